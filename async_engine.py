@@ -0,0 +1,412 @@
+"""
+In-process HTTP attack engine on asyncio, as an alternative to the vegeta binary.
+
+- Targets are read from the same vegeta target files, and every request is serialised once
+  up front; the targets are hit round-robin, as vegeta does. A compiled target corpus is read
+  lazily instead, one request at a time as it is sent (see target_corpus.py).
+- Connections are kept alive and pooled per host, up to max_connections.
+- The scheduler follows an open model: request i is due at start + i / rate, whether earlier
+  requests have returned or not. With a rate shape instead of a rate, each request is due at
+  the time the shape gives it (see rate_shape.py). When the loop falls behind, the overdue requests are sent
+  at once, and every latency is measured from the time the request was due, not from when it
+  was sent, so that a stalled client or server cannot hide its delay (coordinated omission).
+  The time it was sent is kept as well: the rate of the report is that of the real sends, and
+  how late they were shows whether the client kept up with the schedule.
+- The results go into a StreamStats, so a step gives the same report as `vegeta report -type json`.
+"""
+
+import ssl
+import time
+import asyncio
+from vegeta_stream import StreamStats
+from vegeta_targets import Target
+from utils import *
+
+
+###############################################################################
+class HttpClientProtocol(asyncio.Protocol):
+    """
+    One keep-alive HTTP/1.1 connection, with one request in flight at a time. The body of a
+    response is framed by its Content-Length, by its chunks, or else by the end of the connection.
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, loop):
+        self.loop = loop
+        self.transport = None
+        self.buffer = bytearray()
+        self.waiter = None
+        self.head_request = False
+        self.header_end = -1
+        self.body_length = 0
+        self.chunked = False
+        self.until_close = False
+        self.chunk_position = 0                                                 # next chunk size line
+        self.chunk_bytes = 0
+        self.in_trailers = False
+        self.status = 0
+        self.reason = ''
+        self.keep_alive = True
+        self.closed = False
+
+    # --------------------------------------------------------------------------
+    def connection_made(self, transport):
+        self.transport = transport
+
+    # --------------------------------------------------------------------------
+    def connection_lost(self, exc):
+        self.closed = True
+        if self.waiter is None or self.waiter.done():
+            return
+        if exc is None and self.until_close and self.header_end >= 0:
+            self.waiter.set_result((self.status, self.reason, len(self.buffer) - self.header_end))
+        else:
+            self.waiter.set_exception(exc or ConnectionResetError('connection closed by the server'))
+
+    # --------------------------------------------------------------------------
+    def request(self, data: bytes, head_request: bool = False) -> asyncio.Future:
+        """
+        :return: a future of (status code, reason, body bytes)
+        """
+        self.waiter = self.loop.create_future()
+        self.head_request = head_request
+        self.transport.write(data)
+        return self.waiter
+
+    # --------------------------------------------------------------------------
+    def data_received(self, data):
+        self.buffer += data
+        try:
+            self.parse()
+        except ValueError as e:
+            self.transport.close()
+            self.closed = True
+            if self.waiter is not None and not self.waiter.done():
+                self.waiter.set_exception(ValueError('malformed HTTP response: {}'.format(e)))
+
+    # --------------------------------------------------------------------------
+    def parse(self):
+        if self.header_end < 0:
+            header_end = self.buffer.find(b'\r\n\r\n')
+            if header_end < 0:
+                return
+            head = bytes(self.buffer[:header_end]).lower()
+            self.header_end = header_end + 4
+            self.status = int(self.buffer[9:12])
+            line_end = self.buffer.find(b'\r\n')
+            self.reason = self.buffer[13:line_end].decode('latin-1')
+            self.keep_alive = b'\r\nconnection: close' not in head
+            self.body_length = 0
+            self.chunked = self.until_close = False
+            if self.head_request or self.status < 200 or self.status in (204, 304):
+                pass                                                            # never a body
+            elif b'\r\ntransfer-encoding: chunked' in head:
+                self.chunked = True
+                self.chunk_position = self.header_end
+                self.chunk_bytes = 0
+                self.in_trailers = False
+            else:
+                position = head.find(b'\r\ncontent-length:')
+                if position >= 0:
+                    value_end = head.find(b'\r\n', position + 2)
+                    self.body_length = int(head[position + 17:value_end if value_end > 0 else None])
+                else:
+                    self.until_close = True                                     # the body ends with the connection
+                    self.keep_alive = False
+                    return
+
+        if self.until_close:
+            return
+        if self.chunked:
+            response_end = self.chunked_end()
+            if response_end < 0:
+                return
+            body_bytes = self.chunk_bytes
+        else:
+            response_end = self.header_end + self.body_length
+            if len(self.buffer) < response_end:
+                return
+            body_bytes = self.body_length
+
+        del self.buffer[:response_end]
+        self.header_end = -1
+        if not self.keep_alive:
+            self.transport.close()
+            self.closed = True
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result((self.status, self.reason, body_bytes))
+
+    # --------------------------------------------------------------------------
+    def chunked_end(self) -> int:
+        """
+        Walk the chunks that have arrived: size line, data, CRLF, up to the last chunk of size 0
+        and the trailers after it
+        :return: the end of the response in the buffer, -1 while it is incomplete
+        """
+        buffer = self.buffer
+        while True:
+            position = self.chunk_position
+            line_end = buffer.find(b'\r\n', position)
+            if line_end < 0:
+                return -1
+            if self.in_trailers:
+                self.chunk_position = line_end + 2
+                if line_end == position:
+                    return line_end + 2                                         # the empty line after the trailers
+                continue
+            size = int(bytes(buffer[position:line_end]).split(b';', 1)[0], 16)  # without chunk extensions
+            if size == 0:
+                self.in_trailers = True
+                self.chunk_position = line_end + 2
+                continue
+            chunk_end = line_end + 2 + size + 2
+            if len(buffer) < chunk_end:
+                return -1
+            self.chunk_bytes += size
+            self.chunk_position = chunk_end
+
+
+###############################################################################
+class ConnectionPool:
+    """
+    Keep-alive connections to one host. Idle connections are reused last-in first-out, new
+    ones are opened up to max_connections, beyond that a request waits for a free connection.
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, loop, host: str, port: int, secure: bool, max_connections: int):
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl.create_default_context() if secure else None
+        self.max_connections = max_connections
+        self.idle = []
+        self.waiters = []
+        self.count = 0
+
+    # --------------------------------------------------------------------------
+    async def acquire(self) -> HttpClientProtocol:
+        while self.idle:
+            connection = self.idle.pop()
+            if not connection.closed:
+                return connection
+            self.count -= 1
+
+        if self.count >= self.max_connections:
+            waiter = self.loop.create_future()
+            self.waiters.append(waiter)
+            try:
+                connection = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # handed a connection or a slot just as the request timed out: pass it on
+                    if waiter.result() is not None:
+                        self.release(waiter.result())
+                    else:
+                        self.release_slot()
+                raise
+            if connection is not None:
+                return connection
+            # otherwise a free slot has been handed over, and it is counted already
+        else:
+            self.count += 1
+
+        try:
+            _, connection = await self.loop.create_connection(
+                lambda: HttpClientProtocol(self.loop), self.host, self.port, ssl=self.ssl_context)
+        except BaseException:
+            self.release_slot()
+            raise
+        return connection
+
+    # --------------------------------------------------------------------------
+    def wake_one(self, connection) -> bool:
+        while self.waiters:
+            waiter = self.waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(connection)
+                return True
+        return False
+
+    # --------------------------------------------------------------------------
+    def release_slot(self):
+        """
+        A connection is gone; let a waiting request open a new one in its place
+        """
+        if not self.wake_one(None):
+            self.count -= 1
+
+    # --------------------------------------------------------------------------
+    def release(self, connection: HttpClientProtocol):
+        waiter = connection.waiter
+        if connection.closed or waiter is None or not waiter.done() or waiter.cancelled():
+            # closed, or abandoned in the middle of a response - cannot be reused
+            if not connection.closed:
+                connection.transport.close()
+                connection.closed = True
+            self.release_slot()
+            return
+
+        if not self.wake_one(connection):
+            self.idle.append(connection)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        for connection in self.idle:
+            connection.transport.close()
+        self.idle = []
+
+
+###############################################################################
+class AsyncAttackEngine:
+    timeout = 30.0                                                              # vegeta's default, in seconds
+    max_connections = 10000                                                     # per host, vegeta's default
+    abort_check_interval = 0.1                                                  # seconds
+
+    # --------------------------------------------------------------------------
+    def __init__(self, targets: List[Target], max_connections: int = None, timeout: float = None):
+        """
+        :param targets: the targets, or the CorpusRequests of a compiled corpus
+        """
+        if not len(targets):
+            raise Exception(ErrorCode.emptyParameter, "No targets to attack")
+        if hasattr(targets, 'addresses'):
+            self.targets = targets                                              # read while attacking
+            self.addresses = targets.addresses()
+        else:
+            self.targets = [(target.address(), target.request_bytes(), target.method == 'HEAD')
+                            for target in targets]
+            self.addresses = list(dict.fromkeys(address for address, _, _ in self.targets))
+        if max_connections:
+            self.max_connections = max_connections
+        if timeout:
+            self.timeout = timeout
+        self.pools = {}
+
+    # --------------------------------------------------------------------------
+    def attack(self, rate: int, duration: float, stats: StreamStats = None, abort_rule=None,
+               on_tick: Callable[[], bool] = None, phase: float = 0.0, first_target: int = 0,
+               target_stats: List[StreamStats] = None, shape=None,
+               on_start: Callable[[float], None] = None) -> StreamStats:
+        """
+        :param rate: requests/second
+        :param duration: seconds
+        :param stats: where the results go. Default is a new StreamStats
+        :param abort_rule: optional EarlyAbortRule; the attack stops once it trips
+        :param on_tick: optional callback, called every abort_check_interval; the attack stops
+                        once it returns True
+        :param phase: seconds to shift the whole schedule by, to interleave several engines
+        :param first_target: index of the target to start the round-robin with
+        :param target_stats: optional statistics per target, that its results also go to, e.g.
+                             those of its endpoint in a workload profile
+        :param shape: optional RateShape to send along, instead of rate and duration
+        :param on_start: optional callback, called with the POSIX time the schedule starts at
+        :return: the statistics of the attack
+        """
+        stats = stats if stats is not None else StreamStats()
+        asyncio.run(self.run(rate, duration, stats, abort_rule, on_tick, phase, first_target, target_stats,
+                             shape, on_start))
+        return stats
+
+    # --------------------------------------------------------------------------
+    async def run(self, rate: int, duration: float, stats: StreamStats, abort_rule=None,
+                  on_tick: Callable[[], bool] = None, phase: float = 0.0, first_target: int = 0,
+                  target_stats: List[StreamStats] = None, shape=None, on_start: Callable[[float], None] = None):
+        loop = asyncio.get_running_loop()
+        self.pools = {}
+        for address in self.addresses:
+            host, port, secure = address
+            self.pools[address] = ConnectionPool(loop, host, port, secure, self.max_connections)
+
+        if shape is not None:
+            offsets = shape.offsets()
+        else:
+            interval = 1.0 / rate
+            offsets = (i * interval for i in range(int(rate * duration)))
+        in_flight = set()
+        target_count = len(self.targets)
+        start = loop.time() + phase
+        wall_start = time.time() + phase
+        if on_start is not None:
+            on_start(wall_start)
+        next_abort_check = start + self.abort_check_interval
+
+        sent = 0
+        offset = next(offsets, None)
+        while offset is not None:
+            now = loop.time()
+            while offset is not None and start + offset <= now:
+                intended = start + offset
+                index = (first_target + sent) % target_count
+                address, data, head_request = self.targets[index]
+                task = loop.create_task(self.hit(self.pools[address], data, head_request, intended,
+                                                 wall_start - start, stats,
+                                                 target_stats[index] if target_stats is not None else None))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                sent += 1
+                offset = next(offsets, None)
+
+            if now >= next_abort_check:
+                next_abort_check = now + self.abort_check_interval
+                if (abort_rule is not None and abort_rule.check(stats.requests, stats.success)) or \
+                        (on_tick is not None and on_tick()):
+                    for task in in_flight:
+                        task.cancel()
+                    break
+
+            if offset is not None:
+                await asyncio.sleep(min(self.abort_check_interval, max(0.0, start + offset - loop.time())))
+
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        for pool in self.pools.values():
+            pool.close()
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    async def exchange(pool: ConnectionPool, data: bytes, head_request: bool,
+                       held: List[HttpClientProtocol]) -> Tuple[int, str, int]:
+        """
+        Send one request on a connection of the pool
+        :param held: gets the connection, for the caller to release whatever happens
+        :return: status code, reason and body bytes of the response
+        """
+        connection = await pool.acquire()
+        held.append(connection)
+        return await connection.request(data, head_request)
+
+    # --------------------------------------------------------------------------
+    async def hit(self, pool: ConnectionPool, data: bytes, head_request: bool, intended: float,
+                  wall_offset: float, stats: StreamStats, target_stats: StreamStats = None):
+        """
+        :param intended: loop time the request is due at
+        :param wall_offset: POSIX time minus loop time
+        """
+        loop = pool.loop
+        started = loop.time()                                                   # late when the loop falls behind
+        code = 0
+        bytes_in = 0
+        error = None
+        held = []
+        try:
+            # the timeout covers the wait for a connection too, and opening it
+            code, reason, bytes_in = await asyncio.wait_for(self.exchange(pool, data, head_request, held),
+                                                            max(0.0, intended + self.timeout - loop.time()))
+            if code < 200 or code >= 400:
+                error = '{} {}'.format(code, reason)
+        except asyncio.TimeoutError:
+            error = 'timeout awaiting response headers'
+        except (OSError, ValueError) as e:
+            error = str(e) or e.__class__.__name__
+        finally:
+            for connection in held:
+                pool.release(connection)
+
+        # the latency counts from the time the request was due: coordinated omission correction
+        now = loop.time()
+        latency = int((now - intended) * 1e9)
+        stats.record(code, latency, bytes_in, len(data), error, wall_offset + started, now, wall_offset + intended)
+        if target_stats is not None:
+            target_stats.record(code, latency, bytes_in, len(data), error, wall_offset + started, now,
+                                wall_offset + intended)
@@ -0,0 +1,104 @@
+"""
+Benchmark of the in-process async attack engine against the local test server.
+
+Starts testserver.py in a child process, attacks it with the targets of
+test_local_requests.txt at a constant rate, and reports the achieved rate, the success rate,
+the latencies, how late the requests were sent, and how much CPU the engine used. The engine
+sustains the rate when the requests were really sent at the requested rate, close to their
+due times, the attack did not overrun its duration, and its CPU use stays below one core.
+
+    python3 bench_async_engine.py [--rate 5000] [--duration 10]
+"""
+
+import time
+import socket
+import resource
+import argparse
+from urllib.parse import urlsplit, urlunsplit
+from async_engine import AsyncAttackEngine
+from vegeta_targets import read_targets
+from utils import *
+
+
+max_mean_lateness = 0.005                                                       # seconds behind the schedule
+max_overrun = 1.0                                                               # seconds of wall time past the duration
+
+
+###############################################################################
+def local_targets(target_file: str, port: int) -> list:
+    """
+    :return: the targets of the file, with those on this machine sent to port instead
+    """
+    targets = read_targets(target_file)
+    for target in targets:
+        parts = urlsplit(target.url)
+        if parts.hostname in ('localhost', '127.0.0.1') and parts.port != port:
+            target.url = urlunsplit(parts._replace(netloc='{}:{}'.format(parts.hostname, port)))
+    return targets
+
+
+###############################################################################
+def start_test_server(port: int, extra_args: List[str] = None) -> subprocess.Popen:
+    """
+    Start testserver.py in a child process and wait until it accepts connections
+    """
+    server = subprocess.Popen([sys.executable, os.path.join(TestUtils.get_absolute_path(), 'testserver.py'),
+                               '--port', str(port)] + (extra_args or []),
+                              stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise Exception(ErrorCode.executeShellCommand, "The test server did not start on port {}".format(port))
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Benchmark of the async attack engine')
+    args.add_argument('--rate', type=int, dest="rate", default=5000, help="Requests/second. Default is 5000.")
+    args.add_argument('--duration', type=int, dest="duration", default=10, help="Seconds. Default is 10.")
+    args.add_argument('--port', type=int, dest="port", default=5555,
+                      help="Port of the test server. The local targets are sent to it. Default is 5555.")
+    args.add_argument('--target_file', type=str, dest="target_file",
+                      default=os.path.join(TestUtils.get_absolute_path(), 'test_local_requests.txt'))
+    given_args = args.parse_args(argv[1:])
+
+    server = start_test_server(given_args.port)
+    try:
+        engine = AsyncAttackEngine(local_targets(given_args.target_file, given_args.port))
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        wall_before = time.monotonic()
+        stats = engine.attack(given_args.rate, given_args.duration)
+        wall = time.monotonic() - wall_before
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        server.terminate()
+        server.wait()
+
+    entry = stats.report()
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    latencies = entry['latencies']
+    lateness = entry.get('lateness', {'mean': 0, 'max': 0})
+    print('\tRequested rate  : {}/second for {} seconds'.format(given_args.rate, given_args.duration))
+    print('\tAchieved rate   : {:.1f}/second ({} requests)'.format(entry['rate'], entry['requests']))
+    print('\tSuccess         : {:.4f}%'.format(entry['success'] * 100))
+    print('\tLatency mean    : {:.3f}ms'.format(latencies['mean'] / 1e6))
+    print('\tLatency 50/99th : {:.3f}ms / {:.3f}ms'.format(latencies['50th'] / 1e6, latencies['99th'] / 1e6))
+    print('\tLatency 99.9th  : {:.3f}ms'.format(latencies['99.9th'] / 1e6))
+    print('\tSent late       : {:.3f}ms mean, {:.3f}ms max'.format(lateness['mean'] / 1e6, lateness['max'] / 1e6))
+    print('\tEngine CPU      : {:.2f}s in {:.2f}s wall = {:.0f}% of one core'.format(cpu, wall, cpu / wall * 100))
+
+    # the rate of the report is that of the real sends; the schedule alone always looks on time
+    sustained = entry['rate'] >= given_args.rate * 0.99 and entry['success'] > 0.999 and cpu / wall < 1.0 and \
+        lateness['mean'] / 1e9 <= max_mean_lateness and wall <= given_args.duration + max_overrun
+    print('\tSustained       : {}'.format('yes' if sustained else 'no'))
+    return ErrorCode.ok if sustained else ErrorCode.requestRateTooHigh
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,68 @@
+"""
+Scaling benchmark of the multi-core process-pool attack against the local test server.
+
+For every worker count of the sweep, attacks testserver.py at worker count x rate_per_worker
+and reports the achieved rate, the success rate, the tail latency and the CPU the workers used.
+The pool scales as long as the achieved rate keeps up with the requested one; on a box with
+fewer cores than workers, or when the test server itself saturates, it cannot.
+
+    python3 bench_pool_engine.py [--workers 1,2,4] [--rate_per_worker 5000] [--duration 10]
+"""
+
+import time
+import resource
+import argparse
+from pool_engine import ProcessPoolAttack
+from bench_async_engine import start_test_server
+from utils import *
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Scaling benchmark of the process-pool attack')
+    args.add_argument('--workers', type=str, dest="workers", default=None,
+                      help="Comma-separated worker counts. Default is 1, 2, 4 ... up to the number of cores.")
+    args.add_argument('--rate_per_worker', type=int, dest="rate_per_worker", default=5000,
+                      help="Requests/second per worker. Default is 5000.")
+    args.add_argument('--duration', type=int, dest="duration", default=10, help="Seconds. Default is 10.")
+    args.add_argument('--port', type=int, dest="port", default=5555, help="Port of the test server.")
+    args.add_argument('--server_args', type=str, dest="server_args", default='',
+                      help="Extra arguments of testserver.py, e.g. to run it with several processes.")
+    args.add_argument('--target_file', type=str, dest="target_file",
+                      default=os.path.join(TestUtils.get_absolute_path(), 'test_local_requests.txt'))
+    given_args = args.parse_args(argv[1:])
+
+    if given_args.workers:
+        sweep = [int(count) for count in given_args.workers.split(',')]
+    else:
+        sweep = [1]
+        while sweep[-1] * 2 <= (os.cpu_count() or 1):
+            sweep.append(sweep[-1] * 2)
+
+    server = start_test_server(given_args.port, given_args.server_args.split())
+    print('Workers  Requested  Achieved   Success%   99th(ms)   Worker CPU(s)  Scaling')
+    print('=======  =========  =========  =========  =========  =============  =======')
+    base_rate = None
+    try:
+        for workers in sweep:
+            rate = workers * given_args.rate_per_worker
+            usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            stats = ProcessPoolAttack(given_args.target_file, workers).attack(rate, given_args.duration)
+            usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            entry = stats.report()
+            cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+            if base_rate is None:
+                base_rate = entry['rate']
+            print('{0:7d}  {1:9d}  {2:9.1f}  {3:9.4f}  {4:9.3f}  {5:13.2f}  {6:6.2f}x'.format(
+                workers, rate, entry['rate'], entry['success'] * 100, entry['latencies']['99th'] / 1e6,
+                cpu, entry['rate'] / base_rate if base_rate else 0.0))
+            time.sleep(1)
+    finally:
+        server.terminate()
+        server.wait()
+    return ErrorCode.ok
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
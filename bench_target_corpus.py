@@ -0,0 +1,116 @@
+"""
+Benchmark of a compiled target corpus against re-parsing the target file on every step.
+
+Generates a vegeta target file of --targets requests, spread over --paths paths and a few
+distinct JSON bodies, then times --steps steps of preparing every request for sending:
+
+    re-parse  read_targets() and serialise every request, as the async engine does per step
+    corpus    compile the file once, then per step open the memory-mapped corpus and read
+              every request from it in a shuffled order
+
+and prints the time per step, the memory each one needs, and the sizes of the files.
+
+    python3 bench_target_corpus.py [--targets 200000] [--steps 5]
+"""
+
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from target_corpus import TargetCorpus, compile_targets
+from vegeta_targets import read_targets
+from utils import *
+
+
+###############################################################################
+def write_target_file(target_file: str, count: int, paths: int, bodies: int):
+    body_files = []
+    for i in range(bodies):
+        body_file = os.path.join(os.path.dirname(target_file), 'body_{}.json'.format(i))
+        with open(body_file, 'w') as f:
+            json.dump({'account': i, 'items': list(range(50))}, f)
+        body_files.append(body_file)
+
+    with open(target_file, 'w') as f:
+        for i in range(count):
+            if i % 3:
+                f.write('GET http://localhost:5555/test/version?page={}\n'.format(i % paths))
+                f.write('X-Account-ID: {}\n\n'.format(i % 97))
+            else:
+                f.write('POST http://localhost:5555/test/update\n')
+                f.write('Content-Type: application/json\n')
+                f.write('@{}\n\n'.format(body_files[i % bodies]))
+
+
+###############################################################################
+def reparse_step(target_file: str) -> int:
+    requests = [(target.address(), target.request_bytes(), target.method == 'HEAD')
+                for target in read_targets(target_file)]
+    return sum(len(data) for _, data, _ in requests)
+
+
+###############################################################################
+def corpus_step(corpus_file: str) -> int:
+    corpus = TargetCorpus(corpus_file)
+    requests = corpus.requests('shuffle')
+    size = 0
+    for position in range(len(requests)):
+        size += len(requests[position][1])
+    corpus.close()
+    return size
+
+
+###############################################################################
+def measure(step: Callable[[str], int], path: str, steps: int) -> Tuple[float, float, int]:
+    """
+    :return: seconds per step, peak memory of one step in MB, bytes of requests per step
+    """
+    tracemalloc.start()
+    size = step(path)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(steps):
+        step(path)
+    return (time.perf_counter() - started) / steps, peak, size
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Benchmark of compiled target corpora')
+    args.add_argument('--targets', type=int, dest="targets", default=200000, help="Default is 200000.")
+    args.add_argument('--paths', type=int, dest="paths", default=1000, help="Distinct paths. Default is 1000.")
+    args.add_argument('--bodies', type=int, dest="bodies", default=10, help="Distinct bodies. Default is 10.")
+    args.add_argument('--steps', type=int, dest="steps", default=5, help="Steps to time. Default is 5.")
+    given_args = args.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory(prefix='bench_corpus_') as work_dir:
+        target_file = os.path.join(work_dir, 'targets.txt')
+        corpus_file = os.path.join(work_dir, 'targets.vtc')
+        write_target_file(target_file, given_args.targets, given_args.paths, given_args.bodies)
+
+        started = time.perf_counter()
+        compile_targets(target_file, corpus_file)
+        compile_time = time.perf_counter() - started
+
+        reparse_time, reparse_peak, reparse_size = measure(reparse_step, target_file, given_args.steps)
+        corpus_time, corpus_peak, corpus_size = measure(corpus_step, corpus_file, given_args.steps)
+        if reparse_size != corpus_size:
+            raise Exception(ErrorCode.valueOutOfRange, "The corpus does not give the same requests")
+
+        print('\tTargets            : {} ({:.1f}MB of requests per step)'.format(given_args.targets,
+                                                                                  reparse_size / 1e6))
+        print('\tTarget file        : {:.1f}MB, corpus {:.1f}MB, compiled once in {:.2f}s'.format(
+            os.path.getsize(target_file) / 1e6, os.path.getsize(corpus_file) / 1e6, compile_time))
+        print('\tRe-parse per step  : {:.3f}s, peak {:.1f}MB'.format(reparse_time, reparse_peak))
+        print('\tCorpus per step    : {:.3f}s, peak {:.1f}MB'.format(corpus_time, corpus_peak))
+        print('\tOver {} steps       : {:.2f}s re-parsing, {:.2f}s with the corpus including compilation'.format(
+            given_args.steps, reparse_time * given_args.steps, compile_time + corpus_time * given_args.steps))
+    return ErrorCode.ok
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
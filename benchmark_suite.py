@@ -0,0 +1,334 @@
+"""
+Regression benchmark suite: the same named scenarios on every release of a service, compared
+to a baseline.
+
+A suite is a JSON file:
+
+    {
+        "name": "local",
+        "trials": 3,
+        "server": {"capacity": 2000},
+        "args": ["--engine", "async", "--search", "bisection", "--test_time", "2"],
+        "tolerance": {"best_rate": 5, "latency": 10, "search": 20},
+        "scenarios": [
+            {"name": "mixed", "target_file": "test_local_requests.txt", "args": ["--start_rate", "200"]},
+            {"name": "small", "target_file": "test_local_requests.txt", "server": {"capacity": 1000}}
+        ]
+    }
+
+Every scenario runs `loadtest_vegeta.py` on its target file `trials` times, with the arguments
+of the suite followed by its own, and each trial gives the best rate of its search, the
+latency quantiles of the steps at that rate, and the cost of the search in steps and seconds,
+from the results store. A trial whose search found no passing rate has a best rate of 0, and
+no latencies. With a `server` (of the
+suite, updated by the scenario's) testserver.py is started for the scenario with these options,
+e.g. its capacity, as a local stand-in for the service.
+
+The report has the samples of every metric, their mean and 95% confidence interval, and with a
+baseline report the delta of each mean, relative to the baseline, with the 95% confidence
+interval of the difference (Welch). A metric has regressed when its delta is worse than its
+tolerance in percent and the interval of the delta does not include zero, i.e. the change is
+both large enough to matter and not noise. A metric the baseline has samples of and the report
+has none of has regressed as well.
+
+    python3 benchmark_suite.py benchmark_suite.json [--baseline report.json] [--trials 5]
+"""
+
+import json
+import math
+import time
+import sqlite3
+import getpass
+import argparse
+import statistics
+from bench_async_engine import start_test_server
+from latency_histogram import LatencyHistogram
+from results_store import ResultsStore
+from utils import *
+
+
+# two-sided 95% quantiles of Student's t by degrees of freedom
+t_quantiles = [(1, 12.706), (2, 4.303), (3, 3.182), (4, 2.776), (5, 2.571), (6, 2.447), (7, 2.365),
+               (8, 2.306), (9, 2.262), (10, 2.228), (12, 2.179), (15, 2.131), (20, 2.086), (30, 2.042),
+               (60, 2.000), (120, 1.980)]
+
+
+###############################################################################
+def t_quantile(degrees: float) -> float:
+    """
+    :return: the 95% t quantile for these degrees of freedom, rounded towards the wider interval
+    """
+    value = t_quantiles[0][1]
+    for table_degrees, quantile in t_quantiles:
+        if degrees >= table_degrees:
+            value = quantile
+    return value
+
+
+###############################################################################
+def sample_summary(samples: List[float]) -> dict:
+    """
+    :return: mean, standard deviation and 95% confidence interval of the mean
+    """
+    mean = statistics.mean(samples)
+    deviation = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    half = t_quantile(len(samples) - 1) * deviation / math.sqrt(len(samples)) if len(samples) > 1 else 0.0
+    return {'mean': mean, 'stdev': deviation, 'ci': [mean - half, mean + half], 'trials': len(samples)}
+
+
+###############################################################################
+def compare_samples(current: List[float], baseline: List[float]) -> dict:
+    """
+    :return: the difference of the means relative to the baseline in percent, with its 95%
+             confidence interval (Welch's t interval)
+    """
+    mean, base = statistics.mean(current), statistics.mean(baseline)
+    variance = statistics.variance(current) / len(current) if len(current) > 1 else 0.0
+    base_variance = statistics.variance(baseline) / len(baseline) if len(baseline) > 1 else 0.0
+    error = math.sqrt(variance + base_variance)
+    if error > 0:
+        degrees = (variance + base_variance) ** 2 / (
+            (variance ** 2 / (len(current) - 1) if len(current) > 1 else 0.0) +
+            (base_variance ** 2 / (len(baseline) - 1) if len(baseline) > 1 else 0.0))
+        half = t_quantile(degrees) * error
+    else:
+        half = 0.0
+    difference = mean - base
+    if base == 0:
+        return {'baseline': base, 'delta%': 0.0 if difference == 0 else math.inf, 'ci%': [-math.inf, math.inf]}
+    return {'baseline': base,
+            'delta%': difference * 100.0 / base,
+            'ci%': [(difference - half) * 100.0 / base, (difference + half) * 100.0 / base]}
+
+
+###############################################################################
+class BenchmarkSuite:
+    trials = 3
+    tolerance = {'best_rate': 5.0, 'latency': 10.0, 'search': 20.0}             # percent
+    quantiles = [('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99), ('p99.9_ms', 0.999)]
+    port = 5555
+
+    # --------------------------------------------------------------------------
+    def __init__(self, suite_file: str, trials: int = None, store_file: str = None):
+        """
+        :param suite_file: the JSON file of the suite
+        :param trials: runs per scenario, None for the suite's
+        :param store_file: the results store the trials go to. None for the default
+        """
+        self.suite_file = suite_file
+        base_dir = os.path.dirname(os.path.abspath(suite_file))
+        try:
+            with open(suite_file, 'r') as f:
+                suite = json.load(f)
+            self.name = suite.get('name', os.path.splitext(os.path.basename(suite_file))[0])
+            self.trials = trials or int(suite.get('trials', self.trials))
+            self.tolerance = dict(self.tolerance, **suite.get('tolerance', {}))
+            self.scenarios = []
+            for i, item in enumerate(suite['scenarios']):
+                self.scenarios.append({'name': item.get('name', str(i)),
+                                       'target_file': os.path.join(base_dir, item['target_file']),
+                                       'args': [str(arg) for arg in suite.get('args', []) + item.get('args', [])],
+                                       'server': dict(suite.get('server') or {}, **item.get('server', {}))
+                                       if 'server' in suite or 'server' in item else None})
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise Exception(ErrorCode.badParameterType, "Bad benchmark suite {}: {}".format(suite_file, e))
+        if not self.scenarios:
+            raise Exception(ErrorCode.emptyParameter, "The suite {} has no scenarios".format(suite_file))
+        names = [scenario['name'] for scenario in self.scenarios]
+        if len(set(names)) != len(names):
+            raise Exception(ErrorCode.badParameterType, "Scenario names must be unique: {}".format(names))
+        if self.trials <= 0:
+            raise Exception(ErrorCode.valueOutOfRange, "A scenario needs at least one trial")
+        self.store_file = store_file
+
+    # --------------------------------------------------------------------------
+    def run(self) -> dict:
+        """
+        Run every trial of every scenario
+        :return: the report, without deltas
+        """
+        report = {'suite': self.name, 'suite_file': self.suite_file, 'user': getpass.getuser(),
+                  'started': time.time(), 'trials': self.trials, 'tolerance': self.tolerance, 'scenarios': {}}
+        for scenario in self.scenarios:
+            print('\nScenario {}: {} trials of {}'.format(scenario['name'], self.trials, ' '.join(
+                [os.path.basename(scenario['target_file'])] + scenario['args'])))
+            server = None
+            if scenario['server'] is not None:
+                server = self.start_server(scenario['server'])
+            try:
+                trials = [self.run_trial(scenario, trial) for trial in range(1, self.trials + 1)]
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+            samples = {metric: [trial[metric] for trial in trials if trial[metric] is not None]
+                       for metric in ['steps', 'search_s'] + [name for name, _ in self.quantiles]}
+            # a search that found no passing rate leaves no capacity at all
+            samples['best_rate'] = [trial['best_rate'] or 0 for trial in trials]
+            report['scenarios'][scenario['name']] = {
+                'runs': [trial['run_id'] for trial in trials],
+                'samples': samples,
+                'summary': {metric: sample_summary(values) for metric, values in samples.items() if values}}
+        report['finished'] = time.time()
+        return report
+
+    # --------------------------------------------------------------------------
+    def start_server(self, options: dict) -> subprocess.Popen:
+        port = int(options.get('port', self.port))
+        extra_args = []
+        for name, value in options.items():
+            if name != 'port':
+                extra_args += ['--' + name, str(value)]
+        print('\tStand-in server on port {} {}'.format(port, ' '.join(extra_args)))
+        return start_test_server(port, extra_args)
+
+    # --------------------------------------------------------------------------
+    def run_trial(self, scenario: dict, trial: int) -> dict:
+        """
+        Run loadtest_vegeta.py once, and read its result back from the results store
+        :return: the run id, the best rate, the steps and seconds of the search, and the latency
+                 quantiles at the best rate
+        """
+        last_run = self.last_run_id()
+        cmd = [sys.executable, os.path.join(TestUtils.get_absolute_path(), 'loadtest_vegeta.py'),
+               '--target_file', scenario['target_file']] + scenario['args']
+        if self.store_file is not None:
+            cmd += ['--store', self.store_file]
+        started = time.monotonic()
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        run_id = self.last_run_id()
+        if proc.returncode != 0 or run_id == last_run:
+            print('\n'.join(proc.stdout.splitlines()[-20:]))
+            raise Exception(ErrorCode.executeShellCommand, "Trial {} of scenario {} failed: {}".format(
+                trial, scenario['name'], ' '.join(cmd)))
+
+        store = ResultsStore(self.store_file)
+        try:
+            best_rate = store.run_info(run_id)[7]
+            steps, seconds = store.db.execute('SELECT steps, finished - started FROM runs WHERE id = ?',
+                                              (run_id,)).fetchone()
+            histogram = LatencyHistogram.merged(store.step_histograms(run_id, best_rate)) \
+                if best_rate is not None else LatencyHistogram()
+        finally:
+            store.close()
+        result = {'run_id': run_id, 'best_rate': best_rate, 'steps': steps, 'search_s': seconds}
+        values = histogram.quantiles([q for _, q in self.quantiles]) if histogram.total_count else None
+        for i, (name, _) in enumerate(self.quantiles):
+            result[name] = values[i] / 1e6 if values is not None else None
+        print('\tTrial {}: run {}, best rate {}, p99 {} in {:.0f} seconds'.format(
+            trial, run_id, best_rate if best_rate is not None else '-',
+            '{:.3f}ms'.format(result['p99_ms']) if result['p99_ms'] is not None else '-',
+            time.monotonic() - started))
+        return result
+
+    # --------------------------------------------------------------------------
+    def last_run_id(self) -> Optional[int]:
+        store = ResultsStore(self.store_file)
+        try:
+            return store.db.execute('SELECT MAX(id) FROM runs').fetchone()[0]
+        finally:
+            store.close()
+
+    # --------------------------------------------------------------------------
+    def compare(self, report: dict, baseline: dict) -> List[str]:
+        """
+        Add the deltas to the baseline to the report
+        :return: the regressions, as messages
+        """
+        regressions = []
+        for name, scenario in report['scenarios'].items():
+            base_scenario = baseline['scenarios'].get(name)
+            if base_scenario is None:
+                continue
+            scenario['deltas'] = {}
+            for metric, base_samples in base_scenario['samples'].items():
+                samples = scenario['samples'].get(metric)
+                if not base_samples:
+                    continue
+                if not samples:
+                    # e.g. no trial found a passing rate, so there are no latencies at it either
+                    regressions.append('{}: {} has no samples, the baseline has {} with mean {:.3f}'.format(
+                        name, metric, len(base_samples), statistics.mean(base_samples)))
+                    continue
+                delta = compare_samples(samples, base_samples)
+                # the best rate should not go down, latencies and the cost of the search not up
+                sign = -1.0 if metric == 'best_rate' else 1.0
+                tolerance = self.tolerance['best_rate' if metric == 'best_rate' else
+                                           'search' if metric in ('steps', 'search_s') else 'latency']
+                delta['tolerance%'] = tolerance
+                delta['regression'] = delta['delta%'] * sign > tolerance and \
+                    min(value * sign for value in delta['ci%']) > 0
+                scenario['deltas'][metric] = delta
+                if delta['regression']:
+                    regressions.append('{}: {} {:+.1f}% [{:+.1f}%, {:+.1f}%], tolerance {}%'.format(
+                        name, metric, delta['delta%'], delta['ci%'][0], delta['ci%'][1], tolerance))
+        report['baseline'] = {'suite_file': baseline.get('suite_file'), 'started': baseline.get('started')}
+        report['regressions'] = regressions
+        return regressions
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def print_report(report: dict):
+        print('\nScenario        Metric      Mean        95% CI                    Delta     95% CI of Delta      '
+              'Verdict')
+        for name, scenario in report['scenarios'].items():
+            for metric, summary in scenario['summary'].items():
+                line = '{0:<14}  {1:<10}  {2:10.3f}  [{3:10.3f}, {4:10.3f}]'.format(
+                    name, metric, summary['mean'], summary['ci'][0], summary['ci'][1])
+                delta = scenario.get('deltas', {}).get(metric)
+                if delta is not None:
+                    line += '  {0:+7.1f}%  [{1:+7.1f}%, {2:+7.1f}%]  {3}'.format(
+                        delta['delta%'], delta['ci%'][0], delta['ci%'][1],
+                        'REGRESSION' if delta['regression'] else 'ok')
+                print(line)
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Load Testing Tool --- regression benchmark suite')
+    args.add_argument('suite_file', type=str, help="The JSON file of the benchmark suite")
+    args.add_argument('--baseline', type=str, dest="baseline", default=None,
+                      help="A report of an earlier run of the suite to compare with. Optional.")
+    args.add_argument('--trials', type=int, dest="trials", default=None,
+                      help="Runs per scenario. Optional. Default is the suite's, or 3.")
+    args.add_argument('--report', type=str, dest="report_file", default=None,
+                      help="The JSON report to write. Optional. Default is "
+                           "benchmark_<suite>_<user>_<time>.json next to the scripts.")
+    args.add_argument('--store', type=str, dest="store_file", default=None,
+                      help="The results store of the trials. Optional. Default is the default store.")
+    given_args = args.parse_args(argv[1:])
+
+    suite = BenchmarkSuite(given_args.suite_file, given_args.trials, given_args.store_file)
+    baseline = None
+    if given_args.baseline is not None:
+        try:
+            with open(given_args.baseline, 'r') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise Exception(ErrorCode.badParameterType, "Bad baseline report {}: {}".format(given_args.baseline, e))
+
+    try:
+        report = suite.run()
+    except sqlite3.Error as e:
+        raise Exception(ErrorCode.executeShellCommand, "Cannot read the results store: {}".format(e))
+    regressions = suite.compare(report, baseline) if baseline is not None else []
+    suite.print_report(report)
+
+    report_file = given_args.report_file or '{}/benchmark_{}_{}_{}.json'.format(
+        TestUtils.get_absolute_path(), suite.name, getpass.getuser(), time.strftime('%Y_%m_%d_%H_%M_%S'))
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('\nReport: {}'.format(report_file))
+
+    if regressions:
+        print('\nRegressions beyond tolerance:')
+        for message in regressions:
+            print('\t{}'.format(message))
+        return ErrorCode.benchmarkRegression
+    print('\nNo regressions' if baseline is not None else '\nNo baseline to compare with')
+    return ErrorCode.ok
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,252 @@
+"""
+Resources of the load generator itself, so that a step the client could not drive is not
+blamed on the service.
+
+While a step runs, ClientMonitor samples the processes of the load test from /proc: this
+process and all its descendants, which are the vegeta processes, the worker processes of the
+pool engine or the local distributed workers, whichever attacks. Every sample reads
+
+- the CPU time of the processes, with that of their reaped children, as cores busy
+- their resident memory, their open file descriptors and how many of them are sockets
+- the TCP sockets of the host on local ports of the ephemeral range (/proc/net/tcp and tcp6)
+
+At the end of the step, report() puts the peaks next to the requested rate and the rate and
+throughput of the step's report; the rate is that of the real sends, and the async and pool
+engines add how late the sends were behind their schedule. The generator saturated first
+when it did not send at the requested rate or on time, or when it was short of CPU, file
+descriptors or ephemeral ports; such a step tells nothing about the service, and the search
+leaves it out.
+"""
+
+import time
+import resource
+import threading
+from utils import *
+
+
+###############################################################################
+class ProcessTree:
+    """
+    Readings of a process and its descendants from /proc
+    """
+    ticks = os.sysconf('SC_CLK_TCK')
+    page_size = os.sysconf('SC_PAGE_SIZE')
+
+    # --------------------------------------------------------------------------
+    def __init__(self, root: int = None):
+        self.root = root or os.getpid()
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def stat(pid: int) -> Optional[List[str]]:
+        """
+        :return: the fields of /proc/<pid>/stat after the command name, from the state on
+        """
+        try:
+            with open('/proc/{}/stat'.format(pid), 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        return content[content.rfind(b')') + 2:].decode('ascii').split()
+
+    # --------------------------------------------------------------------------
+    def processes(self) -> Dict[int, List[str]]:
+        """
+        :return: the stat fields of the root and of all its descendants, by pid
+        """
+        stats = {}
+        children = {}
+        for name in os.listdir('/proc'):
+            if name.isdigit():
+                fields = self.stat(int(name))
+                if fields is not None:
+                    stats[int(name)] = fields
+                    children.setdefault(int(fields[1]), []).append(int(name))
+        tree = {}
+        pending = [self.root]
+        while pending:
+            pid = pending.pop()
+            if pid in stats and pid not in tree:
+                tree[pid] = stats[pid]
+                pending += children.get(pid, [])
+        return tree
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def descriptors(pid: int) -> Tuple[int, int]:
+        """
+        :return: the open file descriptors of a process, and how many of them are sockets
+        """
+        fd_dir = '/proc/{}/fd'.format(pid)
+        try:
+            names = os.listdir(fd_dir)
+        except OSError:
+            return 0, 0
+        sockets = 0
+        for name in names:
+            try:
+                if os.readlink(os.path.join(fd_dir, name)).startswith('socket:'):
+                    sockets += 1
+            except OSError:
+                pass
+        return len(names), sockets
+
+    # --------------------------------------------------------------------------
+    def sample(self) -> dict:
+        """
+        :return: the CPU seconds so far, the resident memory, the most file descriptors of one
+                 process, and the sockets of all the processes
+        """
+        cpu = 0
+        rss = 0
+        most_fds = 0
+        sockets = 0
+        for pid, fields in self.processes().items():
+            # utime, stime, cutime, cstime: a reaped child's time moves to its parent's
+            cpu += sum(int(value) for value in fields[11:15])
+            rss += int(fields[21])
+            fds, fd_sockets = self.descriptors(pid)
+            most_fds = max(most_fds, fds)
+            sockets += fd_sockets
+        return {'cpu': cpu / self.ticks, 'rss': rss * self.page_size, 'fds': most_fds, 'sockets': sockets}
+
+
+###############################################################################
+def ephemeral_range() -> Tuple[int, int]:
+    try:
+        with open('/proc/sys/net/ipv4/ip_local_port_range', 'r') as f:
+            low, high = f.read().split()
+        return int(low), int(high)
+    except (OSError, ValueError):
+        return 32768, 60999
+
+
+###############################################################################
+def ephemeral_ports_in_use(low: int, high: int) -> int:
+    """
+    :return: the TCP sockets of the host, in any state but listening, on a local port of the
+             ephemeral range
+    """
+    count = 0
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table, 'r') as f:
+                next(f)
+                for line in f:
+                    fields = line.split(None, 4)
+                    port = int(fields[1].rsplit(':', 1)[1], 16)
+                    if low <= port <= high and fields[3] != '0A':
+                        count += 1
+        except (OSError, StopIteration):
+            pass
+    return count
+
+
+###############################################################################
+class ClientMonitor:
+    interval = 0.5                                                              # seconds between samples
+    rate_tolerance = 0.95                                                       # of the requested rate
+    lateness_limit = 50.0                                                       # ms, mean of the sends behind schedule
+    cpu_limit = 0.9                                                             # of the cores
+    fd_limit = 0.9                                                              # of RLIMIT_NOFILE
+    port_limit = 0.9                                                            # of the ephemeral range
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+        self.tree = ProcessTree()
+        self.cores = len(os.sched_getaffinity(0))
+        self.max_fds = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        self.port_range = ephemeral_range()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.first = self.last = None
+        self.peaks = {}
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def available() -> bool:
+        return os.path.exists('/proc/self/stat') and hasattr(os, 'sched_getaffinity')
+
+    # --------------------------------------------------------------------------
+    def begin(self):
+        """
+        Start sampling, at the beginning of a step
+        """
+        self.stopped.clear()
+        self.peaks = {'cpu_cores': 0.0, 'rss': 0, 'fds': 0, 'sockets': 0, 'ports': 0}
+        self.first = self.last = None
+        self.record()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # --------------------------------------------------------------------------
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.record()
+
+    # --------------------------------------------------------------------------
+    def record(self):
+        now = time.monotonic()
+        sample = self.tree.sample()
+        sample['ports'] = ephemeral_ports_in_use(*self.port_range)
+        if self.last is not None and now > self.last[0]:
+            self.peaks['cpu_cores'] = max(self.peaks['cpu_cores'], (sample['cpu'] - self.last[1]['cpu']) /
+                                          (now - self.last[0]))
+        for name in ('rss', 'fds', 'sockets', 'ports'):
+            self.peaks[name] = max(self.peaks[name], sample[name])
+        self.last = (now, sample)
+        if self.first is None:
+            self.first = self.last
+
+    # --------------------------------------------------------------------------
+    def end(self):
+        """
+        Stop sampling, at the end of a step
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.record()
+
+    # --------------------------------------------------------------------------
+    def report(self, entry: dict, requested_rate: int) -> dict:
+        """
+        :param entry: the report of the step
+        :return: the client resources of the step, and why the generator saturated, if it did
+        """
+        seconds = self.last[0] - self.first[0]
+        report = {'cpu_cores': (self.last[1]['cpu'] - self.first[1]['cpu']) / seconds if seconds > 0 else 0.0,
+                  'cpu_peak': self.peaks['cpu_cores'],
+                  'cores': self.cores,
+                  'rss_mb': self.peaks['rss'] / 1048576,
+                  'fds': self.peaks['fds'],
+                  'fd_limit': self.max_fds,
+                  'sockets': self.peaks['sockets'],
+                  'ports': self.peaks['ports'],
+                  'port_range': self.port_range[1] - self.port_range[0] + 1,
+                  'requested_rate': requested_rate,
+                  'rate': entry.get('rate', 0.0),
+                  'lateness_ms': entry.get('lateness', {}).get('mean', 0) / 1e6,
+                  'throughput': entry.get('throughput', 0.0)}
+        report['saturated'] = self.saturation(report)
+        return report
+
+    # --------------------------------------------------------------------------
+    def saturation(self, report: dict) -> List[str]:
+        """
+        :return: the limits of the client the step ran into, as messages; none if it did not
+        """
+        reasons = []
+        if report['requested_rate'] and report['rate'] < report['requested_rate'] * self.rate_tolerance:
+            reasons.append('rate {:.1f}/s of {}/s requested'.format(report['rate'], report['requested_rate']))
+        if report['lateness_ms'] >= self.lateness_limit:
+            reasons.append('late {:.1f}ms behind the schedule on average'.format(report['lateness_ms']))
+        if report['cpu_cores'] >= report['cores'] * self.cpu_limit:
+            reasons.append('cpu {:.2f} of {} cores'.format(report['cpu_cores'], report['cores']))
+        if report['fds'] >= report['fd_limit'] * self.fd_limit:
+            reasons.append('fds {} of {}'.format(report['fds'], report['fd_limit']))
+        if report['ports'] >= report['port_range'] * self.port_limit:
+            reasons.append('ports {} of {}'.format(report['ports'], report['port_range']))
+        return reasons
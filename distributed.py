@@ -0,0 +1,235 @@
+"""
+Distributed attack: one request rate fanned out across several vegeta workers.
+
+The coordinator splits the rate across the workers, launches all of them, and releases them
+at the same moment: every worker is started as `sh -c 'read go; exec vegeta attack ...'` and
+blocks on its stdin until the coordinator writes the go line to all of them. The binary
+results of every worker are collected into local files, and `vegeta report <file> <file> ...`
+merges them into the one entry a load step expects.
+
+How a worker is launched is up to its transport:
+- LocalTransport runs vegeta on this machine, pinned to one core with taskset where available
+- SSHTransport runs vegeta on a remote host, its binary results come back over the SSH stdout
+"""
+
+import abc
+import shlex
+import shutil
+import tempfile
+import threading
+from step_result import report_result_files
+from utils import *
+
+
+###############################################################################
+class WorkerTransport(abc.ABC):
+    """
+    How to get the target file to a worker, and how to launch a command there
+    """
+
+    # --------------------------------------------------------------------------
+    def prepare(self, target_file: str) -> str:
+        """
+        :return: the path of the target file as the worker sees it
+        """
+        return target_file
+
+    # --------------------------------------------------------------------------
+    @abc.abstractmethod
+    def launch_args(self, command: str) -> List[str]:
+        """
+        :param command: shell command to run on the worker
+        :return: the argument list for subprocess.Popen on this machine
+        """
+
+    # --------------------------------------------------------------------------
+    def __str__(self):
+        return self.__class__.__name__
+
+
+###############################################################################
+class LocalTransport(WorkerTransport):
+
+    # --------------------------------------------------------------------------
+    def __init__(self, core: int = None):
+        """
+        :param core: CPU core to pin the worker to. None to let the OS schedule it
+        """
+        self.core = core
+
+    # --------------------------------------------------------------------------
+    def launch_args(self, command):
+        args = ['sh', '-c', command]
+        if self.core is not None and shutil.which('taskset'):
+            args = ['taskset', '-c', str(self.core)] + args
+        return args
+
+    # --------------------------------------------------------------------------
+    def __str__(self):
+        return 'local' if self.core is None else 'local:cpu{}'.format(self.core)
+
+
+###############################################################################
+class SSHTransport(WorkerTransport):
+    ssh_options = ['-T', '-o', 'BatchMode=yes']
+
+    # --------------------------------------------------------------------------
+    def __init__(self, host: str, remote_dir: str = '/tmp'):
+        """
+        :param host: [user@]host of the worker. vegeta must be on its ${PATH}
+        :param remote_dir: where the target file is copied to
+        """
+        self.host = host
+        self.remote_dir = remote_dir
+
+    # --------------------------------------------------------------------------
+    def prepare(self, target_file):
+        # an argument list, so that a local path may have spaces; the remote one has none, it would
+        # need quoting for the remote shell of older scp versions but not for newer ones
+        remote_file = '{}/{}'.format(self.remote_dir, '_'.join(os.path.basename(target_file).split()))
+        proc = subprocess.run(['scp', '-q', '-o', 'BatchMode=yes', target_file,
+                               '{}:{}'.format(self.host, remote_file)],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise Exception(ErrorCode.executeShellCommand, "Cannot copy {} to {}: {}".format(
+                target_file, self.host, proc.stderr.decode('utf-8', 'replace').strip()))
+        return remote_file
+
+    # --------------------------------------------------------------------------
+    def launch_args(self, command):
+        return ['ssh'] + self.ssh_options + [self.host, 'sh -c {}'.format(shlex.quote(command))]
+
+    # --------------------------------------------------------------------------
+    def __str__(self):
+        return 'ssh:{}'.format(self.host)
+
+
+###############################################################################
+class DistributedAttack:
+    go_signal = b'go\n'
+
+    # --------------------------------------------------------------------------
+    def __init__(self, transports: List[WorkerTransport], target_file: str, exact_histogram: bool = False):
+        """
+        :param exact_histogram: decode every result of the workers, see report_result_files()
+        """
+        if not transports:
+            raise Exception(ErrorCode.emptyParameter, "No workers for the distributed attack")
+        self.transports = transports
+        self.target_file = target_file
+        self.exact_histogram = exact_histogram
+        self.worker_targets = None
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def local_workers(count: int) -> List[WorkerTransport]:
+        """
+        :return: count local workers, pinned round-robin to the cores of this machine
+        """
+        cores = os.cpu_count() or 1
+        return [LocalTransport(i % cores) for i in range(count)]
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def split_rate(rate: int, workers: int) -> List[int]:
+        """
+        :return: the per-worker rates; they add up to rate exactly
+        """
+        share, remainder = divmod(rate, workers)
+        return [share + (1 if i < remainder else 0) for i in range(workers)]
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def drain(stream) -> Callable[[], bytes]:
+        """
+        Read a pipe to its end in a thread, so that a chatty worker never blocks on a full pipe
+        :return: a function that waits for the end of the pipe, and returns all that was read
+        """
+        chunks = []
+        thread = threading.Thread(target=lambda: chunks.append(stream.read()), daemon=True)
+        thread.start()
+
+        def read_all() -> bytes:
+            thread.join()
+            return chunks[0] if chunks else b''
+        return read_all
+
+    # --------------------------------------------------------------------------
+    def prepare(self):
+        self.worker_targets = [transport.prepare(self.target_file) for transport in self.transports]
+
+    # --------------------------------------------------------------------------
+    def attack(self, rate: int, duration: int) -> Any:
+        """
+        :return: return code, and the merged vegeta json report of all workers
+        """
+        if self.worker_targets is None:
+            self.prepare()
+
+        rates = self.split_rate(rate, len(self.transports))
+        workers = []
+        with tempfile.TemporaryDirectory(prefix='vegeta_workers_') as result_dir:
+            for i, (transport, worker_rate) in enumerate(zip(self.transports, rates)):
+                if worker_rate == 0:
+                    continue
+                command = 'read go; exec vegeta attack -rate={} -duration={}s -targets={}'.format(
+                    worker_rate, duration, shlex.quote(self.worker_targets[i]))
+                result_file = os.path.join(result_dir, 'worker_{}.bin'.format(i))
+                with open(result_file, 'wb') as out:
+                    proc = subprocess.Popen(transport.launch_args(command), stdin=subprocess.PIPE,
+                                            stdout=out, stderr=subprocess.PIPE)
+                workers.append((transport, result_file, proc, self.drain(proc.stderr)))
+                print('\t\tworker {} ({}): {} requests/second'.format(i, transport, worker_rate))
+
+            # every worker is blocked on its stdin now - release all of them at once
+            try:
+                for _, _, proc, _ in workers:
+                    proc.stdin.write(self.go_signal)
+                    proc.stdin.flush()
+                for _, _, proc, _ in workers:
+                    proc.stdin.close()
+            except BrokenPipeError:
+                # a worker is gone already, e.g. ssh could not log in; the others must not wait for ever
+                self.stop_workers(workers)
+                return ErrorCode.executeShellCommand, None
+
+            failed_workers = 0
+            for transport, _, proc, stderr in workers:
+                out_err = stderr()
+                if proc.wait() != 0:
+                    print('\t\tworker {} failed: {}'.format(transport, out_err.decode('utf-8', 'replace')))
+                    failed_workers += 1
+
+            result_files = [result_file for _, result_file, _, _ in workers
+                            if os.path.getsize(result_file) > 0]
+            if not result_files:
+                return ErrorCode.executeShellCommand, None
+
+            merged_ret, entry = report_result_files(result_files, self.exact_histogram)
+            if merged_ret != 0:
+                return merged_ret, None
+
+        entry['workers'] = len(workers)
+        if failed_workers:
+            entry['failed_workers'] = failed_workers
+        return ErrorCode.ok, entry
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def stop_workers(workers: list):
+        """
+        Terminate the workers that still wait for the go line, and tell why the others exited
+        """
+        for transport, _, proc, stderr in workers:
+            if proc.poll() is None:
+                proc.terminate()
+            else:
+                print('\t\tworker {} exited with {} before the start: {}'.format(
+                    transport, proc.returncode, stderr().decode('utf-8', 'replace').strip()))
+        for _, _, proc, stderr in workers:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass                                                            # the go line it did not read
+            proc.wait()
+            stderr()
@@ -10,5 +10,8 @@ class ErrorCode:
     toolNotInstalled = 122
     toolNotProperlyInstalled = 125
     executeShellCommand = 130
+    badVegetaReport = 135
     requestRateTooHigh = 500
+    searchConverged = 510
+    benchmarkRegression = 520
     processAbnormalExit = 1000
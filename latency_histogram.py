@@ -0,0 +1,291 @@
+"""
+Log-bucketed latency histogram with bounded memory.
+
+Values are recorded in nanoseconds (vegeta's unit). Buckets follow the HDR layout: every
+power-of-two range is split into a fixed number of linear sub-buckets, so the relative
+error of any reported value stays below 1% no matter how many samples are recorded.
+
+Histograms with the same layout can be merged - across steps, workers or repeated runs - and
+any quantile of the merged data can be queried. encode() packs a histogram into a few
+kilobytes at most for the results store. Histograms can also be built from vegeta's `-type hist` report,
+at the resolution of its buckets.
+"""
+
+import re
+import zlib
+import base64
+import struct
+from array import array
+from utils import *
+
+# Go duration units, as vegeta prints them, in nanoseconds
+go_duration_units = {'ns': 1, 'us': 1000, '\u00b5s': 1000, '\u03bcs': 1000, 'ms': 1000000,
+                     's': 1000000000, 'm': 60000000000, 'h': 3600000000000}
+go_duration_part = re.compile(r'([0-9.]+)(ns|us|\u00b5s|\u03bcs|ms|s|m|h)')
+
+
+###############################################################################
+def parse_go_duration(value: str) -> int:
+    """
+    :param value: a Go duration string, e.g. 1.5ms or 2m0.5s
+    :return: the duration in nanoseconds
+    """
+    value = value.strip()
+    if value in ('0', '0s'):
+        return 0
+    parts = go_duration_part.findall(value)
+    if not parts:
+        raise Exception(ErrorCode.badParameterType, "Not a duration: {}".format(value))
+    return int(sum(float(number) * go_duration_units[unit] for number, unit in parts))
+
+
+###############################################################################
+class LatencyHistogram:
+    sub_bucket_bits = 8                                                         # 2 significant digits
+    max_value_bits = 40                                                         # ~1099 seconds in ns
+    header = struct.Struct('<4sBBQQQQ')
+    magic = b'LHG1'
+
+    # bucket bounds for `vegeta report -type=hist[...]`: 0, then 5% apart from 50us up to 64 seconds
+    vegeta_hist_bounds = ['0'] + ['{}ns'.format(round(50000 * 1.05 ** i)) for i in range(289)]
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+        self.half_count = 1 << (self.sub_bucket_bits - 1)
+        bucket_count = self.max_value_bits - self.sub_bucket_bits + 1
+        self.max_value = (1 << self.max_value_bits) - 1
+        self.counts = array('Q', bytes(8 * (bucket_count + 1) * self.half_count))
+        self.total_count = 0
+        self.total_value = 0
+        self.min_value = 0
+        self.max_recorded = 0
+
+    # --------------------------------------------------------------------------
+    def index_of(self, value: int) -> int:
+        bucket = value.bit_length() - self.sub_bucket_bits
+        if bucket < 0:
+            bucket = 0
+        return (bucket * self.half_count) + (value >> bucket)
+
+    # --------------------------------------------------------------------------
+    def value_at_index(self, index: int) -> int:
+        """
+        :return: the midpoint of the value range covered by the bucket at index
+        """
+        bucket = (index - self.half_count) // self.half_count
+        if bucket < 0:
+            bucket = 0
+        sub_bucket = index - bucket * self.half_count
+        return (sub_bucket << bucket) + ((1 << bucket) >> 1)
+
+    # --------------------------------------------------------------------------
+    def record(self, value: int, count: int = 1):
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+
+        self.counts[self.index_of(value)] += count
+        if self.total_count == 0 or value < self.min_value:
+            self.min_value = value
+        if value > self.max_recorded:
+            self.max_recorded = value
+        self.total_count += count
+        self.total_value += value * count
+
+    # --------------------------------------------------------------------------
+    def reset(self):
+        self.counts = array('Q', bytes(8 * len(self.counts)))
+        self.total_count = 0
+        self.total_value = 0
+        self.min_value = 0
+        self.max_recorded = 0
+
+    # --------------------------------------------------------------------------
+    def mean(self) -> int:
+        return int(self.total_value / self.total_count) if self.total_count else 0
+
+    # --------------------------------------------------------------------------
+    def quantile(self, q: float) -> int:
+        """
+        :param q: the quantile in [0, 1], e.g. 0.99 for the 99th percentile
+        :return: the latency in nanoseconds at the quantile, 0 if nothing is recorded
+        """
+        if self.total_count == 0:
+            return 0
+        if q <= 0.0:
+            return self.min_value
+        if q >= 1.0:
+            return self.max_recorded
+
+        wanted = q * self.total_count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count == 0:
+                continue
+            seen += count
+            if seen >= wanted:
+                return min(max(self.value_at_index(index), self.min_value), self.max_recorded)
+        return self.max_recorded
+
+    # --------------------------------------------------------------------------
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        """
+        Add all the values recorded in other to this histogram
+        :return: self
+        """
+        if other.total_count == 0:
+            return self
+        if len(other.counts) != len(self.counts):
+            raise Exception(ErrorCode.badParameterType, "Histograms have different layouts")
+
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        if self.total_count == 0 or other.min_value < self.min_value:
+            self.min_value = other.min_value
+        if other.max_recorded > self.max_recorded:
+            self.max_recorded = other.max_recorded
+        self.total_count += other.total_count
+        self.total_value += other.total_value
+        return self
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def merged(cls, histograms: Iterable['LatencyHistogram']) -> 'LatencyHistogram':
+        result = cls()
+        for histogram in histograms:
+            result.merge(histogram)
+        return result
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def difference(cls, counts: array, earlier_counts: array) -> 'LatencyHistogram':
+        """
+        :param counts: a copy of the counts of a histogram
+        :param earlier_counts: an earlier copy of the counts of the same histogram
+        :return: the histogram of what was recorded in between, e.g. in a window of time. Its
+                 minimum and maximum are the values of its outermost buckets
+        """
+        histogram = cls()
+        histogram.counts = array('Q', (new - old for new, old in zip(counts, earlier_counts)))
+        used = [index for index, count in enumerate(histogram.counts) if count]
+        if used:
+            histogram.total_count = sum(histogram.counts[index] for index in used)
+            histogram.total_value = sum(histogram.counts[index] * histogram.value_at_index(index) for index in used)
+            histogram.min_value = histogram.value_at_index(used[0])
+            histogram.max_recorded = histogram.value_at_index(used[-1])
+        return histogram
+
+    # --------------------------------------------------------------------------
+    def quantiles(self, qs: Iterable[float]) -> List[int]:
+        """
+        Several quantiles in one pass over the buckets
+        :param qs: the quantiles in ascending order
+        """
+        qs = list(qs)
+        if self.total_count == 0:
+            return [0] * len(qs)
+
+        values = []
+        wanted_index = 0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count == 0:
+                continue
+            seen += count
+            while wanted_index < len(qs) and seen >= qs[wanted_index] * self.total_count:
+                q = qs[wanted_index]
+                if q <= 0.0:
+                    values.append(self.min_value)
+                elif q >= 1.0:
+                    values.append(self.max_recorded)
+                else:
+                    values.append(min(max(self.value_at_index(index), self.min_value), self.max_recorded))
+                wanted_index += 1
+            if wanted_index == len(qs):
+                break
+        values.extend([self.max_recorded] * (len(qs) - len(values)))
+        return values
+
+    # --------------------------------------------------------------------------
+    def encode(self) -> bytes:
+        """
+        :return: the histogram in a compact binary form, see decode()
+        """
+        counts = self.counts
+        if sys.byteorder != 'little':
+            counts = array('Q', counts)
+            counts.byteswap()
+        return self.header.pack(self.magic, self.sub_bucket_bits, self.max_value_bits,
+                                self.total_count, self.total_value, self.min_value,
+                                self.max_recorded) + zlib.compress(counts.tobytes())
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def decode(cls, data: bytes) -> 'LatencyHistogram':
+        magic, sub_bucket_bits, max_value_bits, total_count, total_value, min_value, max_recorded = \
+            cls.header.unpack_from(data)
+        if magic != cls.magic or sub_bucket_bits != cls.sub_bucket_bits or \
+                max_value_bits != cls.max_value_bits:
+            raise Exception(ErrorCode.badParameterType, "Not an encoded latency histogram")
+
+        histogram = cls()
+        counts = array('Q', zlib.decompress(data[cls.header.size:]))
+        if sys.byteorder != 'little':
+            counts.byteswap()
+        histogram.counts = counts
+        histogram.total_count = total_count
+        histogram.total_value = total_value
+        histogram.min_value = min_value
+        histogram.max_recorded = max_recorded
+        return histogram
+
+    # --------------------------------------------------------------------------
+    def to_text(self) -> str:
+        """
+        :return: encode() as base64 text, to embed the histogram in a json report
+        """
+        return base64.b64encode(self.encode()).decode('ascii')
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_text(cls, text: str) -> 'LatencyHistogram':
+        return cls.decode(base64.b64decode(text))
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def vegeta_hist_type(cls) -> str:
+        """
+        :return: the -type argument of `vegeta report` for a histogram that from_vegeta_hist() reads
+        """
+        return "'hist[{}]'".format(','.join(cls.vegeta_hist_bounds))
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_vegeta_hist(cls, lines: Iterable[str]) -> 'LatencyHistogram':
+        """
+        :param lines: the output of `vegeta report -type=hist[...]`, e.g.
+                        Bucket           #     %       Histogram
+                        [0s,     1ms]    123   12.30%  #########
+        :return: a histogram with the count of each vegeta bucket at its midpoint
+        """
+        histogram = cls()
+        for line in lines:
+            line = line.strip()
+            if not line.startswith('['):
+                continue
+            bounds, _, rest = line[1:].partition(']')
+            low, _, high = bounds.partition(',')
+            fields = rest.split()
+            if not fields:
+                continue
+            count = int(fields[0])
+            if count == 0:
+                continue
+            low = parse_go_duration(low)
+            high = high.strip()
+            value = low if high.lower() in ('+inf', 'inf') else (low + parse_go_duration(high)) // 2
+            histogram.record(value, count)
+        return histogram
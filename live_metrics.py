@@ -0,0 +1,259 @@
+"""
+Live telemetry of a capacity search while it runs.
+
+LiveMetrics publishes the current step, its target rate and progress, and the achieved rate,
+success rate and p50/p99 latencies of the last 10 seconds, as a Prometheus text endpoint:
+
+    http://localhost:<port>/metrics
+
+The step runners only keep their StreamStats up to date, as they do anyway. Once a second a
+background thread copies the cumulative totals and latency histogram of the step, and works
+out the rolling figures from the difference to the copy of 10 seconds before, so that
+nothing is added to the path that ingests the results.
+
+The same module is a curses dashboard of such an endpoint, e.g. in a second terminal:
+
+    python3 live_metrics.py [--url http://localhost:9100/metrics]
+"""
+
+import time
+import argparse
+import threading
+import urllib.request
+from array import array
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from latency_histogram import LatencyHistogram
+from utils import *
+
+
+###############################################################################
+class LiveMetrics:
+    interval = 1.0                                                              # seconds between publications
+    window_seconds = 10
+    metrics = [('loadtest_step', 'gauge', 'Number of the current step'),
+               ('loadtest_attacking', 'gauge', '1 while a step runs, 0 while resting'),
+               ('loadtest_target_rate', 'gauge', 'Requested rate of the current step, requests/second'),
+               ('loadtest_step_elapsed_seconds', 'gauge', 'Seconds since the current step started'),
+               ('loadtest_step_duration_seconds', 'gauge', 'Planned seconds of the current step'),
+               ('loadtest_step_requests', 'gauge', 'Results of the current step so far'),
+               ('loadtest_step_success', 'gauge', 'Successful results of the current step so far'),
+               ('loadtest_current_rate', 'gauge', 'Results per second over the last second'),
+               ('loadtest_rolling_success_ratio', 'gauge', 'Success ratio of the last 10 seconds'),
+               ('loadtest_rolling_latency_seconds', 'summary', 'Latency quantiles of the last 10 seconds'),
+               ('loadtest_steps_completed_total', 'counter', 'Steps completed in this run'),
+               ('loadtest_best_rate', 'gauge', 'Highest passing rate so far, requests/second')]
+
+    # --------------------------------------------------------------------------
+    def __init__(self, port: int, host: str = '127.0.0.1'):
+        """
+        :param port: port of the /metrics endpoint. 0 to pick a free one
+        :param host: address to listen on. Default is the local host only
+        """
+        self.values = {name: 0 for name, _, _ in self.metrics}
+        self.values['loadtest_best_rate'] = None
+        self.values['loadtest_rolling_latency_seconds'] = {'0.5': 0.0, '0.99': 0.0}
+        self.source = None
+        self.history = deque(maxlen=self.window_seconds + 1)
+        self.step_started = None
+        self.text = self.render().encode('utf-8')
+
+        live = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                text = live.text
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.stopped = threading.Event()
+        self.threads = [threading.Thread(target=self.server.serve_forever, daemon=True),
+                        threading.Thread(target=self.run, daemon=True)]
+
+    # --------------------------------------------------------------------------
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        print('\nLive metrics on http://{}:{}/metrics'.format(self.server.server_address[0], self.port))
+
+    # --------------------------------------------------------------------------
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --------------------------------------------------------------------------
+    def begin_step(self, step: int, rate: int, duration: float):
+        self.source = None
+        self.history.clear()
+        self.step_started = time.monotonic()
+        self.values.update({'loadtest_step': step, 'loadtest_attacking': 1, 'loadtest_target_rate': rate,
+                            'loadtest_step_duration_seconds': duration, 'loadtest_step_elapsed_seconds': 0,
+                            'loadtest_step_requests': 0, 'loadtest_step_success': 0})
+
+    # --------------------------------------------------------------------------
+    def watch(self, source: Callable[[], object]):
+        """
+        :param source: returns the StreamStats of the running step, or None while there are none
+        """
+        self.source = source
+
+    # --------------------------------------------------------------------------
+    def end_step(self, entry: dict, best_rate: int):
+        self.publish()
+        self.source = None
+        self.step_started = None
+        self.values['loadtest_attacking'] = 0
+        self.values['loadtest_current_rate'] = 0
+        if entry is not None:
+            self.values['loadtest_step_requests'] = entry['requests']
+            self.values['loadtest_step_success'] = int(round(entry['requests'] * entry['success']))
+            self.values['loadtest_steps_completed_total'] += 1
+        self.values['loadtest_best_rate'] = best_rate
+        self.text = self.render().encode('utf-8')
+
+    # --------------------------------------------------------------------------
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.publish()
+            except (RuntimeError, ValueError):
+                pass                                                            # the step ended under us; next time
+
+    # --------------------------------------------------------------------------
+    def publish(self):
+        """
+        Take a copy of the step's totals and republish the metrics
+        """
+        values = self.values
+        if self.step_started is not None:
+            values['loadtest_step_elapsed_seconds'] = round(time.monotonic() - self.step_started, 3)
+
+        source = self.source
+        stats = source() if source is not None else None
+        if stats is not None:
+            now = time.monotonic()
+            self.history.append((now, stats.requests, stats.success, array('Q', stats.latencies.counts)))
+            values['loadtest_step_requests'] = stats.requests
+            values['loadtest_step_success'] = stats.success
+
+            if len(self.history) > 1:
+                last = self.history[-2]
+                values['loadtest_current_rate'] = round((stats.requests - last[1]) / (now - last[0]), 1)
+                first = self.history[0]
+                requests = stats.requests - first[1]
+                values['loadtest_rolling_success_ratio'] = (stats.success - first[2]) / requests \
+                    if requests else 1.0
+
+                window = LatencyHistogram.difference(self.history[-1][3], first[3])
+                p50, p99 = window.quantiles([0.5, 0.99])
+                values['loadtest_rolling_latency_seconds'] = {'0.5': p50 / 1e9, '0.99': p99 / 1e9}
+
+        self.text = self.render().encode('utf-8')
+
+    # --------------------------------------------------------------------------
+    def render(self) -> str:
+        """
+        :return: the metrics in the Prometheus text format. A metric without a value has no sample
+        """
+        lines = []
+        for name, kind, description in self.metrics:
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            value = self.values[name]
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                for quantile, quantile_value in value.items():
+                    lines.append('{}{{quantile="{}"}} {}'.format(name, quantile, quantile_value))
+            else:
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+###############################################################################
+def parse_metrics(text: str) -> dict:
+    """
+    :return: {metric name or name{labels}: value} of a Prometheus text page
+    """
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name, _, value = line.rpartition(' ')
+        values[name] = float(value)
+    return values
+
+
+###############################################################################
+def dashboard(screen, url: str, interval: float):
+    import curses
+    curses.curs_set(0)
+    screen.nodelay(True)
+    while screen.getch() not in (ord('q'), 27):
+        screen.erase()
+        screen.addstr(0, 0, 'Load test live view - {}   (q to quit)'.format(url))
+        try:
+            with urllib.request.urlopen(url, timeout=interval) as response:
+                values = parse_metrics(response.read().decode('utf-8'))
+        except OSError as e:
+            screen.addstr(2, 0, 'Cannot read the metrics: {}'.format(e))
+            screen.refresh()
+            time.sleep(interval)
+            continue
+
+        duration = values.get('loadtest_step_duration_seconds', 0)
+        elapsed = values.get('loadtest_step_elapsed_seconds', 0)
+        progress = min(1.0, elapsed / duration) if duration else 0.0
+        rows = [('Step', '{:.0f} ({})'.format(values.get('loadtest_step', 0),
+                                             'attacking' if values.get('loadtest_attacking') else 'resting')),
+                ('Progress', '[{:<30}] {:.0f}/{:.0f}s'.format('#' * int(progress * 30), elapsed, duration)),
+                ('Target rate', '{:.0f}/s'.format(values.get('loadtest_target_rate', 0))),
+                ('Current rate', '{:.1f}/s'.format(values.get('loadtest_current_rate', 0))),
+                ('Requests', '{:.0f}'.format(values.get('loadtest_step_requests', 0))),
+                ('Success (10s)', '{:.2f}%'.format(values.get('loadtest_rolling_success_ratio', 0) * 100)),
+                ('p50 (10s)', '{:.3f}ms'.format(
+                    values.get('loadtest_rolling_latency_seconds{quantile="0.5"}', 0) * 1e3)),
+                ('p99 (10s)', '{:.3f}ms'.format(
+                    values.get('loadtest_rolling_latency_seconds{quantile="0.99"}', 0) * 1e3)),
+                ('Steps done', '{:.0f}'.format(values.get('loadtest_steps_completed_total', 0))),
+                ('Best rate', '{:.0f}/s'.format(values['loadtest_best_rate']) if 'loadtest_best_rate' in values
+                 else '-')]
+        for row, (label, value) in enumerate(rows):
+            screen.addstr(row + 2, 2, '{:<15} {}'.format(label, value))
+        screen.refresh()
+        time.sleep(interval)
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Live view of a running load test')
+    args.add_argument('--url', type=str, dest="url", default='http://localhost:9100/metrics',
+                      help="Metrics endpoint of the load test. Default is http://localhost:9100/metrics")
+    args.add_argument('--interval', type=float, dest="interval", default=1.0,
+                      help="Seconds between two refreshes. Default is 1.")
+    given_args = args.parse_args(argv[1:])
+    try:
+        import curses                                                           # not on every platform, e.g. Windows
+    except ImportError:
+        raise Exception(ErrorCode.toolNotInstalled, "The live view needs curses; on Windows pip install "
+                                                    "windows-curses, or read the metrics endpoint directly")
+    curses.wrapper(dashboard, given_args.url, given_args.interval)
+    return ErrorCode.ok
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
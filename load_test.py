@@ -3,6 +3,16 @@ from utils import *
 
 
 class LoadTest:
+    @staticmethod
+    def check_python_version() -> int:
+        required_version = 30       # python runtime version should >= 3.0
+        current_version = sys.version_info.major * 10 + sys.version_info.minor
+        if current_version < required_version:
+            raise Exception(ErrorCode.pythonVersionTooOld,
+                            "Python 3.0 is required, and you are running v{}.{}"
+                            .format(sys.version_info.major, sys.version_info.minor))
+        return 0
+
     @staticmethod
     def check_load_tool_settings(tool_name: str, expected_exit_code: int) -> int:
         my_machine = None
@@ -14,12 +24,7 @@ class LoadTest:
         elif "windows" in os_type.lower():
             my_machine = PLATFORM.WINDOWS
 
-        required_version = 30       # python runtime version should >= 3.0
-        current_version = sys.version_info.major * 10 + sys.version_info.minor
-        if current_version < required_version:
-            raise Exception(ErrorCode.pythonVersionTooOld,
-                            "Python 3.0 is required, and you are running v{}.{}"
-                            .format(sys.version_info.major, sys.version_info.minor))
+        LoadTest.check_python_version()
 
         # Let's check where the load test tool is installed
         ret, output, out_err = TestUtils.execute_single_command("{} {}"
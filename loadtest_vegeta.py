@@ -16,12 +16,33 @@ Environment:
     Mac, Windows, Linux
 """
 
+import csv
 import json
+import math
 import signal
 import time
 import getpass
 import argparse
+import shutil
+import tempfile
 from load_test import *
+from vegeta_stream import EarlyAbortRule, StreamStats, VegetaStream
+from step_result import StepResult, report_result_files
+from search_strategy import search_strategies
+from simulated_service import SimulatedService
+from distributed import DistributedAttack, SSHTransport
+from results_store import ResultsStore
+from async_engine import AsyncAttackEngine
+from pool_engine import ProcessPoolAttack
+from live_metrics import LiveMetrics
+from target_corpus import TargetCorpus, compile_targets, is_corpus, load_requests, target_orders
+from workload_profile import WorkloadProfile
+from service_objectives import parse_objective, missed_objectives
+from step_pipeline import GatedCommand, HealthProbe, ResultWriter
+from soak_test import DriftDetector, SoakRecorder, parse_soak_time
+from vegeta_targets import Target, read_targets
+from client_resources import ClientMonitor
+from rate_shape import RateShape, ShapedStats, analyse_shape
 
 # Global variables -----
 test_run = None
@@ -35,6 +56,7 @@ def signal_handler(sig, frame):
         print('\n----- Ctrl-C is pressed. Stop the test run. -----\n')
 
         # If we have executed some tests already, save them.
+        test_run.finish_run('interrupted')
         if len(test_run.result_set) > 0:
             test_run.tests_summary()
 
@@ -51,14 +73,53 @@ class VegetaLoadTest(LoadTest):
     load_test_time = 10                                                         # in seconds
     load_rest_time = 5                                                          # in seconds
     load_step_rate = 50                                                         # per second
+    stream_results = False                                                      # per-request streaming
+    early_abort = False                                                         # stop failing steps early
+    search_strategy = None
+    coordinator = None                                                          # distributed attack
+    max_rate_per_process = 5000                                                 # per second
+    store_file = None                                                           # None for the default
+    results_store = None
+    run_id = None
+    live_metrics = None                                                         # /metrics endpoint
+    target_order = 'sequential'
+    vegeta_target_file = None                                                   # what the vegeta binary reads
+    export_dir = None
+    profile_file = None
+    profile = None                                                              # WorkloadProfile
+    objectives = []                                                             # latency objectives
+    adaptive_rest = False                                                       # rest until the target recovers
+    health_url = None                                                           # what to probe it with
+    health_probe = None
+    writer = None                                                               # ResultWriter of the run
+    prepared = None                                                             # attacker of the next step
+    soak_time = None                                                            # in seconds, None to search
+    soak_interval = 10                                                          # seconds per window
+    max_soak_time = 30 * 86400
+    soak_recorder = None
+    resume_run = None                                                           # run id to continue
+    checkpoint = None                                                           # (step_no, saved, state)
+    warm_resume_seconds = 600                                                   # skip the warm-up within
+    command_line = None
+    client_monitor = None                                                       # resources of the load generator
+    shape = None                                                                # RateShape, None to search
+    shape_interval = 1.0                                                        # seconds per interval
+    exact_histogram = False                                                     # decode every binary result
     result_set = []
+    attack_rates = []                                                           # requested rate of each step
 
     # --------------------------------------------------------------------------
     def __init__(self, target_file: str, failure_threshold: float, start_rate: int,
                  test_time: int, step_rate: int, warm_up_rate: int, warm_up_time: int,
-                 rest_time: int):
+                 rest_time: int, stream_results: bool = False, early_abort: bool = False,
+                 search: str = 'adaptive', workers: int = 0, worker_hosts: List[str] = None,
+                 store_file: str = None, metrics_port: int = None, target_order: str = 'sequential',
+                 profile_file: str = None, objectives: List[str] = None, adaptive_rest: bool = False,
+                 health_url: str = None, soak_time: int = None, soak_interval: int = None,
+                 resume_run: int = None, command_line: List[str] = None, shape: str = None,
+                 shape_interval: float = None, exact_histogram: bool = False):
         """
-        :param target_file: the vegeta file that hosts all the HTTP requests
+        :param target_file: the vegeta file that hosts all the HTTP requests, or a compiled target corpus
         :param failure_threshold: stop the test if the failure rate > this threshold
         :param start_rate: start HTTP request rate for vegeta runs
         :param test_time: test run time in seconds. Cannot be more than 1 hour
@@ -66,13 +127,56 @@ class VegetaLoadTest(LoadTest):
         :param warm_up_rate: the initial warm-up request rate for service side JVMs.
         :param warm_up_time: <= 10 minutes
         :param rest_time: the rest time between two chunks of vegeta tests
+        :param stream_results: read per-request results while the attack runs, instead of
+                               the aggregated report at its end
+        :param early_abort: stop a step as soon as its failure rate clearly exceeds the threshold.
+                            Implies stream_results
+        :param search: name of the rate search strategy, see search_strategy.py
+        :param workers: split each load test across this many local vegeta processes. 0 for a single one
+        :param worker_hosts: split each load test across vegeta on these SSH hosts instead
+        :param store_file: the SQLite results store. None for load_test_results.db next to the scripts
+        :param metrics_port: publish live metrics on this port while the test runs. None for no metrics.
+                             Implies stream_results, unless the steps are split across several workers
+        :param target_order: sequential, shuffle or weighted, see target_corpus.py
+        :param profile_file: a workload profile to generate the targets from, instead of target_file.
+                             Implies stream_results, see workload_profile.py
+        :param objectives: service level objectives every step must meet on top of the failure
+                           threshold, e.g. ['p99<250ms', 'p99.9<1s'], see service_objectives.py
+        :param adaptive_rest: end the rest between two steps as soon as the target has recovered,
+                              rest_time being the longest rest
+        :param health_url: the url to probe the target with for adaptive_rest. None for the first
+                           GET target
+        :param soak_time: hold start_rate for this many seconds as a soak test, instead of searching
+                          for the highest rate. Up to 30 days. Implies stream_results
+        :param soak_interval: seconds per window of the soak test's time series
+        :param resume_run: continue this run of the results store from its last checkpoint,
+                           instead of starting a new one
+        :param command_line: the arguments the run was started with, stored with its settings so
+                             that it can be resumed
+        :param shape: send along this rate shape, e.g. 'ramp(100,2000,60) hold(2000,30)', as one
+                      attack instead of searching for the highest rate. Implies stream_results,
+                      see rate_shape.py
+        :param shape_interval: seconds per interval of the shape's time series
+        :param exact_histogram: without stream_results, decode every result of a step into the
+                                latency histogram, instead of reading vegeta's aggregated reports
         """
         # check the parameters
-        if not os.path.exists(target_file):
+        if profile_file is not None:
+            if target_file is not None:
+                raise Exception(ErrorCode.badParameterType, "Use either a target file or a workload profile")
+            self.profile_file = profile_file
+            self.profile = WorkloadProfile.load(profile_file)
+            self.export_dir = tempfile.mkdtemp(prefix='vegeta_targets_')
+            target_file = self.profile.write_target_file(self.export_dir)
+
+        if target_file is None or not os.path.exists(target_file):
             raise Exception(ErrorCode.fileNotExist,
                             "Cannot find target file {}".format(target_file))
         else:
             self.target_file = target_file
+        if target_order not in target_orders:
+            raise Exception(ErrorCode.valueOutOfRange, "Unknown target order {}".format(target_order))
+        self.target_order = target_order
 
         if failure_threshold:
             if failure_threshold < 0.0 or failure_threshold > 10.0:
@@ -80,8 +184,15 @@ class VegetaLoadTest(LoadTest):
             else:
                 self.failure_threshold = failure_threshold
 
+        if workers and worker_hosts:
+            raise Exception(ErrorCode.badParameterType, "Use either local workers or worker hosts")
+        self.worker_count = len(worker_hosts) if worker_hosts else max(workers, 1)
+        if self.worker_count > 64:
+            raise Exception(ErrorCode.valueOutOfRange)
+        max_rate = self.max_rate_per_process * self.worker_count
+
         if start_rate:
-            if start_rate <= 0 or start_rate > 5000:        # No more than 5000 requests/second
+            if start_rate <= 0 or start_rate > max_rate:    # No more than 5000 requests/second per process
                 raise Exception(ErrorCode.valueOutOfRange)
             else:
                 self.load_start_rate = start_rate
@@ -116,6 +227,95 @@ class VegetaLoadTest(LoadTest):
             else:
                 self.load_rest_time = rest_time
 
+        if soak_time is not None:
+            if soak_time <= 0 or soak_time > self.max_soak_time:
+                raise Exception(ErrorCode.valueOutOfRange, "A soak test runs for up to 30 days")
+            self.soak_time = soak_time
+            if resume_run is not None:
+                raise Exception(ErrorCode.badParameterType, "A soak test cannot be resumed")
+        if soak_interval:
+            if soak_interval <= 0 or soak_interval > 3600:
+                raise Exception(ErrorCode.valueOutOfRange)
+            else:
+                self.soak_interval = soak_interval
+
+        if shape is not None:
+            if self.soak_time is not None or resume_run is not None:
+                raise Exception(ErrorCode.badParameterType, "A rate shape can neither soak nor be resumed")
+            self.shape = RateShape.parse(shape)
+            if self.shape.peak_rate() > max_rate:
+                raise Exception(ErrorCode.requestRateTooHigh, "The rate shape peaks at {:.0f} requests/second, "
+                                "more than the {} of {} process(es)".format(self.shape.peak_rate(), max_rate,
+                                                                           self.worker_count))
+        if shape_interval:
+            if shape_interval < 0.1 or shape_interval > 3600:
+                raise Exception(ErrorCode.valueOutOfRange)
+            else:
+                self.shape_interval = shape_interval
+
+        self.objectives = [parse_objective(text) for text in objectives or []]
+        self.adaptive_rest = adaptive_rest
+        self.health_url = health_url
+        self.early_abort = early_abort
+        self.stream_results = stream_results or early_abort or self.profile is not None or \
+            self.soak_time is not None or self.shape is not None or \
+            (metrics_port is not None and self.worker_count == 1 and not worker_hosts)
+
+        if search not in search_strategies:
+            raise Exception(ErrorCode.valueOutOfRange, "Unknown search strategy {}".format(search))
+        self.search_strategy = search_strategies[search](self.failure_threshold, self.load_start_rate,
+                                                         self.load_step_rate)
+        self.search_strategy.max_rate = max_rate
+
+        self.exact_histogram = exact_histogram
+        self.coordinator = self.create_coordinator(workers, worker_hosts)
+        self.store_file = store_file
+        self.resume_run = resume_run
+        self.command_line = command_line
+        if metrics_port is not None:
+            self.live_metrics = LiveMetrics(metrics_port)
+        if ClientMonitor.available():
+            self.client_monitor = ClientMonitor()
+
+    # --------------------------------------------------------------------------
+    def create_coordinator(self, workers: int, worker_hosts: List[str]):
+        """
+        :return: the DistributedAttack that splits each step across several vegeta processes,
+                 or None to run each step in a single one
+        """
+        if (workers > 1 or worker_hosts) and self.stream_results:
+            raise Exception(ErrorCode.badParameterType,
+                            "Streaming is not supported across several workers")
+        if worker_hosts:
+            return DistributedAttack([SSHTransport(host) for host in worker_hosts], self.vegeta_targets(),
+                                     self.exact_histogram)
+        if workers > 1:
+            return DistributedAttack(DistributedAttack.local_workers(workers), self.vegeta_targets(),
+                                     self.exact_histogram)
+        return None
+
+    # --------------------------------------------------------------------------
+    def vegeta_targets(self) -> str:
+        """
+        :return: the target file for the vegeta binary. A compiled corpus, or the targets in
+                 another order than the file's, is exported once to a vegeta target file
+        """
+        if self.vegeta_target_file is None:
+            if self.target_order == 'sequential' and not is_corpus(self.target_file):
+                self.vegeta_target_file = self.target_file
+            else:
+                if self.export_dir is None:
+                    self.export_dir = tempfile.mkdtemp(prefix='vegeta_targets_')
+                corpus_file = self.target_file
+                if not is_corpus(corpus_file):
+                    corpus_file = os.path.join(self.export_dir, 'targets.vtc')
+                    compile_targets(self.target_file, corpus_file)
+                corpus = TargetCorpus(corpus_file)
+                self.vegeta_target_file = os.path.join(self.export_dir, 'targets.txt')
+                corpus.export(self.vegeta_target_file, self.target_order)
+                corpus.close()
+        return self.vegeta_target_file
+
     # --------------------------------------------------------------------------
     def __del__(self):
         pass
@@ -124,9 +324,16 @@ class VegetaLoadTest(LoadTest):
     def execute_tests(self):
         ret = self.check_vegeta_settings()
         if ret == 0:
-            ret = self.warm_up_load_test()
+            self.load_checkpoint()
+            self.start_health_probe()
+            ret = 0 if self.target_still_warm() else self.warm_up_load_test()
             if ret == 0:
-                ret = self.execute_load_test()
+                if self.soak_time is not None:
+                    ret = self.execute_soak_test()
+                elif self.shape is not None:
+                    ret = self.execute_shape_test()
+                else:
+                    ret = self.execute_load_test()
                 if ret == 0:
                     ret = self.tests_summary()
 
@@ -150,85 +357,707 @@ class VegetaLoadTest(LoadTest):
         print('\n\nWarming up target service for {} requests/s and run for {} seconds ...\n'
               .format(self.service_warm_up_rate, self.service_warm_up_time))
         cmd = "vegeta attack -rate={} -duration={}s -targets={} | vegeta report".format(
-            self.service_warm_up_rate, self.service_warm_up_time, self.target_file)
+            self.service_warm_up_rate, self.service_warm_up_time, self.vegeta_targets())
         print('\t{}'.format(cmd))
 
         ret, result = TestUtils.execute_multiple_commands(cmd)
-        if self.load_rest_time > 0:
-            print('\tRest for {} seconds ...'.format(self.load_rest_time))
-            time.sleep(self.load_rest_time)
+        if ret == 0:
+            self.prepare_step(self.load_start_rate, self.load_test_time)
+        self.rest_between_steps()
         print("\tDone\n")
         return ret
 
+    # --------------------------------------------------------------------------
+    def load_checkpoint(self):
+        """
+        Read the checkpoint of the run to resume, before anything is sent to the target
+        """
+        if self.resume_run is None:
+            return
+        store = ResultsStore(self.store_file)
+        try:
+            checkpoint = store.checkpoint(self.resume_run)
+        finally:
+            store.close()
+        if checkpoint is None:
+            raise Exception(ErrorCode.valueOutOfRange,
+                            "Run {} has no checkpoint to resume from".format(self.resume_run))
+        if checkpoint[2]['done']:
+            raise Exception(ErrorCode.valueOutOfRange,
+                            "The search of run {} is complete; nothing to resume".format(self.resume_run))
+        self.checkpoint = checkpoint
+
+    # --------------------------------------------------------------------------
+    def target_still_warm(self) -> bool:
+        """
+        :return: whether the run resumes so soon after its last step that the target needs no warm-up
+        """
+        if self.checkpoint is None:
+            return False
+        stopped = time.time() - self.checkpoint[1]
+        if stopped >= self.warm_resume_seconds:
+            return False
+        print('\n\nRun {} stopped {:.0f} seconds ago; skip on warming up target service\'s JVM\n\n'
+              .format(self.resume_run, stopped))
+        return True
+
+    # --------------------------------------------------------------------------
+    def start_health_probe(self):
+        """
+        Measure the latency of the idle target before anything is sent, which the adaptive rest
+        goes back to
+        """
+        if not self.adaptive_rest or self.load_rest_time == 0:
+            return
+        probe = HealthProbe(self.probe_target())
+        if probe.measure_idle() is None:
+            print('\nThe health probe {} {} fails; rest for {} seconds between the steps\n'.format(
+                probe.target.method, probe.target.url, self.load_rest_time))
+            return
+        self.health_probe = probe
+        print('\nAdaptive rest: probe {} {}, idle latency {:.3f}ms\n'.format(
+            probe.target.method, probe.target.url, probe.idle_latency * 1e3))
+
+    # --------------------------------------------------------------------------
+    def probe_target(self) -> Target:
+        """
+        :return: the request to probe the health of the target with: the health url, or else the
+                 first GET or HEAD target, which has no side effects
+        """
+        if self.health_url is not None:
+            return Target('GET', self.health_url)
+        corpus = None
+        if self.profile is not None:
+            targets = self.profile.materialize()
+        elif is_corpus(self.target_file):
+            corpus = TargetCorpus(self.target_file)
+            targets = (corpus.target(i) for i in range(len(corpus)))
+        else:
+            targets = read_targets(self.target_file)
+        try:
+            for target in targets:
+                if target.method in ('GET', 'HEAD'):
+                    return target
+        finally:
+            if corpus is not None:
+                corpus.close()
+        raise Exception(ErrorCode.emptyParameter,
+                        "No GET target to probe the health of the target with; give a --health_url")
+
+    # --------------------------------------------------------------------------
+    def settings(self) -> dict:
+        return {'failure_threshold': self.failure_threshold,
+                'target_file': self.target_file,
+                'start_rate': self.load_start_rate,
+                'step_rate': self.load_step_rate,
+                'test_time': self.load_test_time,
+                'rest_time': self.load_rest_time,
+                'warm_up_rate': self.service_warm_up_rate,
+                'warm_up_time': self.service_warm_up_time,
+                'stream_results': self.stream_results,
+                'early_abort': self.early_abort,
+                'search': self.search_strategy.name,
+                'target_order': self.target_order,
+                'profile': self.profile_file,
+                'objectives': ','.join(objective.text for objective in self.objectives),
+                'adaptive_rest': self.adaptive_rest,
+                'soak_time': self.soak_time,
+                'soak_interval': self.soak_interval,
+                'shape': self.shape.text if self.shape is not None else None,
+                'shape_interval': self.shape_interval,
+                'exact_histogram': self.exact_histogram,
+                'workers': self.worker_count,
+                'command_line': json.dumps(self.command_line)}
+
+    # --------------------------------------------------------------------------
+    '''
+    Every run and each of its steps goes to the results store right away, so that nothing
+    that has finished is lost on a crash or Ctrl-C. The store is written on the thread of the
+    ResultWriter, so that a step is persisted while the target rests.
+    '''
+    def start_run(self):
+        self.writer = ResultWriter()
+        self.run_id = self.writer.call(self.open_store)
+        print('\nRun {} is stored in {}'.format(self.run_id, self.results_store.db_file))
+
+    # --------------------------------------------------------------------------
+    def open_store(self) -> int:
+        self.results_store = ResultsStore(self.store_file)
+        if self.resume_run is not None:
+            return self.resume_run
+        return self.results_store.start_run(self.profile_file or self.target_file,
+                                            self.search_strategy.name, self.settings())
+
+    # --------------------------------------------------------------------------
+    def resume_search(self) -> Tuple[int, int]:
+        """
+        Load the steps of the run to resume, and the search as it was after the last of them
+        :return: the rate of the next step and the fail count
+        """
+        for rate, entry in self.writer.call(self.results_store.resume_run, self.run_id):
+            self.result_set.append(entry)
+            self.attack_rates.append(rate)
+        step_no, saved, state = self.checkpoint
+        self.search_strategy.restore(state['search'])
+        print('Resume after step {} of {}, with {} requests/second'.format(
+            step_no, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(saved)), state['next_rate']))
+        return state['next_rate'], state['fail_count']
+
+    # --------------------------------------------------------------------------
+    def store_step(self, step_no, attack_rate, entry, checkpoint=None):
+        if self.writer is not None:
+            self.writer.submit(self.results_store.add_step, self.run_id, step_no, attack_rate, entry, checkpoint)
+
+    # --------------------------------------------------------------------------
+    def close_store(self, status, best_rate):
+        self.results_store.finish_run(self.run_id, status, best_rate)
+        self.results_store.close()
+        self.results_store = None
+
+    # --------------------------------------------------------------------------
+    def finish_run(self, status):
+        self.cancel_prepared()
+        if self.soak_recorder is not None:
+            self.soak_summary(self.stop_soak_recorder())
+        if self.export_dir is not None:
+            shutil.rmtree(self.export_dir, ignore_errors=True)
+            self.export_dir = None
+        if self.live_metrics is not None:
+            self.live_metrics.stop()
+            self.live_metrics = None
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            try:
+                writer.call(self.close_store, status, self.search_strategy.best_rate)
+            finally:
+                writer.close()
+
     # --------------------------------------------------------------------------
     def execute_load_test(self):
         self.result_set = []
+        self.attack_rates = []
         attack_rate = self.load_start_rate
         attack_time = self.load_test_time
         fail_count = 0
+        status = 'finished'
+        self.start_run()
+        if self.checkpoint is not None:
+            attack_rate, fail_count = self.resume_search()
+        if self.live_metrics is not None:
+            self.live_metrics.start()
 
         while True:
-            cmd = "vegeta attack -rate={} -duration={}s -targets={} | vegeta report -type json"\
-                .format(attack_rate, attack_time, self.target_file)
-            print('\nExecuting:  {}'.format(cmd))
-
-            ret, result = TestUtils.execute_multiple_commands(cmd)
-
-            ''' Vegeta uses single-quotes in json object. It will fail typical json parsers to 
-            validate the objects. Convert to use double-quotes instead. '''
-            entry = json.loads(result[0].replace("\'", "\""))
+            if self.live_metrics is not None:
+                self.live_metrics.begin_step(len(self.result_set) + 1, attack_rate, attack_time)
+            ret, entry = self.run_monitored_step(attack_rate, attack_time)
+            if ret != 0:
+                status = 'failed'
+                break
 
             self.result_set.append(entry)
-            print('\tResponse: {}'.format(entry))
+            self.attack_rates.append(attack_rate)
+            print('\tResponse: {}'.format({name: value for name, value in entry.items() if name != 'histogram'}))
 
             ret, new_rate, fail_count = self.result_analysis_adaptive_adjustments(entry,
                                                                                   attack_rate,
                                                                                   fail_count)
-            if ret != 0 or fail_count >= 5:
+            # the step is complete now; it is stored in the background with the checkpoint to
+            # resume from, and the attacker of the next step is spawned, while the target rests
+            checkpoint = {'next_rate': new_rate, 'fail_count': fail_count,
+                          'search': self.search_strategy.state(), 'done': ret != 0}
+            self.store_step(len(self.result_set), attack_rate, entry, checkpoint)
+            if self.live_metrics is not None:
+                self.live_metrics.end_step(entry, self.search_strategy.best_rate)
+            if ret != 0:
                 break
 
-            if self.load_rest_time > 0:
-                print('\tRest for {} seconds ...'.format(self.load_rest_time))
-                time.sleep(self.load_rest_time)
+            self.prepare_step(new_rate, attack_time)
+            self.rest_between_steps()
             attack_rate = new_rate
 
+        self.finish_run(status)
         print("Finished load testing.\n")
+        print('{}\n'.format(self.search_strategy.summary()))
+        return 0
+
+    # --------------------------------------------------------------------------
+    '''
+    A soak test holds the start rate for soak_time as one long streaming step. Its windows go to
+    a time series file next to the other result files while it runs, see soak_test.py; the step
+    passes if it met the failure threshold and the objectives, and nothing regressed or drifted.
+    '''
+    def execute_soak_test(self):
+        self.result_set = []
+        self.attack_rates = []
+        attack_rate = self.load_start_rate
+        self.start_run()
+        if self.live_metrics is not None:
+            self.live_metrics.start()
+
+        series_file = '{}/load_test_vegeta_{}_{}_soak.csv'.format(
+            TestUtils.get_absolute_path(), getpass.getuser(), time.strftime('%Y_%m_%d_%H_%M_%S'))
+        windows = self.soak_time // self.soak_interval
+        self.soak_recorder = SoakRecorder(series_file, self.soak_interval,
+                                          DriftDetector(max(3, min(DriftDetector.baseline_windows, windows // 4))))
+        print('\nSoak test: {} requests/second for {} seconds, windows of {} seconds in {}'.format(
+            attack_rate, self.soak_time, self.soak_interval, series_file))
+        self.soak_recorder.start()
+
+        if self.live_metrics is not None:
+            self.live_metrics.begin_step(1, attack_rate, self.soak_time)
+        ret, entry = self.run_load_step(attack_rate, self.soak_time)
+        summary = self.stop_soak_recorder()
+        if ret != 0:
+            self.finish_run('failed')
+            return ret
+
+        entry['soak'] = summary
+        self.result_set.append(entry)
+        self.attack_rates.append(attack_rate)
+        failure_rate = 100 - entry['success'] * 100
+        print('\tExpected Failure Rate: {}%\t\tActual: {}%\n'.format(self.failure_threshold, failure_rate))
+        if self.objectives:
+            failure_rate = self.check_objectives(entry, failure_rate)
+        off = sorted(set(summary['regressions'] + summary['drifting']))
+        if off:
+            entry['bound_by'] = {'objective': 'soak ' + ','.join(off), 'severity': DriftDetector.latency_tolerance}
+            failure_rate = self.search_strategy.missed_failure_rate(failure_rate, DriftDetector.latency_tolerance)
+        self.search_strategy.record_step(attack_rate, failure_rate, entry, entry['duration'] / 1e9)
+
+        self.store_step(1, attack_rate, entry)
+        if self.live_metrics is not None:
+            self.live_metrics.end_step(entry, self.search_strategy.best_rate)
+        self.soak_summary(summary)
+        self.finish_run('finished')
+        print('Soak test {}.\n'.format('passed' if self.search_strategy.best_rate is not None else 'failed'))
         return 0
 
+    # --------------------------------------------------------------------------
+    '''
+    A shaped test sends along the rate shape as one streaming step. The results of each of its
+    intervals go to a time series file next to the other result files, see rate_shape.py; the
+    step passes if it met the failure threshold and the objectives, and recovered from every spike.
+    '''
+    def execute_shape_test(self):
+        self.result_set = []
+        self.attack_rates = []
+        peak_rate = int(math.ceil(self.shape.peak_rate()))
+        self.start_run()
+        if self.live_metrics is not None:
+            self.live_metrics.start()
+
+        series_file = '{}/load_test_vegeta_{}_{}_shape.csv'.format(
+            TestUtils.get_absolute_path(), getpass.getuser(), time.strftime('%Y_%m_%d_%H_%M_%S'))
+        stats = ShapedStats(self.shape, self.shape_interval, series_file)
+        print('\nRate shape: {}\n\t{:.0f} requests in {:.1f} seconds, up to {} requests/second, intervals of {} '
+              'seconds in {}'.format(self.shape.text, self.shape.requests(), self.shape.duration, peak_rate,
+                                     self.shape_interval, series_file))
+
+        if self.live_metrics is not None:
+            self.live_metrics.begin_step(1, peak_rate, self.shape.duration)
+        try:
+            ret = self.run_shaped_step(stats)
+        finally:
+            stats.finish()
+        if ret != 0:
+            self.finish_run('failed')
+            return ret
+
+        entry = stats.report()
+        summary = entry['shape'] = analyse_shape(stats.series, self.shape_interval)
+        summary['late'] = stats.late
+        summary['series_file'] = series_file
+        self.result_set.append(entry)
+        self.attack_rates.append(peak_rate)
+        failure_rate = 100 - entry['success'] * 100
+        print('\tExpected Failure Rate: {}%\t\tActual: {}%\n'.format(self.failure_threshold, failure_rate))
+        if self.objectives:
+            failure_rate = self.check_objectives(entry, failure_rate)
+        if not summary['recovered']:
+            entry['bound_by'] = {'objective': 'spike recovery', 'severity': 1.0}
+            failure_rate = self.search_strategy.missed_failure_rate(failure_rate, 1.0)
+        self.search_strategy.record_step(peak_rate, failure_rate, entry, entry['duration'] / 1e9)
+
+        self.store_step(1, peak_rate, entry)
+        if self.live_metrics is not None:
+            self.live_metrics.end_step(entry, self.search_strategy.best_rate)
+        self.shape_summary(summary)
+        self.finish_run('finished')
+        print('Shaped test {}.\n'.format('passed' if self.search_strategy.best_rate is not None else 'failed'))
+        return 0
+
+    # --------------------------------------------------------------------------
+    def run_shaped_step(self, stats: ShapedStats) -> int:
+        """
+        vegeta attacks at a constant rate, so the shape is sent one interval at a time, at its mean
+        rate over the interval. The attack of the next interval is spawned while one runs, and
+        released when the schedule gets to it.
+        :return: return code
+        """
+        self.watch_step(lambda: stats)
+        intervals = []
+        for index in range(stats.count):
+            start = index * self.shape_interval
+            seconds = min(self.shape_interval, self.shape.duration - start)
+            intervals.append((start, seconds, int(round(self.shape.mean_rate(start, start + seconds)))))
+
+        def spawn(index):
+            _, seconds, rate = intervals[index]
+            return VegetaStream(rate, '{:g}'.format(seconds), self.vegeta_targets()).prepare() if rate > 0 else None
+
+        origin = time.time()
+        stats.begin(origin)
+        prepared = spawn(0)
+        try:
+            for index, (start, seconds, rate) in enumerate(intervals):
+                stream, prepared = prepared, None
+                time.sleep(max(0.0, origin + start - time.time()))
+                if stream is None:
+                    prepared = spawn(index + 1) if index + 1 < len(intervals) else None
+                    time.sleep(max(0.0, origin + start + seconds - time.time()))
+                    continue
+                print('\tInterval {:d}: {} requests/second for {:g} seconds'.format(index + 1, rate, seconds))
+                results = stream.results()
+                prepared = spawn(index + 1) if index + 1 < len(intervals) else None
+                stats.current = index
+                for result in results:
+                    stats.add(result)
+                ret = stream.wait()
+                if ret != 0:
+                    return ret
+                stats.close_until(index + 1)
+        finally:
+            if prepared is not None:
+                prepared.gate.cleanup()
+        return 0 if stats.requests > 0 else ErrorCode.executeShellCommand
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def shape_summary(summary):
+        print('\n\tShape: {} intervals of {} seconds in {}'.format(summary['intervals'], summary['interval'],
+                                                                 summary['series_file']))
+        if summary['behind']:
+            print('\tFell behind the shape in {} intervals, first at {:.1f} seconds; from {:.0f} requests/second '
+                  'on'.format(summary['behind'], summary['first_behind_s'], summary['behind_from_rate']))
+        if summary['kept_up_to_rate'] is not None:
+            print('\tKept up with up to {:.0f} requests/second'.format(summary['kept_up_to_rate']))
+        for spike in summary['spikes']:
+            if not spike['watched']:
+                outcome = 'not watched, the shape ends with it'
+            elif spike['recovery_s'] is None:
+                outcome = 'not recovered within {:.1f} seconds'.format(spike['watched_s'])
+            else:
+                outcome = 'recovered after {:.1f} seconds'.format(spike['recovery_s'])
+            print('\tSpike at {:.1f}-{:.1f} seconds, {:.0f} to {:.0f} requests/second: p99 {:.3f}ms before, {:.3f}ms '
+                  'at most, errors up to {:.2f}%; {}'.format(
+                      spike['start'], spike['end'], spike['rate_before'], spike['peak_rate'], spike['p99_before_ms'],
+                      spike['p99_peak_ms'], spike['error%_peak'], outcome))
+        if summary['late']:
+            print('\t{} responses came after their interval was written; they are in the totals only'.format(
+                summary['late']))
+
+    # --------------------------------------------------------------------------
+    def run_monitored_step(self, attack_rate, attack_time):
+        """
+        Run one step while the resources of the load generator are sampled; they go with the
+        step's report as entry['client']
+        """
+        if self.client_monitor is None:
+            return self.run_load_step(attack_rate, attack_time)
+        self.client_monitor.begin()
+        try:
+            ret, entry = self.run_load_step(attack_rate, attack_time)
+        finally:
+            self.client_monitor.end()
+        if ret == 0:
+            client = entry['client'] = self.client_monitor.report(entry, attack_rate)
+            print('\tClient: cpu {:.2f} of {} cores (peak {:.2f}), rss {:.0f}MB, fds {}, sockets {}, '
+                  'ephemeral ports {}, rate {:.1f}/s, sent {:.1f}ms late, throughput {:.1f}/s'.format(
+                      client['cpu_cores'], client['cores'], client['cpu_peak'], client['rss_mb'], client['fds'],
+                      client['sockets'], client['ports'], client['rate'], client['lateness_ms'],
+                      client['throughput']))
+        return ret, entry
+
+    # --------------------------------------------------------------------------
+    def stop_soak_recorder(self) -> dict:
+        recorder, self.soak_recorder = self.soak_recorder, None
+        recorder.stop()
+        summary = recorder.detector.summary()
+        summary['windows'] = recorder.windows
+        summary['series_file'] = recorder.series_file
+        return summary
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def soak_summary(summary):
+        print('\n\tSoak: {} windows over {:.2f} hours in {}'.format(summary['windows'], summary['hours'],
+                                                                  summary['series_file']))
+        baseline = summary['baseline']
+        if baseline is None:
+            print('\tToo short for a baseline; no drift or regression detection')
+            return
+        print('\tBaseline: p99 {:.3f}ms, error rate {:.3f}%, throughput {:.1f}/s'.format(
+            baseline['p99_ms'], baseline['error%'], baseline['throughput']))
+        for metric, drift in summary['drift'].items():
+            print('\tTrend of {:<10}  {:+10.4f}/hour  {:+7.1f}% of the baseline over the run{}'.format(
+                metric, drift['per_hour'], drift['relative'] * 100,
+                '  DRIFTING' if metric in summary['drifting'] else ''))
+        print('\tPauses: {}    Regressed at the end: {}'.format(summary['pauses'],
+                                                             ', '.join(summary['regressions']) or 'none'))
+        for event in summary['events'][-10:]:
+            print('\t\t{}  {:<10}  {}'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['time'])),
+                                              event['kind'], event['text']))
+
+    # --------------------------------------------------------------------------
+    def rest_between_steps(self):
+        if self.load_rest_time == 0:
+            return
+        if self.health_probe is None:
+            print('\tRest for {} seconds ...'.format(self.load_rest_time))
+            time.sleep(self.load_rest_time)
+            return
+
+        print('\tRest until the target recovers, {} seconds at most ...'.format(self.load_rest_time))
+        rested, recovered, latency = self.health_probe.wait_recovered(self.load_rest_time)
+        self.search_strategy.seconds += rested
+        print('\t{} after {:.1f} seconds: probe latency {}, idle {:.3f}ms'.format(
+            'Recovered' if recovered else 'Not recovered', rested,
+            'failed' if latency is None else '{:.3f}ms'.format(latency * 1e3), self.health_probe.idle_latency * 1e3))
+
+    # --------------------------------------------------------------------------
+    def prepare_step(self, attack_rate, attack_time):
+        """
+        Spawn the vegeta attack of the next step while the target rests, so that the rest is
+        the only time between two steps. It is idle until run_load_step releases it. The
+        workers of a distributed attack are released together by the coordinator anyway.
+        """
+        self.cancel_prepared()
+        if self.coordinator is not None:
+            return
+        if self.stream_results:
+            attack = VegetaStream(attack_rate, attack_time, self.vegeta_targets()).prepare()
+            gate = attack.gate
+        else:
+            result_dir = tempfile.mkdtemp(prefix='vegeta_')
+            attack = gate = GatedCommand("vegeta attack -rate={} -duration={}s -output={}".format(
+                attack_rate, attack_time, os.path.join(result_dir, 'results.bin')), temp_dir=result_dir)
+        self.prepared = (attack_rate, attack_time, attack, gate)
+
+    # --------------------------------------------------------------------------
+    def take_prepared(self, attack_rate, attack_time):
+        """
+        :return: the attack prepared for this rate and time, None if there is none
+        """
+        if self.prepared is None or self.prepared[:2] != (attack_rate, attack_time):
+            self.cancel_prepared()
+            return None
+        attack, self.prepared = self.prepared[2], None
+        return attack
+
+    # --------------------------------------------------------------------------
+    def cancel_prepared(self):
+        if self.prepared is not None:
+            gate, self.prepared = self.prepared[3], None
+            gate.cleanup()
+
+    # --------------------------------------------------------------------------
+    def run_load_step(self, attack_rate, attack_time):
+        """
+        Run vegeta for one step of the load test
+        :return: return code, and the vegeta json report of the step
+        """
+        if self.stream_results:
+            return self.run_streaming_load_step(attack_rate, attack_time)
+
+        if self.coordinator is not None:
+            print('\nExecuting:  {} requests/second for {} seconds on {} workers'.format(
+                attack_rate, attack_time, len(self.coordinator.transports)))
+            return self.coordinator.attack(attack_rate, attack_time)
+
+        attack = self.take_prepared(attack_rate, attack_time)
+        if attack is not None:
+            print('\nExecuting:  {} < {}'.format(attack.cmd, self.vegeta_targets()))
+            try:
+                ret = attack.release(self.vegeta_targets()).wait()
+                if ret != 0:
+                    return ret, None
+                return report_result_files([os.path.join(attack.temp_dir, 'results.bin')], self.exact_histogram)
+            finally:
+                attack.cleanup()
+
+        with tempfile.TemporaryDirectory(prefix='vegeta_') as result_dir:
+            result_file = os.path.join(result_dir, 'results.bin')
+            cmd = "vegeta attack -rate={} -duration={}s -targets={} -output={}"\
+                .format(attack_rate, attack_time, self.vegeta_targets(), result_file)
+            print('\nExecuting:  {}'.format(cmd))
+
+            ret, result = TestUtils.execute_multiple_commands(cmd)
+            if ret != 0:
+                return ret, None
+            return report_result_files([result_file], self.exact_histogram)
+
+    # --------------------------------------------------------------------------
+    '''
+    Streaming variant of a step: the per-request results are decoded as they arrive and folded
+    into StreamStats, so that the memory use does not grow with the rate or the test time.
+    '''
+    def run_streaming_load_step(self, attack_rate, attack_time):
+        stream = self.take_prepared(attack_rate, attack_time) or \
+            VegetaStream(attack_rate, attack_time, self.vegeta_targets())
+        print('\nExecuting:  {}'.format(stream.cmd))
+
+        stats = StreamStats()
+        self.watch_step(lambda: stats)
+        pipeline = stats.consume(stream.results())
+        endpoint_stats = None
+        if self.profile is not None:
+            endpoint_stats = self.profile.endpoint_stats()
+            pipeline = endpoint_stats.split(pipeline)
+        rule = None
+        if self.early_abort:
+            rule = EarlyAbortRule(self.failure_threshold, attack_rate * attack_time)
+            pipeline = rule.watch(pipeline, stats)
+
+        started = time.monotonic()
+        for _ in pipeline:
+            pass
+
+        if rule is not None and rule.tripped:
+            stream.stop()
+        ret = stream.wait()
+        if ret != 0 and stats.requests == 0:
+            return ret, None
+
+        entry = stats.report()
+        if endpoint_stats is not None:
+            entry['endpoints'] = endpoint_stats.reports()
+        if rule is not None and rule.tripped:
+            self.mark_early_abort(entry, rule, time.monotonic() - started, attack_time)
+        return 0, entry
+
+    # --------------------------------------------------------------------------
+    def watch_step(self, source):
+        """
+        Let the live metrics and the soak recorder follow the StreamStats of the running step;
+        their threads read them once in a while, the step itself does not wait for them
+        """
+        if self.live_metrics is not None:
+            self.live_metrics.watch(source)
+        if self.soak_recorder is not None:
+            self.soak_recorder.watch(source)
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def mark_early_abort(entry, rule, elapsed, attack_time):
+        print('\tEarly abort after {:.1f} of {} seconds: failure rate {:.2f}% since the failures began, '
+              'log likelihood ratio {:.1f} of {:.1f}'.format(elapsed, attack_time, rule.failure_rate * 100,
+                                                             rule.log_likelihood_ratio, rule.limit))
+        entry['early_abort'] = {'elapsed': elapsed,
+                                'planned': attack_time,
+                                'failure_rate': rule.failure_rate,
+                                'log_likelihood_ratio': rule.log_likelihood_ratio,
+                                'limit': rule.limit}
+
     # --------------------------------------------------------------------------
     def result_analysis_adaptive_adjustments(self, entry, current_rate, fail_count):
         success_rate = entry['success'] * 100
         current_failure_rate = 100 - success_rate
+        if 'early_abort' in entry:
+            # A partial step: the failures since they began decide, not the diluted total
+            current_failure_rate = max(current_failure_rate, entry['early_abort']['failure_rate'] * 100)
         print('\tExpected Failure Rate: {}%\t\tActual: {}%\n'.format(self.failure_threshold,
                                                                      current_failure_rate))
+        if 'endpoints' in entry:
+            current_failure_rate = self.check_endpoint_objectives(entry, current_failure_rate)
+        if self.objectives:
+            current_failure_rate = self.check_objectives(entry, current_failure_rate)
+
+        # the time the step took, including the rest before the next one. An adaptive rest
+        # adds the time it actually took once it is over
+        step_seconds = (entry['duration'] + entry['wait']) / 1e9
+        if self.health_probe is None:
+            step_seconds += self.load_rest_time
+
+        saturated = list(entry.get('client', {}).get('saturated') or [])
+        if entry.get('failed_workers'):
+            # the share of the rate of the failed workers was never sent
+            saturated.append('workers {} of {} failed'.format(entry['failed_workers'], entry['workers']))
+        if saturated:
+            # the client ran out first: the failures, or the lack of them, are not the service's
+            print('\tThe load generator saturated first ({}); the step is left out of the search'.format(
+                '; '.join(saturated)))
+            entry['bound_by'] = {'objective': 'client ' + ','.join(reason.split()[0] for reason in saturated),
+                                 'severity': 1.0}
+            ret, new_rate = self.search_strategy.generator_saturated(current_rate, step_seconds)
+            if ret != 0:
+                return ret, new_rate, fail_count
+            print('\tAdjust new rate to {} requests/second'.format(new_rate))
+            return 0, new_rate, fail_count
+
+        self.search_strategy.record_step(current_rate, current_failure_rate, entry, step_seconds)
+
+        ret, new_rate, fail_count = self.search_strategy.adjust(current_rate, current_failure_rate,
+                                                                fail_count, entry)
+        if ret != 0:
+            return ret, new_rate, fail_count
 
-        continue_test = (current_failure_rate / self.failure_threshold - 1) < 0.2
+        print('\tAdjust new rate to {} requests/second'.format(new_rate))
+        return 0, new_rate, fail_count
 
-        if continue_test:
-            new_rate = current_rate + self.load_step_rate if fail_count == 0 else \
-                current_rate + int(self.load_step_rate / 5)
+    # --------------------------------------------------------------------------
+    def check_endpoint_objectives(self, entry, current_failure_rate):
+        """
+        Hold every endpoint of the workload profile to its own objectives. The step fails as soon
+        as one endpoint misses one, however good the blended results are.
+        :return: the failure rate the search goes on with
+        """
+        for name, report in entry['endpoints'].items():
+            print('\t\t{:<16} {:7d} requests  {:8.4f}% success  p50 {:9.3f}ms  p99 {:9.3f}ms'.format(
+                name, report['requests'], report['success'] * 100, report['latencies']['50th'] / 1e6,
+                report['latencies']['99th'] / 1e6))
+
+        missed = self.profile.missed_objectives(entry['endpoints'])
+        if not missed:
+            return current_failure_rate
+
+        entry['missed_objectives'] = [{'endpoint': name, 'objective': objective.text, 'severity': severity}
+                                      for name, objective, severity in missed]
+        name, objective, severity = missed[0]
+        print('\n\tEndpoint {} missed its objective: {}'.format(
+            name, objective.describe(entry['endpoints'][name])))
+        entry['bound_by'] = {'objective': '{} {}'.format(name, objective.text), 'severity': severity}
+        return self.search_strategy.missed_failure_rate(current_failure_rate, severity)
 
+    # --------------------------------------------------------------------------
+    def check_objectives(self, entry, current_failure_rate):
+        """
+        Hold the step to the latency objectives as well as to the failure threshold, and note the
+        objective that bounds the capacity: the one that is the nearest to its limit, or the
+        furthest beyond it.
+        :return: the failure rate the search goes on with
+        """
+        pass_limit = self.search_strategy.pass_limit()
+        if pass_limit > 0:
+            failure_severity = current_failure_rate / pass_limit
         else:
-            fail_count += 1
-            if fail_count >= 5:
-                print('\tFailure rate is too high, and we tried for {} times. Stop the load test.'
-                      .format(fail_count))
-                return ErrorCode.requestRateTooHigh, current_rate, fail_count
-
-            if current_failure_rate < self.failure_threshold:
-                new_rate = current_rate + self.load_step_rate
-            else:
-                ratio = (1 - self.failure_threshold / current_failure_rate)
-                new_rate = current_rate - int(self.load_step_rate * ratio)
-
-            if abs(new_rate - current_rate) < 5:            # No need to continue
-                print('\tThe expected new rate {} is too close to existing rate {} - stop the load test.'
-                    .format(
-                    new_rate, current_rate))
-                return ErrorCode.requestRateTooHigh, None, fail_count
-
-        print('\tAdjust new rate to {} requests/second'.format(new_rate))
-        return 0, new_rate, fail_count
+            failure_severity = 0.0 if current_failure_rate == 0 else math.inf
+        binding = ('failure<{}%'.format(self.failure_threshold), failure_severity)
+        for objective in self.objectives:
+            severity = objective.severity(entry)
+            print('\t{:<24} {:6.1f}% of the limit'.format(objective.describe(entry), severity * 100))
+            if severity > binding[1]:
+                binding = (objective.text, severity)
+
+        entry['objectives'] = {objective.text: objective.measure(entry) for objective in self.objectives}
+        if 'bound_by' not in entry or binding[1] > entry['bound_by']['severity']:
+            entry['bound_by'] = {'objective': binding[0], 'severity': binding[1]}
+        print('\tBound by {}, at {:.1f}% of its limit\n'.format(entry['bound_by']['objective'],
+                                                              entry['bound_by']['severity'] * 100))
+
+        missed = missed_objectives(self.objectives, entry)
+        if not missed:
+            return current_failure_rate
+        return self.search_strategy.missed_failure_rate(current_failure_rate, missed[0][1])
 
     # --------------------------------------------------------------------------
     def tests_summary(self):
@@ -248,7 +1077,9 @@ class VegetaLoadTest(LoadTest):
         print('\nSorted test result is saved to {}'.format(result_csv_file))
 
         with open(result_log_file, 'w')as f:
-            f.writelines(list('%s\n' % item for item in self.result_set))
+            f.writelines(json.dumps(entry) + '\n' for entry in self.result_set)
+        results = [StepResult.from_report(entry, step, rate)
+                   for step, (rate, entry) in enumerate(zip(self.attack_rates, self.result_set), 1)]
 
         # The test settings are saved to the xxx_settings.log file
         summary_str = '\n\n----- Vegeta Load Test Summary -----\n\n\
@@ -259,11 +1090,15 @@ class VegetaLoadTest(LoadTest):
 \tEach Load Test Time     : {} seconds\n\
 \tBreak between two runs  : {} seconds\n\
 \tService Warm-up Rate    : {}/second\n\
-\t        Warm-up Time    : {} seconds\n\n\
+\t        Warm-up Time    : {} seconds\n\
+\tEarly Abort             : {}\n\
+\tObjectives              : {}\n\n\
 \tTotal Runs: {}\n\
 '.format(self.failure_threshold, self.target_file, self.load_start_rate,
          self.load_step_rate, self.load_test_time, self.load_rest_time,
-         self.service_warm_up_rate, self.service_warm_up_time, len(self.result_set))
+         self.service_warm_up_rate, self.service_warm_up_time,
+         'on' if self.early_abort else 'off',
+         ', '.join(objective.text for objective in self.objectives) or 'none', len(self.result_set))
         print(summary_str)
         with open(result_setting_file, 'w')as f:
             f.write(summary_str)
@@ -271,63 +1106,290 @@ class VegetaLoadTest(LoadTest):
         # The sorted results are saved to one CSV file for later processing
         with open(result_csv_file, 'w')as f:
             f.write('ID,Total_Requests,Request_Rate,Success%,Failure%,Time(s),Latency_Mean(s),'
-                    'Latency_50th(s),Latency_95th(s),Latency_99th(s),Latency_Max(s)\n')
+                    'Latency_50th(s),Latency_95th(s),Latency_99th(s),Latency_99.9th(s),'
+                    'Latency_99.99th(s),Latency_Max(s),Bound_By,Status_Codes\n')
+            writer = csv.writer(f, lineterminator='\n')
 
             print('\n\
 Requests                                         Latencies\n\
-ID  Total   Rate   Success%  Failure%  Time      Mean      50th      95th      99th      Max\n\
-==  ======  =====  ========  ========  ========  ========  ========  ========  ========  ========')
-            i = 1
-            for one_test in self.result_set:
-                success_rate = one_test['success'] * 100.0
-                failure_rate = 100.0 - success_rate
-                total_time, total_time_unit = self.evalute_time(one_test['duration'])
-                time_mean, time_unit_mean = self.evalute_time(one_test['latencies']['mean'])
-                time_50th, time_unit_50th = self.evalute_time(one_test['latencies']['50th'])
-                time_95th, time_unit_95th = self.evalute_time(one_test['latencies']['95th'])
-                time_99th, time_unit_99th = self.evalute_time(one_test['latencies']['99th'])
-                time_max,  time_unit_max  = self.evalute_time(one_test['latencies']['max'])
-
-                test_result = (i, one_test['requests'], int(one_test['rate']),
-                               success_rate, failure_rate,
-                               total_time, total_time_unit, time_mean, time_unit_mean,
-                               time_50th, time_unit_50th, time_95th, time_unit_95th,
-                               time_99th, time_unit_99th, time_max, time_unit_max)
+ID  Total   Rate   Success%  Failure%  Time      Mean      50th      95th      99th      99.9th    99.99th   Max       Bound by\n\
+==  ======  =====  ========  ========  ========  ========  ========  ========  ========  ========  ========  ========  ========')
+            for result in results:
+                test_result = [result.step, result.requests, int(result.rate), result.success_pct,
+                               result.failure_pct]
+                for value, unit in result.table_times():
+                    test_result += [value, unit]
 
                 format_str = '{0:2d}   {1:5d}  {2:5d}  '
-                format_str += '{3:3.4f}  ' if int(success_rate) == 100 else '{3:2.5f}  '
+                format_str += '{3:3.4f}  ' if int(result.success_pct) == 100 else '{3:2.5f}  '
 
-                if int(failure_rate) == 0:
+                if int(result.failure_pct) == 0:
                     format_str += '{4:<8.0f}  '
-                elif int(failure_rate) < 10:
+                elif int(result.failure_pct) < 10:
                     format_str += '{4:<1.6f}  '
                 else:
                     format_str += '{4:<2.5f}  '
 
-                csv_format_str = ','.join(format_str.split())
                 format_str += '{5:>5.3f}{6:2}  {7:>6.3f}{8:2}  {9:>6.3f}{10:2}  {11:>6.3f}{12:2}' \
-                              '  {13:>6.3f}{14:2}  {15:>6.3f}{16:2}'
-                print(format_str.format(*test_result))
+                              '  {13:>6.3f}{14:2}  {15:>6.3f}{16:2}  {17:>6.3f}{18:2}  {19:>6.3f}{20:2}'
+                print(format_str.format(*test_result) + '  ' + result.bound_by)
+
+                # the CSV file has all the times in seconds
+                writer.writerow([result.step, result.requests, int(result.rate), '{:.4f}'.format(result.success_pct),
+                                 '{:.4f}'.format(result.failure_pct)] +
+                                ['{:.6f}'.format(getattr(result, name) / 1e9)
+                                 for name in ('duration',) + StepResult.table_latencies] +
+                                [result.bound_by, ' '.join('{}:{}'.format(code, count)
+                                                           for code, count in sorted(result.status_codes.items()))])
+
+        self.breakdown_summary(results)
+        self.capacity_bound_summary()
+        if self.profile is not None:
+            self.endpoints_summary('{}_endpoints.csv'.format(result_name))
+        return 0
 
-                csv_result = (i, one_test['requests'], int(one_test['rate']), success_rate,
-                              failure_rate, total_time, time_mean, time_50th, time_95th,
-                              time_99th, time_max)
+    # --------------------------------------------------------------------------
+    def capacity_bound_summary(self):
+        """
+        Print what bounded the capacity: the objective of the lowest failing step above the best rate
+        """
+        best_rate = self.search_strategy.best_rate
+        if best_rate is None:
+            return
+        failed = [(rate, entry) for rate, entry in zip(self.attack_rates, self.result_set)
+                  if rate > best_rate and 'bound_by' in entry]
+        if failed:
+            rate, entry = min(failed, key=lambda item: item[0])
+            print('\n\tCapacity {} requests/second, bound by {}: missed at {} requests/second'.format(
+                best_rate, entry['bound_by']['objective'], rate))
 
-                csv_format_str += '{5:5.3f},{6:6.3f},{7:6.3f},{8:6.3f},{9:6.3f},{10:6.3f}\n'
-                f.write(csv_format_str.format(*csv_result))
-                i += 1
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def breakdown_summary(results: List[StepResult]):
+        """
+        Print the status codes and the errors of the steps that did not all succeed
+        """
+        failed = [result for result in results if result.success < 1.0 or result.errors]
+        if failed:
+            print('\n\tStatus codes and errors:')
+        for result in failed:
+            print('\t{:2d}  {}'.format(result.step, result.breakdown()))
 
+    # --------------------------------------------------------------------------
+    def endpoints_summary(self, result_csv_file):
+        print('\nPer-endpoint results are saved to {}'.format(result_csv_file))
+        print('\n\
+ID  Endpoint          Total   Success%  50th(ms)   99th(ms)   99.9th(ms)  Missed objectives\n\
+==  ================  ======  ========  =========  =========  ==========  =================')
+        with open(result_csv_file, 'w') as f:
+            f.write('ID,Endpoint,Total_Requests,Success%,Latency_50th(s),Latency_99th(s),Latency_99.9th(s),'
+                    'Missed_Objectives\n')
+            for i, one_test in enumerate(self.result_set, 1):
+                missed = {}
+                for item in one_test.get('missed_objectives', []):
+                    missed.setdefault(item['endpoint'], []).append(item['objective'])
+                for name, report in one_test.get('endpoints', {}).items():
+                    latencies = report['latencies']
+                    print('{:2d}  {:<16}  {:6d}  {:8.4f}  {:9.3f}  {:9.3f}  {:10.3f}  {}'.format(
+                        i, name, report['requests'], report['success'] * 100, latencies['50th'] / 1e6,
+                        latencies['99th'] / 1e6, latencies.get('99.9th', 0) / 1e6, ' '.join(missed.get(name, []))))
+                    f.write('{},{},{},{:.4f},{:.6f},{:.6f},{:.6f},{}\n'.format(
+                        i, name, report['requests'], report['success'] * 100, latencies['50th'] / 1e9,
+                        latencies['99th'] / 1e9, latencies.get('99.9th', 0) / 1e9, ' '.join(missed.get(name, []))))
         return 0
 
+
+###############################################################################
+class SimulatedLoadTest(VegetaLoadTest):
+    """
+    Runs the load test against SimulatedService instead of vegeta, to try the search
+    strategies offline. Nothing is sent over the network and nothing sleeps.
+    """
+    service = None
+
+    # --------------------------------------------------------------------------
+    def __init__(self, *args, capacity: int = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.service = SimulatedService(capacity)
+        self.adaptive_rest = False                                              # nothing to probe
+        self.client_monitor = None                                              # nor anything to sample
+        if self.soak_time is not None or self.shape is not None:
+            raise Exception(ErrorCode.badParameterType, "A soak test or a rate shape needs a real target")
+
+    # --------------------------------------------------------------------------
+    def check_vegeta_settings(self):
+        print('\nSimulated service with a capacity of {} requests/second\n'.format(self.service.capacity))
+        return 0
+
+    # --------------------------------------------------------------------------
+    def warm_up_load_test(self):
+        return 0
+
+    # --------------------------------------------------------------------------
+    def prepare_step(self, attack_rate, attack_time):
+        pass
+
+    # --------------------------------------------------------------------------
+    def run_load_step(self, attack_rate, attack_time):
+        print('\nSimulating: {} requests/second for {} seconds'.format(attack_rate, attack_time))
+        return 0, self.service.attack(attack_rate, attack_time)
+
     # --------------------------------------------------------------------------
-    # Evaluate time values
-    def evalute_time(self, time_value):
-        total_time = time_value / 1000000.0
-        time_unit = 'ms'
-        if total_time > 1000:
-            total_time /= 1000.0
-            time_unit = 's'
-        return total_time, time_unit
+    def rest_between_steps(self):
+        pass
+
+
+###############################################################################
+class AsyncLoadTest(VegetaLoadTest):
+    """
+    Runs every step with the in-process AsyncAttackEngine instead of the vegeta binary. The
+    targets are read from the same vegeta target file, and the steps give the same reports,
+    so the search, the summary and the results store work unchanged.
+    """
+    engine = None
+
+    # --------------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.profile is not None:
+            if self.target_order != 'sequential':
+                raise Exception(ErrorCode.badParameterType, "A workload profile sets the order of its requests itself")
+            self.engine = AsyncAttackEngine(self.profile.materialize())
+        else:
+            self.engine = AsyncAttackEngine(load_requests(self.target_file, self.target_order))
+        self.stream_results = True
+
+    # --------------------------------------------------------------------------
+    def create_coordinator(self, workers: int, worker_hosts: List[str]):
+        if workers > 1 or worker_hosts:
+            raise Exception(ErrorCode.badParameterType,
+                            "The async engine runs in this process only; use --engine pool for several cores")
+        return None
+
+    # --------------------------------------------------------------------------
+    def prepare_step(self, attack_rate, attack_time):
+        pass                                                                    # nothing to spawn
+
+    # --------------------------------------------------------------------------
+    def check_vegeta_settings(self):
+        LoadTest.check_python_version()
+        print('\nIn-process async engine, {} targets from {}\n'.format(len(self.engine.targets),
+                                                                      self.target_file))
+        return 0
+
+    # --------------------------------------------------------------------------
+    def warm_up_load_test(self):
+        if self.service_warm_up_time == 0:
+            print('\n\nSkip on warming up target service\'s JVM\n\n')
+            return 0
+
+        print('\n\nWarming up target service for {} requests/s and run for {} seconds ...\n'
+              .format(self.service_warm_up_rate, self.service_warm_up_time))
+        entry = self.engine.attack(self.service_warm_up_rate, self.service_warm_up_time).report()
+        print('\tSuccess: {:.2f}%, mean latency {:.3f}ms'.format(entry['success'] * 100,
+                                                               entry['latencies']['mean'] / 1e6))
+        self.prepare_step(self.load_start_rate, self.load_test_time)
+        self.rest_between_steps()
+        print("\tDone\n")
+        return 0
+
+    # --------------------------------------------------------------------------
+    def run_shaped_step(self, stats: ShapedStats) -> int:
+        """
+        Every request goes out at the time the shape makes it due
+        """
+        print('\nAttacking:  along the rate shape for {:.1f} seconds'.format(self.shape.duration))
+        self.watch_step(lambda: stats)
+        self.engine.attack(None, self.shape.duration, stats, shape=self.shape, on_start=stats.begin)
+        return 0 if stats.requests > 0 else ErrorCode.executeShellCommand
+
+    # --------------------------------------------------------------------------
+    def run_streaming_load_step(self, attack_rate, attack_time):
+        print('\nAttacking:  {} requests/second for {} seconds'.format(attack_rate, attack_time))
+        rule = EarlyAbortRule(self.failure_threshold, attack_rate * attack_time) if self.early_abort else None
+
+        stats = StreamStats()
+        self.watch_step(lambda: stats)
+        endpoint_stats = self.profile.endpoint_stats() if self.profile is not None else None
+        started = time.monotonic()
+        self.engine.attack(attack_rate, attack_time, stats, abort_rule=rule,
+                           target_stats=endpoint_stats.target_stats() if endpoint_stats is not None else None)
+        if stats.requests == 0:
+            return ErrorCode.executeShellCommand, None
+
+        entry = stats.report()
+        if endpoint_stats is not None:
+            entry['endpoints'] = endpoint_stats.reports()
+        if rule is not None and rule.tripped:
+            self.mark_early_abort(entry, rule, time.monotonic() - started, attack_time)
+        return 0, entry
+
+
+###############################################################################
+class ProcessPoolLoadTest(AsyncLoadTest):
+    """
+    Runs every step with the async engine in a pool of worker processes, one per core or as
+    many as --workers, so that a single machine can attack beyond what one core can send.
+    The warm-up stays on a single engine in this process.
+    """
+    pool = None
+
+    # --------------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.profile is not None:
+            raise Exception(ErrorCode.badParameterType,
+                            "The process pool cannot break results down per endpoint; use --engine async or vegeta")
+        if self.shape is not None:
+            raise Exception(ErrorCode.badParameterType,
+                            "The process pool cannot follow a rate shape; use --engine async or vegeta")
+        self.pool = ProcessPoolAttack(self.target_file, self.worker_count if self.worker_count > 1 else None,
+                                      self.target_order)
+        self.worker_count = self.pool.processes
+        self.search_strategy.max_rate = self.max_rate_per_process * self.worker_count
+
+    # --------------------------------------------------------------------------
+    def create_coordinator(self, workers: int, worker_hosts: List[str]):
+        if worker_hosts:
+            raise Exception(ErrorCode.badParameterType, "The process pool runs on this machine only")
+        return None
+
+    # --------------------------------------------------------------------------
+    def prepare_step(self, attack_rate, attack_time):
+        """
+        Spawn the worker processes of the next step, which load the targets and wait for it
+        """
+        self.pool.prepare(attack_rate, attack_time)
+
+    # --------------------------------------------------------------------------
+    def cancel_prepared(self):
+        self.pool.cancel()
+
+    # --------------------------------------------------------------------------
+    def check_vegeta_settings(self):
+        LoadTest.check_python_version()
+        print('\nAsync engine in {} worker processes, {} targets from {}\n'.format(
+            self.pool.processes, self.pool.target_count, self.target_file))
+        return 0
+
+    # --------------------------------------------------------------------------
+    def run_streaming_load_step(self, attack_rate, attack_time):
+        print('\nAttacking:  {} requests/second for {} seconds on {} processes'.format(
+            attack_rate, attack_time, self.pool.processes))
+        rule = EarlyAbortRule(self.failure_threshold, attack_rate * attack_time) if self.early_abort else None
+
+        self.watch_step(self.pool.live_stats)
+        started = time.monotonic()
+        stats = self.pool.attack(attack_rate, attack_time, abort_rule=rule)
+        if stats is None:
+            return ErrorCode.processAbnormalExit, None
+        if stats.requests == 0:
+            return ErrorCode.executeShellCommand, None
+
+        entry = stats.report()
+        if rule is not None and rule.tripped:
+            self.mark_early_abort(entry, rule, time.monotonic() - started, attack_time)
+        return 0, entry
 
 
 ###############################################################################
@@ -369,15 +1431,130 @@ def main(argv):
                       dest="rest_time", default=5, nargs='?',
                       help="Number of seconds to rest between two load runs. Optional. "
                            "Default is 5 seconds. Set to 0 to skip it.")
+    args.add_argument('--stream',              action="store_true",
+                      dest="stream_results", default=False,
+                      help="Read per-request results while each load test runs, with bounded memory. "
+                           "Optional. Default is to read vegeta's aggregated report at the end.")
+    args.add_argument('--exact_histogram',     action="store_true",
+                      dest="exact_histogram", default=False,
+                      help="Without --stream, decode every result of a load test into the latency histogram, "
+                           "for all the latencies at 1%% precision, instead of reading vegeta's aggregated "
+                           "reports. Costs CPU time per request. Optional.")
+    args.add_argument('--early_abort',         action="store_true",
+                      dest="early_abort", default=False,
+                      help="Stop a load test as soon as its failure rate clearly exceeds the threshold. "
+                           "Optional. Implies --stream.")
+    args.add_argument('--search',              type=str, action="store",
+                      dest="search", default='adaptive', choices=sorted(search_strategies),
+                      help="Strategy to search for the highest acceptable rate. Optional. "
+                           "Default is adaptive.")
+    args.add_argument('--simulate',            type=int, action="store",
+                      dest="simulate", default=None,
+                      help="Run against a simulated service with this capacity in requests/second "
+                           "instead of vegeta. Optional.")
+    args.add_argument('--workers',             type=int, action="store",
+                      dest="workers", default=0,
+                      help="Split each load test across this many local vegeta processes, each pinned "
+                           "to a core. Optional. Default is a single process.")
+    args.add_argument('--worker_hosts',        type=str, action="store",
+                      dest="worker_hosts", default=None,
+                      help="Comma-separated [user@]hosts to split each load test across, over SSH. "
+                           "Optional.")
+    args.add_argument('--engine',              type=str, action="store",
+                      dest="engine", default='vegeta', choices=['vegeta', 'async', 'pool'],
+                      help="Attack with the vegeta binary, with the in-process async engine, or with "
+                           "the async engine in one process per core (--workers sets how many). "
+                           "Optional. Default is vegeta.")
+    args.add_argument('--store',               type=str, action="store",
+                      dest="store_file", default=None,
+                      help="SQLite file that stores all runs and steps. Optional. "
+                           "Default is load_test_results.db next to the script.")
+    args.add_argument('--metrics_port',        type=int, action="store",
+                      dest="metrics_port", default=None,
+                      help="Publish live metrics in the Prometheus format on http://localhost:<port>/metrics "
+                           "while the test runs. Optional. Implies --stream with a single vegeta process.")
+    args.add_argument('--profile',             type=str, action="store",
+                      dest="profile_file", default=None,
+                      help="Workload profile to generate the targets from, with weights and objectives per "
+                           "endpoint, instead of --target_file. Optional. Implies --stream.")
+    args.add_argument('--slo',                 type=str, action="append",
+                      dest="objectives", default=None,
+                      help="Service level objective every load test must meet on top of the failure threshold, "
+                           "e.g. 'p99<250ms'. Repeat it for several, which must all be met. Optional.")
+    args.add_argument('--target_order',        type=str, action="store",
+                      dest="target_order", default='sequential', choices=target_orders,
+                      help="Order to send the targets in: as in the file, a shuffle, or sampled by the weights "
+                           "of a compiled corpus. Optional. Default is sequential.")
+    args.add_argument('--adaptive_rest',       action="store_true",
+                      dest="adaptive_rest", default=False,
+                      help="End the rest between two load tests as soon as the target has recovered, with "
+                           "--rest_time as the longest rest. Optional.")
+    args.add_argument('--soak',                type=str, action="store",
+                      dest="soak_time", default=None,
+                      help="Hold --start_rate for this long as a soak test, e.g. 12h or 2d, instead of searching "
+                           "for the highest rate. Optional. Implies --stream.")
+    args.add_argument('--soak_interval',       type=int, action="store",
+                      dest="soak_interval", default=10,
+                      help="Seconds per window of the soak test's time series. Optional. Default is 10.")
+    args.add_argument('--shape',               type=str, action="store",
+                      dest="shape", default=None,
+                      help="Send along a rate shape as one attack, e.g. 'ramp(100,2000,60) spikes(500,3000,20,2,120)' "
+                           "or 'replay(access.log,1,60)', instead of searching for the highest rate. See "
+                           "rate_shape.py. Optional. Implies --stream.")
+    args.add_argument('--shape_interval',      type=float, action="store",
+                      dest="shape_interval", default=1.0,
+                      help="Seconds per interval of the rate shape's time series. Optional. Default is 1.")
+    args.add_argument('--health_url',          type=str, action="store",
+                      dest="health_url", default=None,
+                      help="URL to probe the target with for --adaptive_rest. Optional. "
+                           "Default is the first GET target.")
+    args.add_argument('--resume',              type=int, action="store",
+                      dest="resume_run", default=None,
+                      help="Continue this run of the results store from its last step, with the arguments "
+                           "it was started with. Arguments given here override them; --slo given here replaces all the "
+                           "objectives of the run. Optional.")
 
     if len(argv) == 1:
         args.print_help()
         return ErrorCode.emptyCommandLineParameters
 
-    given_args = args.parse_args()
-    test_run = VegetaLoadTest(given_args.target_file, given_args.failure_threshold,
-                              given_args.start_rate, given_args.test_time, given_args.step_rate,
-                              given_args.warm_up_rate, given_args.warm_up_time, given_args.rest_time)
+    given_args = args.parse_args(argv[1:])
+    if given_args.resume_run is not None:
+        store = ResultsStore(given_args.store_file)
+        try:
+            settings = store.run_settings(given_args.resume_run)
+        finally:
+            store.close()
+        if not settings:
+            raise Exception(ErrorCode.valueOutOfRange, "No run {} in the results store".format(given_args.resume_run))
+        command_line = json.loads(settings.get('command_line', 'null'))
+        if command_line is None:
+            raise Exception(ErrorCode.valueOutOfRange,
+                            "Run {} was not stored with its command line".format(given_args.resume_run))
+        given_objectives = given_args.objectives
+        given_args = args.parse_args(command_line + argv[1:])
+        if given_objectives is not None:                                        # --slo appends; replace instead
+            given_args.objectives = given_objectives
+    test_args = (given_args.target_file, given_args.failure_threshold,
+                 given_args.start_rate, given_args.test_time, given_args.step_rate,
+                 given_args.warm_up_rate, given_args.warm_up_time, given_args.rest_time,
+                 given_args.stream_results, given_args.early_abort, given_args.search,
+                 given_args.workers,
+                 given_args.worker_hosts.split(',') if given_args.worker_hosts else None,
+                 given_args.store_file, given_args.metrics_port, given_args.target_order,
+                 given_args.profile_file, given_args.objectives, given_args.adaptive_rest,
+                 given_args.health_url,
+                 parse_soak_time(given_args.soak_time) if given_args.soak_time else None,
+                 given_args.soak_interval, given_args.resume_run, argv[1:], given_args.shape,
+                 given_args.shape_interval, given_args.exact_histogram)
+    if given_args.simulate:
+        test_run = SimulatedLoadTest(*test_args, capacity=given_args.simulate)
+    elif given_args.engine == 'async':
+        test_run = AsyncLoadTest(*test_args)
+    elif given_args.engine == 'pool':
+        test_run = ProcessPoolLoadTest(*test_args)
+    else:
+        test_run = VegetaLoadTest(*test_args)
 
     return test_run.execute_tests()
 
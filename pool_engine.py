@@ -0,0 +1,326 @@
+"""
+Multi-core attack: the async engine in a pool of processes, one event loop per core.
+
+The rate is split across the worker processes, and their schedules are interleaved, so that
+together they send at the requested rate with even gaps. Workers do not send their results
+to the parent one by one; each worker owns a block of shared memory with its counters, its
+status codes and its latency histogram, and republishes it several times per second. The
+parent reads the blocks while the step runs (for the early-abort check) and merges them
+into one StreamStats at the end, which gives the usual step report.
+"""
+
+import json
+import math
+import time
+import struct
+import threading
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+from async_engine import AsyncAttackEngine
+from distributed import DistributedAttack
+from latency_histogram import LatencyHistogram
+from vegeta_stream import StreamStats
+from target_corpus import load_requests
+from utils import *
+
+
+###############################################################################
+class SharedStats:
+    """
+    StreamStats totals of one worker in shared memory. The worker is the only writer of the
+    totals; a generation counter, odd while a write is going on, lets the parent read a
+    consistent copy without locks (a seqlock). The stop flag is the only field the parent writes.
+
+    Layout: generation, stop flag, totals, status code counts, histogram counts, errors as json
+    """
+    control = struct.Struct('<QQ')
+    totals_header = struct.Struct('<QQQQQQQQQdddQdd')
+    max_status_code = 600
+    error_bytes = 4096
+
+    # --------------------------------------------------------------------------
+    def __init__(self, name: str = None):
+        """
+        :param name: the shared memory block to attach to. None to create a new one
+        """
+        self.histogram_length = len(LatencyHistogram().counts)
+        self.codes_offset = self.control.size + self.totals_header.size
+        self.histogram_offset = self.codes_offset + 8 * self.max_status_code
+        self.errors_offset = self.histogram_offset + 8 * self.histogram_length
+        size = self.errors_offset + self.error_bytes
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.codes = self.shm.buf[self.codes_offset:self.histogram_offset].cast('Q')
+        self.histogram = self.shm.buf[self.histogram_offset:self.errors_offset].cast('Q')
+        self.generation = 0
+
+    # --------------------------------------------------------------------------
+    def close(self, unlink: bool = False):
+        self.codes.release()
+        self.histogram.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    # --------------------------------------------------------------------------
+    def request_stop(self):
+        struct.pack_into('<Q', self.shm.buf, 8, 1)
+
+    # --------------------------------------------------------------------------
+    def stop_requested(self) -> bool:
+        return struct.unpack_from('<Q', self.shm.buf, 8)[0] != 0
+
+    # --------------------------------------------------------------------------
+    def publish(self, stats: StreamStats):
+        """
+        Worker side: copy the current totals of stats into shared memory
+        """
+        buf = self.shm.buf
+        self.generation += 1
+        struct.pack_into('<Q', buf, 0, self.generation)                          # odd: writing
+
+        codes = array('Q', bytes(8 * self.max_status_code))
+        for code, count in stats.status_codes.items():
+            codes[min(int(code), self.max_status_code - 1)] += count
+        self.codes[:] = memoryview(codes)
+        self.histogram[:] = memoryview(stats.latencies.counts)
+        error_counts = stats.errors
+        errors = json.dumps(error_counts).encode('utf-8')
+        while len(errors) > self.error_bytes:
+            error_counts = dict(list(error_counts.items())[:len(error_counts) // 2])
+            errors = json.dumps(error_counts).encode('utf-8')
+        buf[self.errors_offset:self.errors_offset + len(errors)] = errors
+
+        histogram = stats.latencies
+        self.totals_header.pack_into(buf, self.control.size,
+                                     stats.requests, stats.success, stats.bytes_in, stats.bytes_out,
+                                     histogram.total_count, histogram.total_value, histogram.min_value,
+                                     histogram.max_recorded, len(errors),
+                                     math.nan if stats.earliest is None else stats.earliest,
+                                     math.nan if stats.latest is None else stats.latest,
+                                     math.nan if stats.end is None else stats.end,
+                                     stats.scheduled, stats.lateness_total, stats.lateness_max)
+        self.generation += 1
+        struct.pack_into('<Q', buf, 0, self.generation)                          # even: consistent
+
+    # --------------------------------------------------------------------------
+    def totals(self) -> Tuple[int, int]:
+        """
+        Parent side, cheap: requests and successes so far, from one consistent write
+        """
+        while True:
+            generation = struct.unpack_from('<Q', self.shm.buf, 0)[0]
+            if generation % 2:
+                time.sleep(0.001)
+                continue
+            totals = struct.unpack_from('<QQ', self.shm.buf, self.control.size)
+            if struct.unpack_from('<Q', self.shm.buf, 0)[0] == generation:
+                return totals
+
+    # --------------------------------------------------------------------------
+    def read(self) -> StreamStats:
+        """
+        Parent side: a consistent copy of the worker's totals
+        """
+        while True:
+            generation = struct.unpack_from('<Q', self.shm.buf, 0)[0]
+            if generation % 2:
+                time.sleep(0.001)
+                continue
+            fields = self.totals_header.unpack_from(self.shm.buf, self.control.size)
+            codes = self.codes.tolist()
+            counts = bytes(self.histogram)
+            errors = bytes(self.shm.buf[self.errors_offset:self.errors_offset + fields[8]])
+            if struct.unpack_from('<Q', self.shm.buf, 0)[0] == generation:
+                break
+
+        stats = StreamStats()
+        (stats.requests, stats.success, stats.bytes_in, stats.bytes_out, total_count,
+         total_value, min_value, max_recorded, _, earliest, latest, end,
+         stats.scheduled, stats.lateness_total, stats.lateness_max) = fields
+        histogram = stats.latencies
+        histogram.counts = array('Q', counts)
+        histogram.total_count, histogram.total_value = total_count, total_value
+        histogram.min_value, histogram.max_recorded = min_value, max_recorded
+        stats.status_codes = {str(code): count for code, count in enumerate(codes) if count}
+        stats.errors = json.loads(errors) if errors else {}
+        stats.earliest = None if math.isnan(earliest) else earliest
+        stats.latest = None if math.isnan(latest) else latest
+        stats.end = None if math.isnan(end) else end
+        return stats
+
+
+###############################################################################
+def attack_worker(shm_name: str, target_file: str, target_order: str, rate: int, duration: float,
+                  phase: float, first_target: int, core: int, barrier):
+    """
+    Body of one worker process
+    """
+    if core is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {core})
+    shared = SharedStats(shm_name)
+    try:
+        engine = AsyncAttackEngine(load_requests(target_file, target_order))
+        stats = StreamStats()
+
+        def on_tick():
+            shared.publish(stats)
+            return shared.stop_requested()
+
+        barrier.wait()
+        try:
+            engine.attack(rate, duration, stats, on_tick=on_tick, phase=phase, first_target=first_target)
+        finally:
+            shared.publish(stats)
+    finally:
+        shared.close()
+
+
+###############################################################################
+class ProcessPoolAttack:
+    poll_interval = 0.25                                                        # seconds
+    start_timeout = 30                                                          # seconds
+
+    # --------------------------------------------------------------------------
+    def __init__(self, target_file: str, processes: int = None, target_order: str = 'sequential'):
+        """
+        :param target_file: vegeta target file or compiled target corpus
+        :param processes: number of worker processes. Default is one per core
+        :param target_order: order of the targets, see target_corpus.py. Every worker uses the same one
+        """
+        self.target_file = target_file
+        self.target_order = target_order
+        self.processes = processes or os.cpu_count() or 1
+        self.target_count = len(load_requests(target_file))
+        self.lock = threading.Lock()
+        self.running = []
+        self.prepared = None
+
+    # --------------------------------------------------------------------------
+    def live_stats(self) -> StreamStats:
+        """
+        :return: the merged statistics of the running attack so far, None if there is none.
+                 Safe to call from another thread.
+        """
+        with self.lock:
+            if not self.running:
+                return None
+            stats = StreamStats()
+            for block in self.running:
+                stats.merge(block.read())
+            return stats
+
+    # --------------------------------------------------------------------------
+    def spawn(self, rate: int, duration: float) -> Tuple[list, list, Any]:
+        """
+        Start the workers of an attack; they load the targets and wait at the barrier
+        :return: the shared memory blocks, the worker processes and the barrier
+        """
+        rates = [r for r in DistributedAttack.split_rate(rate, self.processes) if r > 0]
+        cores = os.cpu_count() or 1
+        barrier = multiprocessing.Barrier(len(rates) + 1)
+        shared = []
+        workers = []
+        try:
+            for i, worker_rate in enumerate(rates):
+                block = SharedStats()
+                shared.append(block)
+                # worker i sends the i-th of every len(rates) requests of the combined schedule
+                worker = multiprocessing.Process(
+                    target=attack_worker, daemon=True,
+                    args=(block.name, self.target_file, self.target_order, worker_rate, duration, i / rate,
+                          i % self.target_count, i % cores, barrier))
+                worker.start()
+                workers.append(worker)
+        except BaseException:
+            self.release_workers(shared, workers)
+            raise
+        return shared, workers, barrier
+
+    # --------------------------------------------------------------------------
+    def prepare(self, rate: int, duration: float):
+        """
+        Spawn the workers of the next attack ahead of time, e.g. while the target rests.
+        attack() with the same rate and duration releases them instead of spawning its own.
+        """
+        self.cancel()
+        self.prepared = (rate, duration, self.spawn(rate, duration))
+
+    # --------------------------------------------------------------------------
+    def cancel(self):
+        """
+        Stop the prepared workers, if any
+        """
+        if self.prepared is not None:
+            shared, workers, _ = self.prepared[2]
+            self.prepared = None
+            self.release_workers(shared, workers)
+
+    # --------------------------------------------------------------------------
+    def release_workers(self, shared: list, workers: list):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        with self.lock:
+            self.running = []
+            for block in shared:
+                block.close(unlink=True)
+
+    # --------------------------------------------------------------------------
+    def attack(self, rate: int, duration: float, abort_rule=None) -> StreamStats:
+        """
+        :param abort_rule: optional EarlyAbortRule. It is checked while the workers still send;
+                           once the schedule is over they only wait for the requests in flight,
+                           and there is nothing left to stop
+        :return: the merged statistics of all the workers, None if a worker exited before the start
+                 or failed
+        """
+        if self.prepared is not None and self.prepared[:2] == (rate, duration):
+            shared, workers, barrier = self.prepared[2]
+            self.prepared = None
+        else:
+            self.cancel()
+            shared, workers, barrier = self.spawn(rate, duration)
+        try:
+            try:
+                barrier.wait(self.start_timeout)
+            except threading.BrokenBarrierError:
+                exit_codes = [worker.exitcode for worker in workers if worker.exitcode is not None]
+                print('\tThe worker processes did not start: {} of {} exited, exit status {}'.format(
+                    len(exit_codes), len(workers), ', '.join(str(code) for code in exit_codes) or 'none'))
+                return None
+            self.running = shared
+            started = time.monotonic()
+
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(self.poll_interval)
+                if abort_rule is None or abort_rule.tripped or time.monotonic() - started >= duration:
+                    continue
+                total = success = 0
+                for block in shared:
+                    worker_total, worker_success = block.totals()
+                    total += worker_total
+                    success += worker_success
+                if abort_rule.check(total, success):
+                    for block in shared:
+                        block.request_stop()
+
+            for worker in workers:
+                worker.join()
+            exit_codes = [worker.exitcode for worker in workers]
+            if any(exit_codes):
+                print('\tThe worker processes failed: exit status {}'.format(
+                    ', '.join(str(code) for code in exit_codes)))
+                return None
+            stats = StreamStats()
+            for block in shared:
+                stats.merge(block.read())
+            return stats
+        finally:
+            self.release_workers(shared, workers)
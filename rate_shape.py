@@ -0,0 +1,534 @@
+"""
+Rate shapes: one attack whose rate follows a function of time, for the bursts and the daily
+ramps that a constant rate per step never shows.
+
+A shape is a sequence of segments, one after the other, written as e.g.
+
+    ramp(100,2000,60) hold(2000,30) spikes(500,3000,20,2,120) sine(1000,500,60,300)
+
+- hold(rate,seconds) - a constant rate
+- ramp(from,to,seconds) - a linear ramp
+- sine(base,amplitude,period,seconds) - base + amplitude * sin(2 pi t / period), never below 0
+- spikes(base,peak,every,width,seconds) - the base rate, with a spike to the peak rate for the
+  last `width` seconds of every `every` seconds
+- replay(file[,bucket[,speed[,scale]]]) - the rate curve of an access log: its requests are
+  counted per `bucket` seconds (1) by their timestamps, in common or combined log format,
+  ISO 8601, or epoch seconds at the start of the line. The curve is replayed `speed` times
+  faster (1) and its rates multiplied by `scale` (1)
+
+Durations are in seconds, or with units, e.g. 90s, 5m or 2h. The async engine sends every
+request at the time the shape makes it due, an open model like that of a constant rate. The
+vegeta binary only knows a constant rate, so it follows the shape one interval at a time, at
+the mean rate of the shape over the interval; the attack of the next interval is spawned while
+the one before runs.
+
+ShapedStats keeps the results of each interval of the shape apart, by the time their request
+was due, and writes them as one line of a CSV time series per interval next to the rate the
+shape asked for:
+
+    interval,start,target_rate,rate,throughput,error%,p50_ms,p90_ms,p99_ms,max_ms
+
+Only the intervals that responses may still arrive for (up to the timeout) are open, so the
+memory does not grow with the length of the shape. analyse_shape() then finds
+
+- where the service fell behind: the intervals whose throughput was below 95% of the rate
+  the shape asked for, e.g. while an autoscaler was still adding capacity
+- the spikes, wherever the rate jumps by half or more, and for each how long after its end
+  the p99 latency and the error rate took to get back to what they were before it
+"""
+
+import re
+import abc
+import math
+import bisect
+import statistics
+from array import array
+from datetime import datetime
+from latency_histogram import LatencyHistogram
+from soak_test import parse_soak_time
+from vegeta_stream import StreamStats
+from utils import *
+
+
+###############################################################################
+def parse_seconds(value: str) -> float:
+    """
+    :param value: seconds, or a duration with units, e.g. 90s, 5m or 2h
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return float(parse_soak_time(value))
+
+
+###############################################################################
+class Segment(abc.ABC):
+    """
+    A piece of a rate shape, from its local time 0 to seconds
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise Exception(ErrorCode.valueOutOfRange, "A segment of a rate shape must last some time")
+        self.seconds = seconds
+
+    # --------------------------------------------------------------------------
+    @abc.abstractmethod
+    def rate(self, t: float) -> float:
+        """
+        :return: the rate at local time t, in requests/second
+        """
+
+    # --------------------------------------------------------------------------
+    @abc.abstractmethod
+    def peak(self) -> float:
+        """
+        :return: the highest rate of the segment
+        """
+
+
+###############################################################################
+class Hold(Segment):
+    # --------------------------------------------------------------------------
+    def __init__(self, rate: float, seconds: float):
+        super().__init__(seconds)
+        self.value = rate
+
+    # --------------------------------------------------------------------------
+    def rate(self, t: float) -> float:
+        return self.value
+
+    # --------------------------------------------------------------------------
+    def peak(self) -> float:
+        return self.value
+
+
+###############################################################################
+class Ramp(Segment):
+    # --------------------------------------------------------------------------
+    def __init__(self, start_rate: float, end_rate: float, seconds: float):
+        super().__init__(seconds)
+        self.start_rate = start_rate
+        self.end_rate = end_rate
+
+    # --------------------------------------------------------------------------
+    def rate(self, t: float) -> float:
+        return self.start_rate + (self.end_rate - self.start_rate) * t / self.seconds
+
+    # --------------------------------------------------------------------------
+    def peak(self) -> float:
+        return max(self.start_rate, self.end_rate)
+
+
+###############################################################################
+class Sine(Segment):
+    # --------------------------------------------------------------------------
+    def __init__(self, base: float, amplitude: float, period: float, seconds: float):
+        super().__init__(seconds)
+        if period <= 0:
+            raise Exception(ErrorCode.valueOutOfRange, "The period of a sine must be positive")
+        self.base = base
+        self.amplitude = amplitude
+        self.period = period
+
+    # --------------------------------------------------------------------------
+    def rate(self, t: float) -> float:
+        return max(0.0, self.base + self.amplitude * math.sin(2 * math.pi * t / self.period))
+
+    # --------------------------------------------------------------------------
+    def peak(self) -> float:
+        quarter = self.period / 4                                               # the crest
+        return self.rate(quarter) if quarter < self.seconds else self.rate(self.seconds)
+
+
+###############################################################################
+class Spikes(Segment):
+    # --------------------------------------------------------------------------
+    def __init__(self, base: float, peak: float, every: float, width: float, seconds: float):
+        super().__init__(seconds)
+        if not 0 < width < every:
+            raise Exception(ErrorCode.valueOutOfRange, "A spike must be shorter than the time between two")
+        self.base = base
+        self.peak_rate = peak
+        self.every = every
+        self.width = width
+
+    # --------------------------------------------------------------------------
+    def rate(self, t: float) -> float:
+        return self.peak_rate if t % self.every >= self.every - self.width else self.base
+
+    # --------------------------------------------------------------------------
+    def peak(self) -> float:
+        return max(self.base, self.peak_rate) if self.seconds > self.every - self.width else self.base
+
+
+###############################################################################
+class Replay(Segment):
+    """
+    A piecewise constant rate, one value per bucket
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, rates: List[float], bucket: float):
+        super().__init__(len(rates) * bucket)
+        self.rates = rates
+        self.bucket = bucket
+
+    # --------------------------------------------------------------------------
+    def rate(self, t: float) -> float:
+        return self.rates[min(int(t / self.bucket), len(self.rates) - 1)]
+
+    # --------------------------------------------------------------------------
+    def peak(self) -> float:
+        return max(self.rates)
+
+
+###############################################################################
+common_log_time = re.compile(r'\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}(?: [+-]\d{4})?)\]')
+iso_time = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?')
+epoch_time = re.compile(r'^\s*(\d{9,10}(?:\.\d+)?|\d{12,13})\b')
+
+
+###############################################################################
+def log_timestamp(line: str) -> Optional[float]:
+    """
+    :return: the POSIX timestamp of an access log line, None if it has none
+    """
+    match = common_log_time.search(line)
+    if match:
+        value = match.group(1)
+        return datetime.strptime(value, '%d/%b/%Y:%H:%M:%S %z' if ' ' in value else '%d/%b/%Y:%H:%M:%S').timestamp()
+    match = epoch_time.match(line)
+    if match:
+        value = float(match.group(1))
+        return value / 1000 if value > 1e11 else value                          # in milliseconds
+    match = iso_time.search(line)
+    if match:
+        value = match.group(0).replace(',', '.').replace(' ', 'T')
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        dot = value.find('.')
+        if dot > 0:                                                             # at most microseconds
+            end = dot + 1
+            while end < len(value) and value[end].isdigit():
+                end += 1
+            value = value[:dot + 1] + value[dot + 1:end][:6] + value[end:]
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+###############################################################################
+def access_log_rates(log_file: str, bucket: float = 1.0) -> List[float]:
+    """
+    :return: the requests/second of each bucket of the access log, from its first to its last request
+    """
+    if not os.path.exists(log_file):
+        raise Exception(ErrorCode.fileNotExist, "Cannot find access log {}".format(log_file))
+    counts = {}
+    first = None
+    with open(log_file, 'r', errors='replace') as f:
+        for line in f:
+            timestamp = log_timestamp(line)
+            if timestamp is None:
+                continue
+            if first is None:
+                first = timestamp
+            index = math.floor((timestamp - first) / bucket)                     # before the first if out of order
+            counts[index] = counts.get(index, 0) + 1
+    if not counts:
+        raise Exception(ErrorCode.emptyParameter, "No timestamps found in access log {}".format(log_file))
+    low, high = min(counts), max(counts)
+    return [counts.get(index, 0) / bucket for index in range(low, high + 1)]
+
+
+###############################################################################
+class RateShape:
+    """
+    Requests/second as a function of the time since the start of the attack
+    """
+    kinds = {'hold': Hold, 'ramp': Ramp, 'sine': Sine, 'spikes': Spikes}
+    durations = {'hold': {1}, 'ramp': {2}, 'sine': {2, 3}, 'spikes': {2, 3, 4}}   # the arguments that are times
+    min_rate = 0.001                                                            # below it, nothing is sent
+    resolution = 0.01                                                           # seconds, to integrate the rate
+
+    # --------------------------------------------------------------------------
+    def __init__(self, segments: List[Segment], text: str = ''):
+        if not segments:
+            raise Exception(ErrorCode.emptyParameter, "A rate shape needs at least one segment")
+        self.segments = segments
+        self.text = text
+        self.starts = []
+        start = 0.0
+        for segment in segments:
+            self.starts.append(start)
+            start += segment.seconds
+        self.duration = start
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def parse(cls, text: str) -> 'RateShape':
+        """
+        :param text: the segments, e.g. 'ramp(100,2000,60) hold(2000,30)', see the module's docstring
+        """
+        segments = []
+        position = 0
+        for match in re.finditer(r'(\w+)\s*\(([^)]*)\)', text):
+            if text[position:match.start()].strip(' +,;'):
+                break
+            position = match.end()
+            kind = match.group(1).lower()
+            arguments = [argument.strip() for argument in match.group(2).split(',')]
+            try:
+                if kind == 'replay':
+                    if not 1 <= len(arguments) <= 4:
+                        raise ValueError
+                    options = [parse_seconds(value) if i == 0 else float(value)
+                               for i, value in enumerate(arguments[1:])]
+                    bucket, speed, scale = options + [1.0] * (3 - len(options))
+                    if bucket <= 0 or speed <= 0 or scale < 0:
+                        raise ValueError
+                    rates = access_log_rates(arguments[0], bucket)
+                    segments.append(Replay([rate * scale for rate in rates], bucket / speed))
+                elif kind in cls.kinds:
+                    values = [parse_seconds(value) if i in cls.durations[kind] else float(value)
+                              for i, value in enumerate(arguments)]
+                    if any(value < 0 for value in values):
+                        raise ValueError
+                    segments.append(cls.kinds[kind](*values))
+                else:
+                    raise Exception(ErrorCode.badParameterType, "Unknown segment {} in the rate shape {}; "
+                                    "use hold, ramp, sine, spikes or replay".format(kind, text))
+            except (ValueError, TypeError):
+                raise Exception(ErrorCode.badParameterType, "Bad arguments of {} in the rate shape {}"
+                                .format(match.group(0), text))
+        if text[position:].strip(' +,;'):
+            raise Exception(ErrorCode.badParameterType, "Cannot parse the rate shape {} from: {}"
+                            .format(text, text[position:].strip()))
+        return cls(segments, text)
+
+    # --------------------------------------------------------------------------
+    def rate(self, t: float) -> float:
+        if t < 0 or t >= self.duration:
+            return 0.0
+        index = bisect.bisect_right(self.starts, t) - 1
+        return self.segments[index].rate(t - self.starts[index])
+
+    # --------------------------------------------------------------------------
+    def requests(self, start: float = 0.0, end: float = None) -> float:
+        """
+        :return: the number of requests the shape sends between two times, by the midpoint rule
+        """
+        end = self.duration if end is None else end
+        if end <= start:
+            return 0.0
+        steps = max(1, int(math.ceil((end - start) / self.resolution)))
+        width = (end - start) / steps
+        return sum(self.rate(start + (i + 0.5) * width) for i in range(steps)) * width
+
+    # --------------------------------------------------------------------------
+    def mean_rate(self, start: float, end: float) -> float:
+        return self.requests(start, end) / (end - start) if end > start else 0.0
+
+    # --------------------------------------------------------------------------
+    def peak_rate(self) -> float:
+        return max(segment.peak() for segment in self.segments)
+
+    # --------------------------------------------------------------------------
+    def offsets(self) -> Iterator[float]:
+        """
+        :return: the times, in seconds from the start, at which the requests are due. Each is
+                 one request after the one before, at the rate half way between them
+        """
+        t = 0.0
+        while t < self.duration:
+            rate = self.rate(t)
+            if rate < self.min_rate:
+                t += self.resolution                                            # idle; look again a bit later
+                continue
+            yield t
+            step = 1.0 / rate
+            middle = self.rate(t + step / 2)
+            t += step if middle < self.min_rate else 1.0 / middle
+
+
+###############################################################################
+class ShapedStats(StreamStats):
+    """
+    StreamStats of a shaped attack, which keep the results of every interval of the shape apart
+    as well, by the time their request was due, and write them to a CSV time series
+    """
+    columns = ['interval', 'start', 'target_rate', 'rate', 'throughput', 'error%', 'p50_ms', 'p90_ms', 'p99_ms',
+               'max_ms']
+    quantiles = [0.5, 0.9, 0.99]
+
+    # --------------------------------------------------------------------------
+    def __init__(self, shape: RateShape, interval: float, series_file: str, timeout: float = 30.0):
+        """
+        :param interval: seconds per interval of the time series
+        :param timeout: seconds after which no more responses come for a request; the intervals
+                        older than that are closed
+        """
+        super().__init__()
+        self.shape = shape
+        self.interval = interval
+        self.count = max(1, int(math.ceil(shape.duration / interval - 1e-9)))
+        self.lag = int(math.ceil(timeout / interval)) + 1
+        self.origin = None                                                      # wall time of the shape's start
+        self.current = None                                                     # the interval, if not by time
+        self.open = {}                                                          # index: [requests, success, histogram]
+        self.spare = []
+        self.newest = -1
+        self.closed = 0                                                         # the intervals before are written
+        self.late = 0
+        self.series = {name: array('d') for name in self.columns}
+        self.series_file = series_file
+        self.file = open(series_file, 'w', buffering=1)
+        self.file.write(','.join(self.columns) + '\n')
+
+    # --------------------------------------------------------------------------
+    def begin(self, origin: float):
+        """
+        :param origin: the POSIX time at which the shape starts
+        """
+        self.origin = origin
+
+    # --------------------------------------------------------------------------
+    def record(self, code: int, latency: int, bytes_in: int = 0, bytes_out: int = 0, error: str = None,
+               started: float = None, now: float = None, due: float = None):
+        super().record(code, latency, bytes_in, bytes_out, error, started, now, due)
+        due = started if due is None else due
+        if self.current is not None:
+            index = self.current
+        elif due is not None and self.origin is not None:
+            index = min(max(int((due - self.origin) / self.interval), 0), self.count - 1)
+        else:
+            return
+        if index < self.closed:
+            self.late += 1                                                      # in the totals only
+            return
+        window = self.open.get(index)
+        if window is None:
+            window = self.open[index] = self.spare.pop() if self.spare else [0, 0, LatencyHistogram()]
+        window[0] += 1
+        if 200 <= code < 400:
+            window[1] += 1
+        window[2].record(latency)
+        if index > self.newest:
+            self.newest = index
+            self.close_until(index - self.lag)
+
+    # --------------------------------------------------------------------------
+    def close_until(self, end: int):
+        """
+        Write the intervals before end, which no more results come for
+        """
+        while self.closed < min(end, self.count):
+            self.close_window(self.closed)
+            self.closed += 1
+
+    # --------------------------------------------------------------------------
+    def close_window(self, index: int):
+        window = self.open.pop(index, None)
+        requests, success = (window[0], window[1]) if window is not None else (0, 0)
+        start = index * self.interval
+        seconds = min(self.interval, self.shape.duration - start)
+        if window is not None:
+            p50, p90, p99 = window[2].quantiles(self.quantiles)
+            latency_max = window[2].max_recorded
+        else:
+            p50 = p90 = p99 = latency_max = 0
+        row = {'interval': index,
+               'start': start,
+               'target_rate': self.shape.mean_rate(start, start + seconds),
+               'rate': requests / seconds,
+               'throughput': success / seconds,
+               'error%': 100.0 * (requests - success) / requests if requests else 0.0,
+               'p50_ms': p50 / 1e6,
+               'p90_ms': p90 / 1e6,
+               'p99_ms': p99 / 1e6,
+               'max_ms': latency_max / 1e6}
+        for name in self.columns:
+            self.series[name].append(row[name])
+        self.file.write(','.join(str(index) if name == 'interval' else '{:.3f}'.format(row[name])
+                                 for name in self.columns) + '\n')
+        if window is not None:
+            window[0] = window[1] = 0
+            window[2].reset()
+            self.spare.append(window)
+
+    # --------------------------------------------------------------------------
+    def finish(self):
+        """
+        Write the intervals still open, and close the time series
+        """
+        self.close_until(self.count)
+        self.file.close()
+
+
+###############################################################################
+def analyse_shape(series: Dict[str, array], interval: float, keep_up: float = 0.95, spike_factor: float = 1.5,
+                  latency_tolerance: float = 1.5, failure_margin: float = 1.0, baseline_intervals: int = 5) -> dict:
+    """
+    :param series: the columns of the time series, see ShapedStats
+    :param keep_up: the service fell behind in an interval whose throughput is below this share of its target
+    :param spike_factor: a spike is a run of intervals whose target is at least this many times that before it
+    :param latency_tolerance: the service recovered from a spike once the p99 is within this many times that
+                              before the spike ...
+    :param failure_margin: ... and the error rate within this many percent of it
+    :param baseline_intervals: the intervals before a spike that tell what the service was like
+    :return: where the service fell behind, and the spikes with their recovery times. A spike the shape
+             ends with is not watched, and does not count for whether the service recovered
+    """
+    count = len(series['interval'])
+    target = series['target_rate']
+    behind = [i for i in range(count) if target[i] >= 1 and series['throughput'][i] < target[i] * keep_up]
+    kept_up = [target[i] for i in sorted(set(range(count)) - set(behind)) if target[i] >= 1]
+
+    spikes = []
+    i = 1
+    while i < count:
+        before = target[i - 1]
+        if before >= 1 and target[i] >= before * spike_factor:
+            end = i
+            while end < count and target[end] >= before * spike_factor:
+                end += 1
+            spikes.append((i, end, before))
+            i = end
+        else:
+            i += 1
+
+    spike_reports = []
+    for number, (start, end, before) in enumerate(spikes):
+        baseline = list(range(max(0, start - baseline_intervals), start))
+        p99_before = statistics.median(series['p99_ms'][j] for j in baseline)
+        errors_before = statistics.median(series['error%'][j] for j in baseline)
+        limit = spikes[number + 1][0] if number + 1 < len(spikes) else count
+        recovered = None
+        for j in range(end, limit):
+            if series['p99_ms'][j] <= p99_before * latency_tolerance and \
+                    series['error%'][j] <= errors_before + failure_margin and \
+                    series['throughput'][j] >= target[j] * keep_up:
+                recovered = j
+                break
+        spike_reports.append({'start': start * interval,
+                              'end': end * interval,
+                              'rate_before': before,
+                              'peak_rate': max(target[start:end]),
+                              'p99_before_ms': p99_before,
+                              'p99_peak_ms': max(series['p99_ms'][start:limit]),
+                              'error%_peak': max(series['error%'][start:limit]),
+                              'recovery_s': None if recovered is None else (recovered - end) * interval,
+                              'watched_s': (limit - end) * interval,
+                              'watched': limit > end})
+    return {'intervals': count,
+            'interval': interval,
+            'behind': len(behind),
+            'first_behind_s': behind[0] * interval if behind else None,
+            'behind_from_rate': min(target[i] for i in behind) if behind else None,
+            'kept_up_to_rate': max(kept_up) if kept_up else None,
+            'spikes': spike_reports,
+            'recovered': all(spike['recovery_s'] is not None for spike in spike_reports if spike['watched'])}
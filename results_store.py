@@ -0,0 +1,325 @@
+"""
+Persistent store of load test runs, in one SQLite file.
+
+Every run gets a row in `runs`, its settings go to `settings`, and each load step is written
+to `steps` as soon as it finishes, in its own transaction, so a crash or Ctrl-C loses nothing
+that has completed. The original vegeta report of a step is kept as JSON next to the columns
+that are queried. Runs are indexed by target file and start time, steps by rate.
+
+With each step goes a checkpoint of the search, in the same transaction: the rate of the next
+step, the fail count and the state of the search strategy. A run that was interrupted, or that
+crashed, continues from its checkpoint with `loadtest_vegeta.py --resume <run id>`.
+
+Query it from the command line:
+    python3 results_store.py list [--target <file>] [--limit N]
+    python3 results_store.py show <run id>
+    python3 results_store.py compare <run id> <run id> ...
+    python3 results_store.py quantiles <run id> [<run id> ...] [--rate N]
+    python3 results_store.py export <run id> [<run id> ...] --output <dir or file> [--format npy|parquet|arrow]
+"""
+
+import json
+import time
+import sqlite3
+import getpass
+import argparse
+from latency_histogram import LatencyHistogram
+from step_result import StepColumns, StepResult
+from utils import *
+
+
+class ResultsStore:
+    default_file = 'load_test_results.db'
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id          INTEGER PRIMARY KEY,
+            user        TEXT,
+            target_file TEXT,
+            search      TEXT,
+            started     REAL,
+            finished    REAL,
+            status      TEXT,
+            best_rate   INTEGER,
+            steps       INTEGER DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS settings (
+            run_id      INTEGER REFERENCES runs(id),
+            name        TEXT,
+            value       TEXT,
+            PRIMARY KEY (run_id, name));
+        CREATE TABLE IF NOT EXISTS steps (
+            id          INTEGER PRIMARY KEY,
+            run_id      INTEGER REFERENCES runs(id),
+            step_no     INTEGER,
+            finished    REAL,
+            rate        INTEGER,
+            requests    INTEGER,
+            success     REAL,
+            duration    INTEGER,
+            latency_mean INTEGER,
+            latency_50th INTEGER,
+            latency_95th INTEGER,
+            latency_99th INTEGER,
+            latency_max INTEGER,
+            entry       TEXT);
+        CREATE TABLE IF NOT EXISTS histograms (
+            step_id     INTEGER PRIMARY KEY REFERENCES steps(id),
+            encoded     BLOB);
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            run_id      INTEGER PRIMARY KEY REFERENCES runs(id),
+            step_no     INTEGER,
+            saved       REAL,
+            state       TEXT);
+        CREATE INDEX IF NOT EXISTS runs_target ON runs(target_file, started);
+        CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+        CREATE INDEX IF NOT EXISTS steps_run ON steps(run_id, step_no);
+        CREATE INDEX IF NOT EXISTS steps_rate ON steps(rate);
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, db_file: str = None):
+        """
+        :param db_file: the SQLite file. Default is load_test_results.db next to the scripts
+        """
+        self.db_file = db_file or os.path.join(TestUtils.get_absolute_path(), self.default_file)
+        self.db = sqlite3.connect(self.db_file)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.schema)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.db.close()
+
+    # --------------------------------------------------------------------------
+    def start_run(self, target_file: str, search: str, settings: dict) -> int:
+        """
+        :return: the id of the new run
+        """
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (user, target_file, search, started, status) VALUES (?, ?, ?, ?, ?)',
+                (getpass.getuser(), target_file, search, time.time(), 'running'))
+            run_id = cursor.lastrowid
+            self.db.executemany('INSERT INTO settings (run_id, name, value) VALUES (?, ?, ?)',
+                                [(run_id, name, str(value)) for name, value in settings.items()])
+        return run_id
+
+    # --------------------------------------------------------------------------
+    def add_step(self, run_id: int, step_no: int, rate: int, entry: dict, checkpoint: dict = None) -> int:
+        """
+        :param checkpoint: the state to resume the run from after this step, saved atomically with it
+        :return: the id of the new step
+        """
+        latencies = entry['latencies']
+        histogram = entry.get('histogram')
+        if histogram is not None:
+            entry = dict(entry)
+            del entry['histogram']                                              # stored as a blob
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO steps (run_id, step_no, finished, rate, requests, success, duration, '
+                'latency_mean, latency_50th, latency_95th, latency_99th, latency_max, entry) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, step_no, time.time(), rate, entry['requests'], entry['success'],
+                 entry['duration'], latencies.get('mean'), latencies.get('50th'),
+                 latencies.get('95th'), latencies.get('99th'), latencies.get('max'),
+                 json.dumps(entry)))
+            step_id = cursor.lastrowid
+            if histogram is not None:
+                self.db.execute('INSERT INTO histograms (step_id, encoded) VALUES (?, ?)',
+                                (step_id, LatencyHistogram.from_text(histogram).encode()))
+            self.db.execute('UPDATE runs SET steps = ? WHERE id = ?', (step_no, run_id))
+            if checkpoint is not None:
+                self.db.execute('INSERT OR REPLACE INTO checkpoints (run_id, step_no, saved, state) '
+                                'VALUES (?, ?, ?, ?)', (run_id, step_no, time.time(), json.dumps(checkpoint)))
+        return step_id
+
+    # --------------------------------------------------------------------------
+    def checkpoint(self, run_id: int) -> Optional[Tuple[int, float, dict]]:
+        """
+        :return: the step number, the time and the state of the last checkpoint of a run, None if there is none
+        """
+        row = self.db.execute('SELECT step_no, saved, state FROM checkpoints WHERE run_id = ?', (run_id,)).fetchone()
+        return None if row is None else (row[0], row[1], json.loads(row[2]))
+
+    # --------------------------------------------------------------------------
+    def resume_run(self, run_id: int) -> List[Tuple[int, dict]]:
+        """
+        Mark a run as running again
+        :return: the rate and the vegeta json report of each of its steps so far
+        """
+        with self.db:
+            self.db.execute("UPDATE runs SET finished = NULL, status = 'running' WHERE id = ?", (run_id,))
+        return [(rate, json.loads(entry)) for rate, entry in self.db.execute(
+            'SELECT rate, entry FROM steps WHERE run_id = ? ORDER BY step_no', (run_id,))]
+
+    # --------------------------------------------------------------------------
+    def finish_run(self, run_id: int, status: str, best_rate: int):
+        with self.db:
+            self.db.execute('UPDATE runs SET finished = ?, status = ?, best_rate = ? WHERE id = ?',
+                            (time.time(), status, best_rate, run_id))
+
+    # --------------------------------------------------------------------------
+    def list_runs(self, target_file: str = None, limit: int = 20) -> List[tuple]:
+        query = 'SELECT id, started, user, target_file, search, status, steps, best_rate FROM runs'
+        params = []
+        if target_file:
+            query += ' WHERE target_file = ?'
+            params.append(target_file)
+        query += ' ORDER BY started DESC LIMIT ?'
+        params.append(limit)
+        return self.db.execute(query, params).fetchall()
+
+    # --------------------------------------------------------------------------
+    def run_settings(self, run_id: int) -> dict:
+        return dict(self.db.execute('SELECT name, value FROM settings WHERE run_id = ?', (run_id,)))
+
+    # --------------------------------------------------------------------------
+    def run_steps(self, run_id: int) -> List[tuple]:
+        return self.db.execute(
+            'SELECT step_no, rate, requests, success, duration, latency_mean, latency_50th, '
+            'latency_95th, latency_99th, latency_max FROM steps WHERE run_id = ? ORDER BY step_no',
+            (run_id,)).fetchall()
+
+    # --------------------------------------------------------------------------
+    def step_histograms(self, run_id: int, rate: int = None) -> Iterator[LatencyHistogram]:
+        """
+        :return: the latency histograms of the steps of a run, optionally only those at one rate
+        """
+        query = 'SELECT h.encoded FROM histograms h JOIN steps s ON s.id = h.step_id WHERE s.run_id = ?'
+        params = [run_id]
+        if rate is not None:
+            query += ' AND s.rate = ?'
+            params.append(rate)
+        for row in self.db.execute(query, params):
+            yield LatencyHistogram.decode(row[0])
+
+    # --------------------------------------------------------------------------
+    def step_results(self, run_ids: List[int]) -> Iterator[Tuple[int, StepResult]]:
+        """
+        :return: the steps of the runs, in order, each with the id of its run
+        """
+        for run_id in run_ids:
+            for step_no, rate, entry in self.db.execute(
+                    'SELECT step_no, rate, entry FROM steps WHERE run_id = ? ORDER BY step_no', (run_id,)):
+                yield run_id, StepResult.from_report(json.loads(entry), step_no, rate)
+
+    # --------------------------------------------------------------------------
+    def run_info(self, run_id: int) -> tuple:
+        return self.db.execute(
+            'SELECT id, started, user, target_file, search, status, steps, best_rate FROM runs '
+            'WHERE id = ?', (run_id,)).fetchone()
+
+
+###############################################################################
+def format_started(started: float) -> str:
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Load Testing Tool --- stored results')
+    args.add_argument('--store', type=str, action="store", dest="store", default=None,
+                      help="The results store file. Default is {} next to the scripts."
+                      .format(ResultsStore.default_file))
+    commands = args.add_subparsers(dest="command")
+    list_args = commands.add_parser('list', help="List the latest runs")
+    list_args.add_argument('--target', type=str, dest="target", default=None,
+                           help="Only the runs against this target file")
+    list_args.add_argument('--limit', type=int, dest="limit", default=20)
+    show_args = commands.add_parser('show', help="Show the settings and steps of one run")
+    show_args.add_argument('run_id', type=int)
+    compare_args = commands.add_parser('compare', help="Compare the capacity of several runs")
+    compare_args.add_argument('run_ids', type=int, nargs='+')
+    quantile_args = commands.add_parser('quantiles',
+                                        help="Latency quantiles of the merged histograms of one or more runs")
+    quantile_args.add_argument('run_ids', type=int, nargs='+')
+    quantile_args.add_argument('--rate', type=int, dest="rate", default=None,
+                               help="Only the steps at this rate")
+    export_args = commands.add_parser('export', help="Export the steps of one or more runs as columns")
+    export_args.add_argument('run_ids', type=int, nargs='+')
+    export_args.add_argument('--output', type=str, dest="output", required=True,
+                             help="The directory of the .npy files, or the parquet or arrow file")
+    export_args.add_argument('--format', type=str, dest="format", default='npy', choices=StepColumns.formats,
+                             help="npy: one NumPy file per column, no dependencies. parquet and arrow need "
+                                  "pyarrow. Default is npy.")
+
+    given_args = args.parse_args(argv[1:])
+    if given_args.command is None:
+        args.print_help()
+        return ErrorCode.emptyCommandLineParameters
+
+    store = ResultsStore(given_args.store)
+    if given_args.command == 'list':
+        print('ID     Started              User        Search       Status       Steps  Best Rate  Target')
+        for row in store.list_runs(given_args.target, given_args.limit):
+            print('{0:<5d}  {1}  {2:<10}  {3:<11}  {4:<11}  {5:5d}  {6:>9}  {7}'.format(
+                row[0], format_started(row[1]), row[2], row[4] or '', row[5], row[6] or 0,
+                row[7] if row[7] is not None else '-', row[3]))
+
+    elif given_args.command == 'show':
+        if store.run_info(given_args.run_id) is None:
+            print('No run {}'.format(given_args.run_id))
+            return ErrorCode.valueOutOfRange
+        for name, value in sorted(store.run_settings(given_args.run_id).items()):
+            print('\t{:<24}: {}'.format(name, value))
+        checkpoint = store.checkpoint(given_args.run_id)
+        if checkpoint is not None:
+            step_no, saved, state = checkpoint
+            print('\t{:<24}: step {} at {}, {}'.format(
+                'checkpoint', step_no, format_started(saved), 'search done' if state['done'] else
+                'next rate {}, fail count {}'.format(state['next_rate'], state['fail_count'])))
+        print('\nID  Total   Rate   Success%  Time(s)   Mean(ms)  50th(ms)  95th(ms)  99th(ms)  Max(ms)')
+        for row in store.run_steps(given_args.run_id):
+            print('{0:2d}  {1:6d}  {2:5d}  {3:8.4f}  {4:8.3f}  {5:8.3f}  {6:8.3f}  {7:8.3f}  {8:8.3f}  {9:8.3f}'
+                  .format(row[0], row[2], row[1], row[3] * 100, row[4] / 1e9,
+                          *[(value or 0) / 1e6 for value in row[5:]]))
+
+    elif given_args.command == 'compare':
+        print('ID     Started              Status       Steps  Best Rate  Delta    p99 at Best(ms)')
+        baseline = None
+        for run_id in given_args.run_ids:
+            row = store.run_info(run_id)
+            if row is None:
+                print('{0:<5d}  not found'.format(run_id))
+                continue
+            best_rate = row[7]
+            p99 = store.db.execute('SELECT MIN(latency_99th) FROM steps WHERE run_id = ? AND rate = ?',
+                                   (run_id, best_rate)).fetchone()[0]
+            if baseline is None:
+                baseline = best_rate
+            delta = '{:+.1f}%'.format((best_rate - baseline) * 100.0 / baseline) \
+                if baseline and best_rate is not None else '-'
+            print('{0:<5d}  {1}  {2:<11}  {3:5d}  {4:>9}  {5:<7}  {6:>15}'.format(
+                row[0], format_started(row[1]), row[5], row[6] or 0,
+                best_rate if best_rate is not None else '-', delta,
+                '{:.3f}'.format(p99 / 1e6) if p99 is not None else '-'))
+
+    elif given_args.command == 'quantiles':
+        quantiles = [0.5, 0.9, 0.95, 0.99, 0.999, 0.9999]
+        histogram = LatencyHistogram.merged(histogram for run_id in given_args.run_ids
+                                            for histogram in store.step_histograms(run_id, given_args.rate))
+        if histogram.total_count == 0:
+            print('No latency histograms stored for run(s) {}'.format(
+                ', '.join(str(run_id) for run_id in given_args.run_ids)))
+        else:
+            print('\tRequests: {}'.format(histogram.total_count))
+            print('\tMean    : {:.3f}ms'.format(histogram.mean() / 1e6))
+            for q, value in zip(quantiles, histogram.quantiles(quantiles)):
+                print('\t{:<8}: {:.3f}ms'.format('{:g}th'.format(q * 100), value / 1e6))
+            print('\tMax     : {:.3f}ms'.format(histogram.max_recorded / 1e6))
+
+    elif given_args.command == 'export':
+        columns = StepColumns(store.step_results(given_args.run_ids))
+        files = columns.write(given_args.output, given_args.format)
+        print('\t{} steps, {} columns, exported to {}'.format(columns.rows, len(columns.columns) + len(columns.text),
+                                                             files[0] if len(files) == 1 else given_args.output))
+
+    store.close()
+    return ErrorCode.ok
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,315 @@
+"""
+Strategies to search for the highest request rate that meets the failure threshold.
+
+Every strategy gets the failure rate of the step that has just finished and proposes the
+rate of the next step, or tells the caller to stop:
+
+- adaptive:    the original step-and-backoff logic, moving by step_rate or step_rate/5
+- exponential: double the rate until the first failure, then bisect
+- bisection:   bisect between the highest passing and the lowest failing rate, starting with
+               the bracket [start_rate, max_rate]
+- model:       fit the failure and latency curves of the steps so far and probe the predicted
+               knee, falling back to bisection when the fit is not usable
+
+The state of a strategy (state_fields) is saved with every step, so that a search can be
+resumed where it stopped.
+
+A step at a rate the load generator could not drive is left out: generator_saturated() makes
+the rate the upper bound of the search instead, which then goes on below it.
+"""
+
+import abc
+import copy
+from utils import *
+
+
+###############################################################################
+class SearchStrategy(abc.ABC):
+    name = None
+    max_rate = 5000                                                             # per second
+    resolution = 5                                                              # per second
+    max_fail_count = 5
+    state_fields = ['steps', 'seconds', 'best_rate', 'max_rate', 'generator_limit']
+
+    # --------------------------------------------------------------------------
+    def __init__(self, failure_threshold: float, start_rate: int, step_rate: int):
+        self.failure_threshold = failure_threshold
+        self.start_rate = start_rate
+        self.step_rate = step_rate
+        self.steps = 0
+        self.seconds = 0.0
+        self.best_rate = None                                                   # highest passing rate
+        self.generator_limit = None                                             # lowest rate the client failed
+
+    # --------------------------------------------------------------------------
+    def pass_limit(self) -> float:
+        return self.failure_threshold * 1.2
+
+    # --------------------------------------------------------------------------
+    def is_pass(self, failure_rate: float) -> bool:
+        """
+        The same acceptance rule as ever: a run passes while its failure rate is less than
+        20% above the threshold.
+        """
+        if self.failure_threshold == 0:
+            return failure_rate == 0
+        return (failure_rate / self.failure_threshold - 1) < 0.2
+
+    # --------------------------------------------------------------------------
+    def missed_failure_rate(self, failure_rate: float, severity: float) -> float:
+        """
+        The failure rate that a step counts with when it missed a service level objective other
+        than the failure threshold: a failing one, the worse the further the objective was missed
+        :param severity: the measured value over the objective's limit, > 1
+        """
+        severity = min(severity, 10.0)
+        return max(failure_rate, self.pass_limit() * severity, 0.01 * severity)
+
+    # --------------------------------------------------------------------------
+    def record_step(self, current_rate: int, failure_rate: float, entry: dict, seconds: float):
+        self.steps += 1
+        self.seconds += seconds
+        if self.is_pass(failure_rate) and (self.best_rate is None or current_rate > self.best_rate):
+            self.best_rate = current_rate
+
+    # --------------------------------------------------------------------------
+    @abc.abstractmethod
+    def adjust(self, current_rate: int, failure_rate: float, fail_count: int, entry: dict) -> Any:
+        """
+        :param current_rate: the rate of the step that has just finished
+        :param failure_rate: its failure rate in percent
+        :param fail_count: number of failed steps so far
+        :param entry: the vegeta json report of the step
+        :return: return code, new rate and the updated fail count. A non-zero return code stops the test
+        """
+
+    # --------------------------------------------------------------------------
+    def generator_saturated(self, current_rate: int, seconds: float) -> Tuple[int, Optional[int]]:
+        """
+        The load generator could not drive the step: it tells nothing about the service, so it
+        is not recorded, and the search goes on below its rate
+        :return: return code and new rate
+        """
+        self.steps += 1
+        self.seconds += seconds
+        if self.generator_limit is None or current_rate < self.generator_limit:
+            self.generator_limit = current_rate
+        self.max_rate = min(self.max_rate, current_rate - 1)
+        low = self.best_rate if self.best_rate is not None else 0
+        if self.max_rate - low <= self.resolution:
+            print('\tThe load generator cannot drive more than {} requests/second - stop the load test.'
+                  .format(self.max_rate))
+            return ErrorCode.searchConverged, None
+        return ErrorCode.ok, (low + self.max_rate + 1) // 2
+
+    # --------------------------------------------------------------------------
+    def state(self) -> dict:
+        """
+        :return: a copy of what the search has learned so far, JSON serializable
+        """
+        return {name: copy.deepcopy(getattr(self, name)) for name in self.state_fields}
+
+    # --------------------------------------------------------------------------
+    def restore(self, state: dict):
+        for name in self.state_fields:
+            if name in state:
+                setattr(self, name, state[name])
+
+    # --------------------------------------------------------------------------
+    def summary(self) -> str:
+        summary = '{} search: best rate {} requests/second, found in {} steps and {:.0f} seconds'.format(
+            self.name, self.best_rate, self.steps, self.seconds)
+        if self.generator_limit is not None:
+            summary += '\n\tThe load generator saturated at {} requests/second; the service may take more'.format(
+                self.generator_limit)
+        return summary
+
+
+###############################################################################
+class AdaptiveStepSearch(SearchStrategy):
+    name = 'adaptive'
+
+    # --------------------------------------------------------------------------
+    def adjust(self, current_rate, failure_rate, fail_count, entry):
+        if self.is_pass(failure_rate):
+            new_rate = current_rate + self.step_rate if fail_count == 0 else \
+                current_rate + int(self.step_rate / 5)
+            if self.generator_limit is not None:
+                if current_rate >= self.max_rate:
+                    print('\tPassed at {} requests/second, the most the load generator can drive - stop the '
+                          'load test.'.format(current_rate))
+                    return ErrorCode.searchConverged, None, fail_count
+                new_rate = min(new_rate, self.max_rate)
+
+        else:
+            fail_count += 1
+            if fail_count >= self.max_fail_count:
+                print('\tFailure rate is too high, and we tried for {} times. Stop the load test.'
+                      .format(fail_count))
+                return ErrorCode.requestRateTooHigh, current_rate, fail_count
+
+            if failure_rate < self.failure_threshold:
+                new_rate = current_rate + self.step_rate
+            else:
+                ratio = (1 - self.failure_threshold / failure_rate)
+                new_rate = current_rate - int(self.step_rate * ratio)
+
+            if abs(new_rate - current_rate) < self.resolution:                  # No need to continue
+                print('\tThe expected new rate {} is too close to existing rate {} - stop the load test.'
+                      .format(new_rate, current_rate))
+                return ErrorCode.requestRateTooHigh, None, fail_count
+
+        return ErrorCode.ok, new_rate, fail_count
+
+
+###############################################################################
+class BisectionSearch(SearchStrategy):
+    name = 'bisection'
+    state_fields = SearchStrategy.state_fields + ['low', 'high']
+
+    # --------------------------------------------------------------------------
+    def __init__(self, failure_threshold: float, start_rate: int, step_rate: int):
+        super().__init__(failure_threshold, start_rate, step_rate)
+        self.low = None                                                         # highest passing rate
+        self.high = None                                                        # lowest failing rate
+
+    # --------------------------------------------------------------------------
+    def update_bracket(self, current_rate: int, failure_rate: float):
+        if self.is_pass(failure_rate):
+            if self.low is None or current_rate > self.low:
+                self.low = current_rate
+        elif self.high is None or current_rate < self.high:
+            self.high = current_rate
+
+    # --------------------------------------------------------------------------
+    def generator_saturated(self, current_rate, seconds):
+        if self.high is not None and self.high > current_rate:
+            self.high = None                                                    # max_rate bounds it now
+        return super().generator_saturated(current_rate, seconds)
+
+    # --------------------------------------------------------------------------
+    def probe(self, current_rate: int) -> int:
+        """
+        :return: the next rate to try before the bracket is closed
+        """
+        low = self.low if self.low is not None else 0
+        high = self.high if self.high is not None else self.max_rate
+        return (low + high) // 2
+
+    # --------------------------------------------------------------------------
+    def adjust(self, current_rate, failure_rate, fail_count, entry):
+        if not self.is_pass(failure_rate):
+            fail_count += 1
+        self.update_bracket(current_rate, failure_rate)
+
+        if self.low is None and self.high is not None and self.high <= self.resolution:
+            print('\tEven {} requests/second fails - stop the load test.'.format(self.high))
+            return ErrorCode.requestRateTooHigh, None, fail_count
+
+        high = self.high if self.high is not None else self.max_rate
+        low = self.low if self.low is not None else 0
+        if self.low is not None and (high - low <= self.resolution or self.low >= self.max_rate):
+            print('\tConverged between {} and {} requests/second - stop the load test.'.format(low, high))
+            return ErrorCode.searchConverged, None, fail_count
+
+        new_rate = min(max(self.probe(current_rate), low + 1), high - 1 if self.high is not None else high)
+        if new_rate == current_rate:
+            print('\tNo new rate to try around {} requests/second - stop the load test.'.format(current_rate))
+            return ErrorCode.searchConverged, None, fail_count
+        return ErrorCode.ok, new_rate, fail_count
+
+
+###############################################################################
+class ExponentialSearch(BisectionSearch):
+    name = 'exponential'
+    growth = 2
+
+    # --------------------------------------------------------------------------
+    def probe(self, current_rate):
+        if self.high is None:
+            return min(current_rate * self.growth, self.max_rate)
+        return super().probe(current_rate)
+
+
+###############################################################################
+class ModelSearch(ExponentialSearch):
+    """
+    Ramps up exponentially until the service shows stress, then fits two curves to the steps
+    that have been run:
+        failure%(rate)    = a * (rate - knee) for the steps around the knee
+        1 / latency(rate) = (1 / base) * (1 - rate / capacity), the M/M/1 queueing curve
+    and probes the rate where the failure line reaches the pass limit, or 90% of the fitted
+    queueing capacity when there are no failures yet. A model probe that did not at least halve
+    the bracket is followed by a bisection step, so the search is never slower than bisection
+    by more than a step or so.
+    """
+    name = 'model'
+    min_latency_points = 3
+    state_fields = ExponentialSearch.state_fields + ['points', 'model_width']
+
+    # --------------------------------------------------------------------------
+    def __init__(self, failure_threshold: float, start_rate: int, step_rate: int):
+        super().__init__(failure_threshold, start_rate, step_rate)
+        self.points = []                                                        # (rate, failure%, mean latency)
+        self.model_width = None                                                 # bracket width at the last model probe
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def linear_fit(xs: List[float], ys: List[float]) -> Any:
+        """
+        :return: slope and intercept of the least squares line, or None if it is undetermined
+        """
+        n = len(xs)
+        if n < 2:
+            return None
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        if sxx == 0:
+            return None
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+        return slope, mean_y - slope * mean_x
+
+    # --------------------------------------------------------------------------
+    def predict_knee(self) -> Any:
+        # the failure curve near the knee: the failing steps and the highest passing one
+        failing = [(rate, failure) for rate, failure, _ in self.points
+                   if failure > 0 or (self.low is not None and rate == self.low)]
+        if len(failing) >= 2:
+            fit = self.linear_fit([p[0] for p in failing], [p[1] for p in failing])
+            if fit is not None and fit[0] > 0:
+                return (self.pass_limit() - fit[1]) / fit[0]
+
+        loaded = [(rate, latency) for rate, _, latency in self.points if latency > 0]
+        if len(loaded) >= self.min_latency_points:
+            fit = self.linear_fit([p[0] for p in loaded], [1.0 / p[1] for p in loaded])
+            if fit is not None and fit[0] < 0 and fit[1] > 0:
+                return 0.9 * (fit[1] / -fit[0])
+        return None
+
+    # --------------------------------------------------------------------------
+    def probe(self, current_rate):
+        knee = self.predict_knee()
+        low = self.low if self.low is not None else 0
+        high = self.high if self.high is not None else self.max_rate
+        width = high - low
+        model_failed = self.model_width is not None and width > self.model_width / 2
+        self.model_width = None
+        if knee is not None and low < knee < high and not model_failed:
+            self.model_width = width
+            # never probe right next to the bracket ends; that would converge slower than bisection
+            margin = max(width / 10, 1)
+            return int(min(max(knee, low + margin), high - margin))
+        return super().probe(current_rate)
+
+    # --------------------------------------------------------------------------
+    def adjust(self, current_rate, failure_rate, fail_count, entry):
+        self.points.append((current_rate, failure_rate, entry['latencies']['mean']))
+        return super().adjust(current_rate, failure_rate, fail_count, entry)
+
+
+search_strategies = {
+    AdaptiveStepSearch.name: AdaptiveStepSearch,
+    ExponentialSearch.name: ExponentialSearch,
+    BisectionSearch.name: BisectionSearch,
+    ModelSearch.name: ModelSearch}
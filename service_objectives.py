@@ -0,0 +1,103 @@
+"""
+Service level objectives on the report of a step, written as e.g.
+
+    p99<250ms       the 99th percentile latency is below 250ms
+    p99.9<1s        the 99.9th percentile latency is below one second
+    mean<100ms      also p50, p90, p95, p99.99, max
+    failure<1%      the failure rate is below 1%
+
+A step meets an objective when the measured value is below the limit. The severity of a
+miss is the measured value over the limit, so the further off, the larger.
+"""
+
+import re
+import math
+from latency_histogram import parse_go_duration
+from utils import *
+
+
+latency_metrics = {'mean': 'mean', 'max': 'max', 'p50': '50th', 'p90': '90th', 'p95': '95th',
+                   'p99': '99th', 'p99.9': '99.9th', 'p99.99': '99.99th'}
+objective_pattern = re.compile(r'^\s*([a-z0-9.]+)\s*<\s*([0-9.]+\s*[a-z%µμ]*)\s*$')
+
+
+###############################################################################
+class Objective:
+    __slots__ = ('metric', 'limit', 'text')
+
+    # --------------------------------------------------------------------------
+    def __init__(self, metric: str, limit: float, text: str):
+        """
+        :param metric: 'failure', or the key of the latency in the vegeta json report, e.g. 99th
+        :param limit: percent for the failure rate, nanoseconds for latencies
+        """
+        self.metric = metric
+        self.limit = limit
+        self.text = text
+
+    # --------------------------------------------------------------------------
+    def measure(self, entry: dict) -> float:
+        """
+        :return: the measured value. A report without it raises badVegetaReport, so that it cannot pass unchecked
+        """
+        if self.metric == 'failure':
+            return 100.0 - entry['success'] * 100.0
+        measured = entry['latencies'].get(self.metric)
+        if measured is None:
+            raise Exception(ErrorCode.badVegetaReport, "The report has no {} latency to check {} against".format(
+                self.metric, self.text))
+        return measured
+
+    # --------------------------------------------------------------------------
+    def severity(self, entry: dict) -> float:
+        measured = self.measure(entry)
+        if self.limit == 0:
+            return 1.0 if measured == 0 else math.inf
+        return measured / self.limit
+
+    # --------------------------------------------------------------------------
+    def is_met(self, entry: dict) -> bool:
+        measured = self.measure(entry)
+        return measured == 0 if self.limit == 0 else measured < self.limit
+
+    # --------------------------------------------------------------------------
+    def describe(self, entry: dict) -> str:
+        """
+        :return: the measured value against the objective, e.g. p99 = 312.000ms (< 250ms)
+        """
+        measured = self.measure(entry)
+        if self.metric == 'failure':
+            return 'failure = {:.3f}% ({})'.format(measured, self.text)
+        return '{} = {:.3f}ms ({})'.format(self.text.split('<')[0].strip(), measured / 1e6, self.text)
+
+    # --------------------------------------------------------------------------
+    def __repr__(self):
+        return self.text
+
+
+###############################################################################
+def parse_objective(text: str) -> Objective:
+    """
+    :param text: e.g. p99<250ms or failure<1%
+    """
+    match = objective_pattern.match(text.lower())
+    if match is None:
+        raise Exception(ErrorCode.badParameterType, "Not an objective: {}, expected e.g. p99<250ms".format(text))
+    name, limit = match.group(1), match.group(2).replace(' ', '')
+    if name == 'failure':
+        if not limit.endswith('%'):
+            raise Exception(ErrorCode.badParameterType, "The failure objective is in percent: {}".format(text))
+        return Objective('failure', float(limit[:-1]), text.strip())
+    if name not in latency_metrics:
+        raise Exception(ErrorCode.badParameterType, "Unknown latency {} in {}, expected one of {}".format(
+            name, text, ', '.join(latency_metrics)))
+    return Objective(latency_metrics[name], parse_go_duration(limit), text.strip())
+
+
+###############################################################################
+def missed_objectives(objectives: List[Objective], entry: dict) -> List[Tuple[Objective, float]]:
+    """
+    :return: the objectives the step missed with their severities, the worst first
+    """
+    missed = [(objective, objective.severity(entry)) for objective in objectives if not objective.is_met(entry)]
+    return sorted(missed, key=lambda item: -item[1])
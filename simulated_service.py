@@ -0,0 +1,77 @@
+"""
+Deterministic simulated service, to run the load test logic offline.
+
+The service has a fixed capacity in requests/second. Below the capacity latencies follow an
+M/M/1 queueing curve; above it the excess requests fail. A small pseudo-random jitter,
+seeded by the rate, makes the numbers look real while keeping every run reproducible.
+The result of attack() has the layout of `vegeta report -type json`.
+"""
+
+import math
+import random
+from utils import *
+
+
+class SimulatedService:
+    base_latency = 5000000                                                      # 5ms in ns
+    timeout = 30000000000                                                       # vegeta's 30s in ns
+
+    # --------------------------------------------------------------------------
+    def __init__(self, capacity: int, seed: int = 0):
+        """
+        :param capacity: the highest request rate the service can handle without failures
+        :param seed: seed of the jitter. The same seed gives the same results
+        """
+        if capacity is None or capacity <= 0:
+            raise Exception(ErrorCode.valueOutOfRange, "Capacity must be positive")
+        self.capacity = capacity
+        self.seed = seed
+
+    # --------------------------------------------------------------------------
+    def failure_ratio(self, rate: int, jitter: float) -> float:
+        if rate <= self.capacity:
+            return 0.0
+        return min(1.0, (rate - self.capacity) / rate * (1.0 + jitter))
+
+    # --------------------------------------------------------------------------
+    def mean_latency(self, rate: int) -> int:
+        utilisation = min(rate / self.capacity, 0.99)
+        return min(int(self.base_latency / (1.0 - utilisation)), self.timeout)
+
+    # --------------------------------------------------------------------------
+    def attack(self, rate: int, duration: int) -> dict:
+        """
+        :param rate: requests/second
+        :param duration: in seconds
+        :return: the simulated `vegeta report -type json` of the attack
+        """
+        jitter = random.Random(self.seed * 1000003 + rate).uniform(-0.05, 0.05)
+        requests = rate * duration
+        success = 1.0 - self.failure_ratio(rate, jitter)
+        mean = int(self.mean_latency(rate) * (1.0 + jitter))
+
+        def exponential_quantile(q):
+            return min(int(-mean * math.log(1.0 - q)), self.timeout)
+
+        successes = int(round(requests * success))
+        status_codes = {'200': successes}
+        if requests > successes:
+            status_codes['503'] = requests - successes
+
+        return {
+            'latencies': {'total': mean * requests, 'mean': mean,
+                          '50th': exponential_quantile(0.50), '90th': exponential_quantile(0.90),
+                          '95th': exponential_quantile(0.95), '99th': exponential_quantile(0.99),
+                          '99.9th': exponential_quantile(0.999), '99.99th': exponential_quantile(0.9999),
+                          'max': exponential_quantile(0.99999), 'min': self.base_latency},
+            'bytes_in': {'total': 0, 'mean': 0.0},
+            'bytes_out': {'total': 0, 'mean': 0.0},
+            'earliest': '', 'latest': '', 'end': '',
+            'duration': duration * 1000000000,
+            'wait': mean,
+            'requests': requests,
+            'rate': float(rate),
+            'throughput': successes / (duration + mean / 1e9) if duration else 0.0,
+            'success': successes / requests if requests else 0.0,
+            'status_codes': status_codes,
+            'errors': ['503 Service Unavailable'] if requests > successes else []}
@@ -0,0 +1,328 @@
+"""
+Soak tests: one rate held for hours or days, to catch the slow leaks, the GC pauses and the
+creeping latency that a 10 second step never shows.
+
+The step of a soak test runs like any streaming step, into a single StreamStats of bounded
+size. SoakRecorder copies its cumulative totals and latency histogram once per interval, and
+the difference to the previous copy is the window of that interval, written as one line of
+a CSV time series:
+
+    time,seconds,requests,rate,throughput,error%,p50_ms,p90_ms,p99_ms,p99.9_ms,max_ms
+
+Nothing else is kept per window, so the memory does not grow with the length of the test.
+DriftDetector watches the windows as they come:
+
+- the median of the first windows is the baseline; once the median of the latest windows
+  has p99 latency, error rate or throughput beyond the tolerances, a regression is reported,
+  and again when it recovers
+- a window whose max latency is far above the baseline p99 is a pause, e.g. of the GC
+- a least-squares trend over the whole run, kept in five running sums, tells a slow drift
+  that no two neighbouring windows show
+"""
+
+import math
+import time
+import statistics
+import threading
+from array import array
+from collections import deque
+from latency_histogram import LatencyHistogram
+from utils import *
+
+
+###############################################################################
+def parse_soak_time(value: str) -> int:
+    """
+    :param value: seconds, or a duration with units, e.g. 90m, 12h or 2d12h
+    :return: the duration in seconds
+    """
+    value = value.strip().lower()
+    if value.isdigit():
+        return int(value)
+    units = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    seconds = 0
+    number = ''
+    for char in value:
+        if char.isdigit() or char == '.':
+            number += char
+        elif char in units and number:
+            seconds += float(number) * units[char]
+            number = ''
+        else:
+            raise Exception(ErrorCode.badParameterType, "Not a duration: {}, expected e.g. 12h or 2d".format(value))
+    if number:
+        raise Exception(ErrorCode.badParameterType, "Not a duration: {}, expected e.g. 12h or 2d".format(value))
+    return int(seconds)
+
+
+###############################################################################
+class OnlineTrend:
+    """
+    Least-squares line through (x, y) points, in constant memory
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+        self.count = 0
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+
+    # --------------------------------------------------------------------------
+    def add(self, x: float, y: float):
+        self.count += 1
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_xy += x * y
+
+    # --------------------------------------------------------------------------
+    def slope(self) -> float:
+        """
+        :return: the change of y per unit of x, 0 before there are two distinct x
+        """
+        denominator = self.count * self.sum_xx - self.sum_x * self.sum_x
+        if self.count < 2 or denominator <= 0:
+            return 0.0
+        return (self.count * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+
+###############################################################################
+class DriftDetector:
+    baseline_windows = 30                                                       # 5 minutes of 10s windows
+    latency_tolerance = 1.5                                                     # times the baseline p99
+    throughput_tolerance = 0.9                                                  # of the baseline throughput
+    failure_margin = 1.0                                                        # percent over the baseline
+    drift_tolerance = 0.2                                                       # of the baseline, over the run
+    pause_factor = 10                                                           # times the baseline p99
+    max_events = 100
+
+    # --------------------------------------------------------------------------
+    def __init__(self, baseline_windows: int = None):
+        """
+        :param baseline_windows: the number of windows of the baseline, and of the latest
+                                 windows compared to it
+        """
+        self.baseline_windows = baseline_windows or self.baseline_windows
+        self.first = []
+        self.baseline = None
+        self.recent = deque(maxlen=self.baseline_windows)
+        self.started = None
+        self.hours = 0.0
+        self.trends = {'p99_ms': OnlineTrend(), 'error%': OnlineTrend(), 'throughput': OnlineTrend()}
+        self.regressions = set()                                                # metrics off right now
+        self.events = deque(maxlen=self.max_events)
+        self.event_count = 0
+        self.pauses = 0
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def medians(windows) -> dict:
+        return {metric: statistics.median(window[metric] for window in windows)
+                for metric in ('p99_ms', 'error%', 'throughput')}
+
+    # --------------------------------------------------------------------------
+    def add(self, window: dict) -> List[str]:
+        """
+        :param window: one window of the time series, see SoakRecorder.window()
+        :return: what the window brought up, as messages
+        """
+        if window['requests'] == 0:
+            return []
+        if self.started is None:
+            self.started = window['time']
+        self.hours = (window['time'] - self.started) / 3600
+        for metric, trend in self.trends.items():
+            trend.add(self.hours, window[metric])
+
+        if self.baseline is None:
+            self.first.append(window)
+            if len(self.first) == self.baseline_windows:
+                self.baseline = self.medians(self.first)
+                self.first = None
+                return ['baseline of the first {} windows: p99 {:.3f}ms, error rate {:.3f}%, '
+                        'throughput {:.1f}/s'.format(self.baseline_windows, self.baseline['p99_ms'],
+                                                     self.baseline['error%'], self.baseline['throughput'])]
+            return []
+
+        messages = []
+        if window['max_ms'] > self.baseline['p99_ms'] * self.pause_factor:
+            self.pauses += 1
+            factor = window['max_ms'] / self.baseline['p99_ms'] if self.baseline['p99_ms'] else math.inf
+            messages.append(self.event(window['time'], 'pause', 'max latency {:.3f}ms, {:.0f}x the baseline p99'
+                                       .format(window['max_ms'], factor)))
+
+        self.recent.append(window)
+        if len(self.recent) < self.baseline_windows:
+            return messages
+        current = self.medians(self.recent)
+        checks = [('p99_ms', current['p99_ms'] > self.baseline['p99_ms'] * self.latency_tolerance,
+                   'p99 {:.3f}ms against {:.3f}ms'.format(current['p99_ms'], self.baseline['p99_ms'])),
+                  ('error%', current['error%'] > self.baseline['error%'] + self.failure_margin,
+                   'error rate {:.3f}% against {:.3f}%'.format(current['error%'], self.baseline['error%'])),
+                  ('throughput', current['throughput'] < self.baseline['throughput'] * self.throughput_tolerance,
+                   'throughput {:.1f}/s against {:.1f}/s'.format(current['throughput'], self.baseline['throughput']))]
+        for metric, regressed, text in checks:
+            if regressed and metric not in self.regressions:
+                self.regressions.add(metric)
+                messages.append(self.event(window['time'], 'regression', text))
+            elif not regressed and metric in self.regressions:
+                self.regressions.discard(metric)
+                messages.append(self.event(window['time'], 'recovered', text))
+        return messages
+
+    # --------------------------------------------------------------------------
+    def event(self, when: float, kind: str, text: str) -> str:
+        self.event_count += 1
+        self.events.append({'time': when, 'kind': kind, 'text': text})
+        return '{}: {}'.format(kind, text)
+
+    # --------------------------------------------------------------------------
+    def drift(self) -> dict:
+        """
+        :return: per metric, the slope of its trend per hour and the change over the run so far
+                 relative to the baseline
+        """
+        drift = {}
+        for metric, trend in self.trends.items():
+            slope = trend.slope()
+            base = self.baseline[metric] if self.baseline is not None else 0.0
+            drift[metric] = {'per_hour': slope,
+                             'relative': slope * self.hours / base if base else 0.0}
+        return drift
+
+    # --------------------------------------------------------------------------
+    def summary(self) -> dict:
+        drift = self.drift()
+        drifting = []
+        for metric, values in drift.items():
+            if metric == 'throughput':
+                if values['relative'] < -self.drift_tolerance:
+                    drifting.append(metric)
+            elif values['relative'] > self.drift_tolerance:
+                drifting.append(metric)
+            elif metric == 'error%' and values['per_hour'] * self.hours > self.failure_margin:
+                drifting.append(metric)                                         # from a baseline of no errors
+        return {'hours': self.hours,
+                'baseline': self.baseline,
+                'drift': drift,
+                'drifting': drifting,
+                'regressions': sorted(self.regressions),
+                'pauses': self.pauses,
+                'events': list(self.events),
+                'event_count': self.event_count}
+
+
+###############################################################################
+class SoakRecorder:
+    """
+    Writes the windows of a running soak step to a CSV time series, from a background thread
+    """
+    columns = ['time', 'seconds', 'requests', 'rate', 'throughput', 'error%', 'p50_ms', 'p90_ms', 'p99_ms',
+               'p99.9_ms', 'max_ms']
+    quantiles = [0.5, 0.9, 0.99, 0.999]
+
+    # --------------------------------------------------------------------------
+    def __init__(self, series_file: str, interval: float = 10.0, detector: DriftDetector = None):
+        """
+        :param series_file: the CSV file of the time series
+        :param interval: seconds per window
+        """
+        self.series_file = series_file
+        self.interval = interval
+        self.detector = detector or DriftDetector()
+        self.source = None
+        self.watched = None                                                     # when the step began
+        self.last = None
+        self.windows = 0
+        self.file = open(series_file, 'w', buffering=1)
+        self.file.write(','.join(self.columns) + '\n')
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    # --------------------------------------------------------------------------
+    def start(self):
+        self.thread.start()
+
+    # --------------------------------------------------------------------------
+    def watch(self, source: Callable[[], object]):
+        """
+        :param source: returns the StreamStats of the running step, or None while there are none
+        """
+        if self.watched is None:
+            self.watched = time.time(), time.monotonic()
+        self.source = source
+
+    # --------------------------------------------------------------------------
+    def stop(self):
+        """
+        Record the last, partial window and close the time series. The window ends with the
+        step, so it is written but the drift detection leaves it out
+        """
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.record(final=True)
+        self.file.close()
+
+    # --------------------------------------------------------------------------
+    def run(self):
+        deadline = time.monotonic() + self.interval
+        while not self.stopped.wait(max(0.0, deadline - time.monotonic())):
+            deadline += self.interval
+            try:
+                self.record()
+            except (RuntimeError, ValueError):
+                pass                                                            # the step ended under us; next time
+
+    # --------------------------------------------------------------------------
+    def snapshot(self) -> Optional[tuple]:
+        source = self.source
+        stats = source() if source is not None else None
+        if stats is None:
+            return None
+        return time.time(), time.monotonic(), stats.requests, stats.success, array('Q', stats.latencies.counts)
+
+    # --------------------------------------------------------------------------
+    def record(self, final: bool = False):
+        """
+        Take a copy of the totals, and write the window since the previous copy
+        """
+        current = self.snapshot()
+        if current is None:
+            return
+        last, self.last = self.last, current
+        if last is None:                                                        # the first window starts with the step
+            began = self.watched or current[:2]
+            last = (began[0], began[1], 0, 0, array('Q', bytes(8 * len(current[4]))))
+        window = self.window(last, current)
+        if window is None:
+            return
+        self.windows += 1
+        self.file.write(','.join('{:.3f}'.format(window[column]) if isinstance(window[column], float)
+                                 else str(window[column]) for column in self.columns) + '\n')
+        if final:
+            return
+        for message in self.detector.add(window):
+            print('\tSoak {}: {}'.format(time.strftime('%H:%M:%S', time.localtime(window['time'])), message))
+
+    # --------------------------------------------------------------------------
+    def window(self, last: tuple, current: tuple) -> Optional[dict]:
+        seconds = current[1] - last[1]
+        if seconds <= 0:
+            return None
+        requests = current[2] - last[2]
+        success = current[3] - last[3]
+        histogram = LatencyHistogram.difference(current[4], last[4])
+        p50, p90, p99, p999 = histogram.quantiles(self.quantiles)
+        return {'time': current[0],
+                'seconds': seconds,
+                'requests': requests,
+                'rate': requests / seconds,
+                'throughput': success / seconds,
+                'error%': 100.0 * (requests - success) / requests if requests else 0.0,
+                'p50_ms': p50 / 1e6,
+                'p90_ms': p90 / 1e6,
+                'p99_ms': p99 / 1e6,
+                'p99.9_ms': p999 / 1e6,
+                'max_ms': histogram.max_recorded / 1e6}
@@ -0,0 +1,206 @@
+"""
+Pieces that overlap the work between two steps of a search with the rest of the target.
+
+A step used to be followed by its persistence and reporting, then a fixed rest, then the
+spawn of the next attacker, one after the other. With these, only the rest is left between
+two steps:
+
+- ResultWriter persists finished steps on a background thread, in order, while the main
+  thread analyses the step and rests
+- GatedCommand spawns the next vegeta attack during the rest. vegeta reads all its targets
+  from stdin before it sends anything, so the process is loaded and ready, but idle, until
+  it is fed the target file
+- HealthProbe ends the rest early: it sends a cheap request to the target from time to time,
+  and the rest is over once its latency is back to what it was on the idle target
+"""
+
+import ssl
+import time
+import shutil
+import signal
+import statistics
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from vegeta_targets import Target
+from utils import *
+
+
+###############################################################################
+class ResultWriter:
+    """
+    Runs persistence calls on one background thread, in the order they were submitted. The
+    results store is only ever used from that thread.
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='result_writer')
+        self.pending = []
+
+    # --------------------------------------------------------------------------
+    def submit(self, function: Callable, *args):
+        self.pending = [future for future in self.pending if not future.done() or future.exception()]
+        self.pending.append(self.executor.submit(function, *args))
+
+    # --------------------------------------------------------------------------
+    def call(self, function: Callable, *args):
+        """
+        Run a call after the ones submitted so far, and wait for its result
+        """
+        self.drain()
+        return self.executor.submit(function, *args).result()
+
+    # --------------------------------------------------------------------------
+    def drain(self):
+        """
+        Wait for the calls submitted so far; the first one that failed raises its exception here
+        """
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            self.executor.shutdown()
+
+
+###############################################################################
+class GatedCommand:
+    """
+    A shell command spawned ahead of time, blocked on reading its stdin until release()
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, cmd: str, temp_dir: str = None, **popen_args):
+        """
+        :param temp_dir: a directory of the command's output, removed with cleanup()
+        :param popen_args: e.g. stdout, for subprocess.Popen
+        """
+        self.cmd = cmd
+        self.temp_dir = temp_dir
+        # own process group, so that cleanup() reaches every process of a pipeline
+        self.proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, start_new_session=True,
+                                     **popen_args)
+
+    # --------------------------------------------------------------------------
+    def release(self, input_file: str) -> 'GatedCommand':
+        """
+        Feed the command input_file as its stdin, which lets it go
+        """
+        try:
+            with open(input_file, 'rb') as f:
+                shutil.copyfileobj(f, self.proc.stdin)
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass                                                                # it failed; wait() tells
+        return self
+
+    # --------------------------------------------------------------------------
+    def wait(self) -> int:
+        """
+        :return: ErrorCode.ok, or ErrorCode.executeShellCommand if the command failed
+        """
+        return ErrorCode.ok if self.proc.wait() == 0 else ErrorCode.executeShellCommand
+
+    # --------------------------------------------------------------------------
+    def cleanup(self):
+        if self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            self.proc.wait()
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
+
+###############################################################################
+class HealthProbe:
+    interval = 0.25                                                             # seconds between probes
+    timeout = 2.0                                                               # seconds
+    idle_probes = 5
+    recovered_probes = 3                                                        # in a row
+    tolerance = 1.5                                                             # times the idle latency
+    slack = 0.002                                                               # seconds, for very fast targets
+
+    # --------------------------------------------------------------------------
+    def __init__(self, target: Target):
+        """
+        :param target: the request to probe with. It is sent over and over, so it should be a
+                       cheap one without side effects, e.g. a GET of a version or health page
+        """
+        self.target = target
+        self.idle_latency = None
+
+    # --------------------------------------------------------------------------
+    def probe(self) -> Optional[float]:
+        """
+        :return: the seconds one request took, None if it failed
+        """
+        host, port, secure = self.target.address()
+        parts = urlsplit(self.target.url)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        if secure:
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout,
+                                                     context=ssl.create_default_context())
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        started = time.perf_counter()
+        try:
+            connection.request(self.target.method, path, body=self.target.body or None,
+                               headers=dict(self.target.headers))
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                return None
+            return time.perf_counter() - started
+        except (OSError, http.client.HTTPException):
+            return None
+        finally:
+            connection.close()
+
+    # --------------------------------------------------------------------------
+    def measure_idle(self) -> Optional[float]:
+        """
+        Measure the latency of the idle target, which tells later when it has recovered
+        :return: the median latency in seconds, None if no probe succeeded
+        """
+        latencies = []
+        for _ in range(self.idle_probes):
+            latency = self.probe()
+            if latency is not None:
+                latencies.append(latency)
+            time.sleep(self.interval)
+        self.idle_latency = statistics.median(latencies) if latencies else None
+        return self.idle_latency
+
+    # --------------------------------------------------------------------------
+    def recovered_latency(self) -> float:
+        return max(self.idle_latency * self.tolerance, self.idle_latency + self.slack)
+
+    # --------------------------------------------------------------------------
+    def wait_recovered(self, max_seconds: float) -> Tuple[float, bool, Optional[float]]:
+        """
+        Probe until recovered_probes probes in a row are within the recovered latency, or until
+        max_seconds have passed
+        :return: seconds waited, whether the target recovered, and the latency of the last probe
+        """
+        started = time.monotonic()
+        deadline = started + max_seconds
+        limit = self.recovered_latency()
+        in_row = 0
+        latency = None
+        while True:
+            latency = self.probe()
+            in_row = in_row + 1 if latency is not None and latency <= limit else 0
+            now = time.monotonic()
+            if in_row >= self.recovered_probes:
+                return now - started, True, latency
+            if now >= deadline:
+                return now - started, False, latency
+            time.sleep(min(self.interval, deadline - now))
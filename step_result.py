@@ -0,0 +1,436 @@
+"""
+Typed results of the load steps, parsed from vegeta's outputs, and their columnar export.
+
+A step's report travels through the script as the dict of `vegeta report -type json`, which is
+what the search, the objectives and the results store read. StepResult is the typed, validated
+view of it for everything that looks at many steps at once: the summary table and CSV file,
+and the export of stored runs. It is built from
+
+- the json report: from_json(), or from_report() for a dict that is already decoded. The
+  fields the script relies on are checked, and a broken report raises badVegetaReport
+- the histogram report, `vegeta report -type hist[...]`: from_hist(), latencies only
+- the binary results of `vegeta attack -output`: from_binary(), decoded by `vegeta encode`
+  and folded into StreamStats, which count the status codes and the errors one by one
+
+Exported, the steps of any number of runs are one column per field, see StepColumns: NumPy
+.npy files, written with the standard library and readable by numpy.load() or read_npy(),
+or a Parquet or Arrow file when pyarrow is installed.
+"""
+
+import ast
+import json
+import shlex
+import struct
+from array import array
+from latency_histogram import LatencyHistogram
+from vegeta_stream import StreamStats, decode_results, result_lines
+from utils import *
+
+
+# the fields of `vegeta report -type json` that the script reads, and their types
+report_schema = {'latencies': dict, 'duration': int, 'wait': int, 'requests': int, 'rate': (int, float),
+                 'throughput': (int, float), 'success': (int, float), 'status_codes': dict}
+latency_schema = ['mean', '50th', '95th', '99th', 'max']
+
+
+###############################################################################
+def validate_report(entry: Any) -> dict:
+    """
+    :param entry: a decoded `vegeta report -type json`
+    :return: entry, if it has all the fields the script reads, with the right types
+    """
+    if not isinstance(entry, dict):
+        raise Exception(ErrorCode.badVegetaReport, "Not a vegeta json report: {!r:.80}".format(entry))
+    for name, kind in report_schema.items():
+        if not isinstance(entry.get(name), kind) or isinstance(entry.get(name), bool):
+            raise Exception(ErrorCode.badVegetaReport, "Bad or missing field {} in the vegeta report: {!r:.80}"
+                            .format(name, entry.get(name)))
+    for name in latency_schema:
+        if not isinstance(entry['latencies'].get(name), (int, float)):
+            raise Exception(ErrorCode.badVegetaReport, "Bad or missing latency {} in the vegeta report: {!r:.80}"
+                            .format(name, entry['latencies'].get(name)))
+    if not isinstance(entry.get('errors') or [], list):
+        raise Exception(ErrorCode.badVegetaReport, "Bad errors in the vegeta report: {!r:.80}"
+                        .format(entry['errors']))
+    return entry
+
+
+###############################################################################
+def parse_report(text: Union[str, bytes]) -> dict:
+    """
+    :param text: the output of `vegeta report -type json`
+    :return: the validated report
+    """
+    try:
+        entry = json.loads(text)
+    except ValueError as e:
+        raise Exception(ErrorCode.badVegetaReport, "Cannot decode the vegeta json report: {}".format(e))
+    return validate_report(entry)
+
+
+###############################################################################
+def decode_result_files(result_files: List[str]) -> Tuple[int, Optional[StreamStats]]:
+    """
+    Fold binary vegeta result files, as written by `vegeta attack -output`, into StreamStats;
+    `vegeta encode` decodes them, and every request is recorded into the latency histogram
+    :return: return code, and the statistics of all the results
+    """
+    cmd = 'vegeta encode -to json {}'.format(' '.join(shlex.quote(f) for f in result_files))
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
+    stats = StreamStats()
+    try:
+        for result in decode_results(result_lines(process.stdout)):
+            stats.add(result)
+    finally:
+        process.stdout.close()
+        ret = process.wait()
+    if ret != 0:
+        print('\t{} exited with {}'.format(cmd, ret))
+        return ErrorCode.executeShellCommand, None
+    return ErrorCode.ok, stats
+
+
+###############################################################################
+def report_result_files(result_files: List[str], exact_histogram: bool = False) -> Any:
+    """
+    Report on binary vegeta result files, as written by `vegeta attack -output`. vegeta itself
+    aggregates them: its json report, and its histogram report over the buckets of
+    LatencyHistogram.vegeta_hist_bounds, 5% wide, which gives the tail quantiles that the json
+    report lacks. They are kept between the 99th and the max of the json report, which are exact.
+    :param exact_histogram: decode every result with `vegeta encode` and record it into the
+                            histogram instead, for all the latencies at 1% precision. It costs
+                            CPU time for each request, which adds up at high rates
+    :return: return code, and the json report with the histogram and its 99.9th and 99.99th
+    """
+    if exact_histogram:
+        ret, stats = decode_result_files(result_files)
+        if ret != 0:
+            return ret, None
+        return ErrorCode.ok, stats.report()
+
+    files = ' '.join(shlex.quote(f) for f in result_files)
+    ret, lines = TestUtils.execute_multiple_commands('vegeta report -type json {}'.format(files))
+    if ret != 0:
+        return ret, None
+    entry = parse_report(lines[0])
+
+    ret, lines = TestUtils.execute_multiple_commands('vegeta report -type={} {}'.format(
+        LatencyHistogram.vegeta_hist_type(), files))
+    if ret == 0:
+        histogram = LatencyHistogram.from_vegeta_hist(lines)
+        latencies = entry['latencies']
+        p999, p9999 = histogram.quantiles([0.999, 0.9999])
+        latencies['99.9th'] = min(max(p999, latencies['99th']), latencies['max'])
+        latencies['99.99th'] = min(max(p9999, latencies['99.9th']), latencies['max'])
+        entry['histogram'] = histogram.to_text()
+    return ErrorCode.ok, entry
+
+
+###############################################################################
+def format_time(value: float) -> Tuple[float, str]:
+    """
+    :param value: nanoseconds
+    :return: the value in ms, or in s above a second, and its unit
+    """
+    value /= 1e6
+    if value > 1000:
+        return value / 1000.0, 's'
+    return value, 'ms'
+
+
+###############################################################################
+class StepResult:
+    """
+    One load step: the requested and achieved rates, the latencies in nanoseconds, the count of
+    every status code (0 for no response) and of every error message
+    """
+    __slots__ = ('step', 'attack_rate', 'requests', 'rate', 'throughput', 'success', 'duration', 'wait',
+                 'latency_mean', 'latency_50th', 'latency_90th', 'latency_95th', 'latency_99th',
+                 'latency_999th', 'latency_9999th', 'latency_max', 'latency_min', 'bytes_in', 'bytes_out',
+                 'status_codes', 'errors', 'bound_by')
+    step: int
+    attack_rate: int
+    requests: int
+    rate: float
+    throughput: float
+    success: float                                                              # ratio, 0 to 1
+    duration: int
+    wait: int
+    latency_mean: int
+    latency_50th: int
+    latency_90th: int
+    latency_95th: int
+    latency_99th: int
+    latency_999th: int
+    latency_9999th: int
+    latency_max: int
+    latency_min: int
+    bytes_in: int
+    bytes_out: int
+    status_codes: Dict[int, int]
+    errors: Dict[str, int]                                                      # 0 where only the message is known
+    bound_by: str
+
+    # the latencies of the summary table, in its order
+    table_latencies = ('latency_mean', 'latency_50th', 'latency_95th', 'latency_99th', 'latency_999th',
+                       'latency_9999th', 'latency_max')
+
+    # --------------------------------------------------------------------------
+    def __init__(self, step: int = 0, attack_rate: int = 0):
+        self.step = step
+        self.attack_rate = attack_rate
+        self.requests = 0
+        self.rate = self.throughput = self.success = 0.0
+        self.duration = self.wait = 0
+        self.latency_mean = self.latency_50th = self.latency_90th = self.latency_95th = self.latency_99th = 0
+        self.latency_999th = self.latency_9999th = self.latency_max = self.latency_min = 0
+        self.bytes_in = self.bytes_out = 0
+        self.status_codes = {}
+        self.errors = {}
+        self.bound_by = ''
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_report(cls, entry: dict, step: int = 0, attack_rate: int = 0) -> 'StepResult':
+        """
+        :param entry: the json report of the step, as kept in the result set and the results store
+        """
+        validate_report(entry)
+        result = cls(step, attack_rate or int(entry['rate']))
+        latencies = entry['latencies']
+        result.requests = entry['requests']
+        result.rate = float(entry['rate'])
+        result.throughput = float(entry['throughput'])
+        result.success = float(entry['success'])
+        result.duration = entry['duration']
+        result.wait = entry['wait']
+        result.latency_mean = int(latencies['mean'])
+        result.latency_50th = int(latencies['50th'])
+        result.latency_90th = int(latencies.get('90th', 0))
+        result.latency_95th = int(latencies['95th'])
+        result.latency_99th = int(latencies['99th'])
+        result.latency_999th = int(latencies.get('99.9th', 0))
+        result.latency_9999th = int(latencies.get('99.99th', 0))
+        result.latency_max = int(latencies['max'])
+        result.latency_min = int(latencies.get('min', 0))
+        result.bytes_in = int((entry.get('bytes_in') or {}).get('total', 0))
+        result.bytes_out = int((entry.get('bytes_out') or {}).get('total', 0))
+        result.status_codes = {int(code): count for code, count in entry['status_codes'].items()}
+        result.errors = dict(entry.get('error_counts') or dict.fromkeys(entry.get('errors') or [], 0))
+        result.bound_by = (entry.get('bound_by') or {}).get('objective', '')
+        return result
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_json(cls, text: Union[str, bytes], step: int = 0, attack_rate: int = 0) -> 'StepResult':
+        """
+        :param text: the output of `vegeta report -type json`
+        """
+        return cls.from_report(parse_report(text), step, attack_rate)
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_hist(cls, lines: Iterable[str], step: int = 0, attack_rate: int = 0) -> 'StepResult':
+        """
+        :param lines: the output of `vegeta report -type hist[...]`; it has the latencies, at the
+                      resolution of its buckets, and the number of requests, nothing else
+        """
+        histogram = LatencyHistogram.from_vegeta_hist(lines)
+        result = cls(step, attack_rate)
+        result.requests = histogram.total_count
+        result.latency_mean = histogram.mean()
+        (result.latency_50th, result.latency_90th, result.latency_95th, result.latency_99th,
+         result.latency_999th, result.latency_9999th) = histogram.quantiles([0.5, 0.9, 0.95, 0.99, 0.999, 0.9999])
+        result.latency_max = histogram.max_recorded
+        result.latency_min = histogram.min_value
+        return result
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_results(cls, results: Iterable[dict], step: int = 0, attack_rate: int = 0) -> 'StepResult':
+        """
+        :param results: decoded vegeta results, one per request, as `vegeta encode -to json` writes them
+        """
+        stats = StreamStats()
+        for result in results:
+            stats.add(result)
+        return cls.from_report(stats.report(), step, attack_rate)
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_binary(cls, result_files: List[str], step: int = 0, attack_rate: int = 0) -> 'StepResult':
+        """
+        :param result_files: binary vegeta result files, as written by `vegeta attack -output`
+        """
+        ret, stats = decode_result_files(result_files)
+        if ret != 0:
+            raise Exception(ErrorCode.executeShellCommand, "Cannot decode the vegeta results {}".format(result_files))
+        return cls.from_report(stats.report(), step, attack_rate)
+
+    # --------------------------------------------------------------------------
+    @property
+    def success_pct(self) -> float:
+        return self.success * 100.0
+
+    # --------------------------------------------------------------------------
+    @property
+    def failure_pct(self) -> float:
+        return 100.0 - self.success * 100.0
+
+    # --------------------------------------------------------------------------
+    def table_times(self) -> List[Tuple[float, str]]:
+        """
+        :return: the duration and the latencies of the summary table, each in ms or s, with its unit
+        """
+        return [format_time(self.duration)] + [format_time(getattr(self, name)) for name in self.table_latencies]
+
+    # --------------------------------------------------------------------------
+    def status_classes(self) -> Dict[str, int]:
+        """
+        :return: the requests by class of status code, e.g. {'2xx': 9950, '5xx': 50}; 'none' for
+                 the requests that got no response
+        """
+        classes = {}
+        for code, count in sorted(self.status_codes.items()):
+            name = '{}xx'.format(code // 100) if code else 'none'
+            classes[name] = classes.get(name, 0) + count
+        return classes
+
+    # --------------------------------------------------------------------------
+    def breakdown(self) -> str:
+        """
+        :return: the status codes and the errors of the step in one line, the most frequent first
+        """
+        text = ' '.join('{}:{}'.format(code, count) for code, count in
+                        sorted(self.status_codes.items(), key=lambda item: -item[1]))
+        errors = sorted(self.errors.items(), key=lambda item: -item[1])
+        if errors:
+            text += '; ' + '; '.join('{} x{}'.format(error, count) if count else error for error, count in errors)
+        return text
+
+
+###############################################################################
+def write_npy(path: str, values: array):
+    """
+    Write a one-dimensional array as a NumPy .npy file, format version 1.0
+    """
+    header = "{{'descr': '<{}8', 'fortran_order': False, 'shape': ({},), }}".format(
+        'f' if values.typecode == 'd' else 'i', len(values))
+    header += ' ' * (63 - (10 + len(header)) % 64) + '\n'                        # aligned to 64 bytes
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    with open(path, 'wb') as f:
+        f.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        values.tofile(f)
+
+
+###############################################################################
+def read_npy(path: str) -> array:
+    """
+    Read a one-dimensional .npy file of 8-byte integers or floats, as write_npy() writes them
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:6] != b'\x93NUMPY':
+        raise Exception(ErrorCode.badParameterType, "Not a .npy file: {}".format(path))
+    length = struct.unpack_from('<H', data, 8)[0]
+    header = ast.literal_eval(data[10:10 + length].decode('latin1'))
+    typecode = {'<f8': 'd', '<i8': 'q'}.get(header['descr'])
+    if typecode is None or header['fortran_order'] or len(header['shape']) != 1:
+        raise Exception(ErrorCode.badParameterType, "Unsupported .npy file {}: {}".format(path, header))
+    values = array(typecode)
+    values.frombytes(data[10 + length:])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+###############################################################################
+class StepColumns:
+    """
+    The steps of one or more runs, one column per field
+    """
+    formats = ['npy', 'parquet', 'arrow']
+    integer_fields = ['step', 'attack_rate', 'requests', 'duration', 'wait', 'latency_mean', 'latency_50th',
+                      'latency_90th', 'latency_95th', 'latency_99th', 'latency_999th', 'latency_9999th',
+                      'latency_max', 'latency_min', 'bytes_in', 'bytes_out']
+    float_fields = ['rate', 'throughput', 'success']
+
+    # --------------------------------------------------------------------------
+    def __init__(self, results: Iterable[Tuple[int, StepResult]]):
+        """
+        :param results: the steps, each with the id of its run
+        """
+        self.columns = {'run_id': array('q')}
+        self.columns.update((name, array('q')) for name in self.integer_fields)
+        self.columns.update((name, array('d')) for name in self.float_fields)
+        self.text = {'bound_by': [], 'errors': []}
+        codes = {}
+        rows = 0
+        for run_id, result in results:
+            self.columns['run_id'].append(run_id)
+            for name in self.integer_fields + self.float_fields:
+                self.columns[name].append(getattr(result, name))
+            for code, count in result.status_codes.items():
+                codes.setdefault(code, {})[rows] = count
+            self.text['bound_by'].append(result.bound_by)
+            self.text['errors'].append(json.dumps(result.errors) if result.errors else '')
+            rows += 1
+        self.rows = rows
+        for code in sorted(codes):
+            column = self.columns['code_{}'.format(code)] = array('q', bytes(8 * rows))
+            for row, count in codes[code].items():
+                column[row] = count
+
+    # --------------------------------------------------------------------------
+    def write(self, output: str, file_format: str = 'npy') -> List[str]:
+        """
+        :param output: a directory for npy, a file for parquet and arrow
+        :return: the files written
+        """
+        if file_format == 'npy':
+            return self.write_npy(output)
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception(ErrorCode.toolNotInstalled, "{} needs pyarrow; pip install pyarrow, or use npy"
+                            .format(file_format))
+        table = pyarrow.table({name: pyarrow.array(values, pyarrow.float64() if values.typecode == 'd'
+                                                   else pyarrow.int64()) for name, values in self.columns.items()})
+        for name, values in self.text.items():
+            table = table.append_column(name, pyarrow.array(values, pyarrow.string()))
+        if file_format == 'parquet':
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(table, output)
+        else:
+            import pyarrow.feather
+            pyarrow.feather.write_feather(table, output)
+        return [output]
+
+    # --------------------------------------------------------------------------
+    def write_npy(self, directory: str) -> List[str]:
+        """
+        One .npy file per numeric column, and columns.json with the list of the columns, the
+        rows and the text columns
+        """
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name, values in self.columns.items():
+            files.append(os.path.join(directory, '{}.npy'.format(name)))
+            write_npy(files[-1], values)
+        files.append(os.path.join(directory, 'columns.json'))
+        with open(files[-1], 'w') as f:
+            json.dump({'rows': self.rows, 'columns': list(self.columns), 'text': self.text}, f)
+        return files
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def read_npy(directory: str) -> Tuple[Dict[str, array], Dict[str, List[str]]]:
+        """
+        :return: the numeric and the text columns of a directory that write_npy() wrote
+        """
+        with open(os.path.join(directory, 'columns.json'), 'r') as f:
+            manifest = json.load(f)
+        columns = {name: read_npy(os.path.join(directory, '{}.npy'.format(name))) for name in manifest['columns']}
+        return columns, manifest['text']
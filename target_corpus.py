@@ -0,0 +1,329 @@
+"""
+Pre-compiled target corpora, for replay files with millions of requests.
+
+A vegeta target file, or a file of JSON lines in vegeta's json target format
+
+    {"method": "POST", "url": "http://host/path", "header": {"Content-Type": ["application/json"]},
+     "body": "<base64>", "weight": 2}
+
+is compiled once into a binary corpus. Every request is split into its request line, its
+header block and its body, and each distinct piece is stored only once. The corpus is
+memory-mapped when it is used, so a step reads the requests it sends straight from the page
+cache, shared by all the worker processes, without parsing anything.
+
+Layout, little-endian:
+
+    header   magic 'VTC1', target count, host count, piece count,
+             offsets of the hosts, the pieces, the records, the weights and the data
+    hosts    json list of [host, port, secure]
+    pieces   per piece: offset into the data, length
+    records  per target: request line, header block and body piece ids, host id, HEAD flag
+    weights  per target: cumulative weight, as doubles
+    data     the pieces
+
+    python3 target_corpus.py compile <target file> <corpus file>
+    python3 target_corpus.py info <corpus file>
+"""
+
+import json
+import time
+import mmap
+import base64
+import random
+import struct
+import argparse
+from array import array
+from urllib.parse import urlsplit
+from vegeta_targets import Target, read_targets
+from utils import *
+
+
+target_orders = ['sequential', 'shuffle', 'weighted']
+weighted_sample_size = 10000                                                    # at least, for small corpora
+
+
+###############################################################################
+def target_indexes(count: int, target_order: str = 'sequential', seed: int = 0, cum_weights=None) -> array:
+    """
+    :param target_order: sequential, shuffle - a permutation, or weighted - sampled by cum_weights
+    :return: the indexes of the targets to send, in order
+    """
+    if target_order == 'sequential':
+        return array('I', range(count))
+    generator = random.Random(seed)
+    if target_order == 'shuffle':
+        indexes = array('I', range(count))
+        generator.shuffle(indexes)
+        return indexes
+    if target_order == 'weighted':
+        return array('I', generator.choices(range(count), cum_weights=cum_weights,
+                                            k=max(count, weighted_sample_size)))
+    raise Exception(ErrorCode.valueOutOfRange, "Unknown target order {}".format(target_order))
+
+
+###############################################################################
+def names_host(value: str, host_name: str, port: int) -> bool:
+    """
+    :param value: a Host header
+    :return: whether it names the host and port of the url, with or without the port
+    """
+    parts = urlsplit('//' + value)
+    try:
+        return parts.hostname == host_name and parts.port in (None, port)
+    except ValueError:                                                          # not a port
+        return False
+
+
+###############################################################################
+class TargetCorpus:
+    magic = b'VTC1'
+    header = struct.Struct('<4sIIIQQQQQ')
+    piece = struct.Struct('<QI')
+    record = struct.Struct('<IIIHB')
+
+    # --------------------------------------------------------------------------
+    def __init__(self, corpus_file: str):
+        self.corpus_file = corpus_file
+        with open(corpus_file, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.target_count, host_count, self.piece_count, hosts_offset, self.pieces_offset,
+         self.records_offset, weights_offset, self.data_offset) = self.header.unpack_from(self.data, 0)
+        if magic != self.magic:
+            raise Exception(ErrorCode.badParameterType, "{} is not a compiled target corpus".format(corpus_file))
+        self.hosts = [tuple(host) for host in json.loads(self.data[hosts_offset:self.pieces_offset])]
+        self.cum_weights = memoryview(self.data)[weights_offset:self.data_offset].cast('d')
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+        return self.target_count
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.cum_weights.release()
+        self.data.close()
+
+    # --------------------------------------------------------------------------
+    def piece_bytes(self, piece_id: int) -> bytes:
+        offset, length = self.piece.unpack_from(self.data, self.pieces_offset + piece_id * self.piece.size)
+        start = self.data_offset + offset
+        return self.data[start:start + length]
+
+    # --------------------------------------------------------------------------
+    def request(self, index: int) -> Tuple[Tuple[str, int, bool], bytes, bool]:
+        """
+        :return: address, the complete HTTP request, and whether it is a HEAD request, of one target
+        """
+        line, headers, body, host, head_request = \
+            self.record.unpack_from(self.data, self.records_offset + index * self.record.size)
+        return self.hosts[host], self.piece_bytes(line) + self.piece_bytes(headers) + self.piece_bytes(body), \
+            head_request == 1
+
+    # --------------------------------------------------------------------------
+    def target(self, index: int) -> Target:
+        """
+        :return: one target decoded back, without the headers that Target.request_bytes() adds:
+                 a Host of the url's own host, the Content-Length of the body, the User-Agent.
+                 A Host of another name, e.g. for a virtual host, stays
+        """
+        line, headers, body, host, _ = \
+            self.record.unpack_from(self.data, self.records_offset + index * self.record.size)
+        method, path, _ = self.piece_bytes(line).decode('latin-1').split(' ', 2)
+        host_name, port, secure = self.hosts[host]
+        body = self.piece_bytes(body)
+        header_list = []
+        for header in self.piece_bytes(headers).decode('latin-1').split('\r\n'):
+            name, _, value = header.partition(':')
+            name, value = name.strip(), value.strip()
+            lower_name = name.lower()
+            if not header or (lower_name == 'host' and names_host(value, host_name, port)) or \
+                    (lower_name == 'content-length' and value == str(len(body))) or \
+                    (lower_name == 'user-agent' and value == Target.user_agent):
+                continue
+            header_list.append((name, value))
+        return Target(method, '{}://{}:{}{}'.format('https' if secure else 'http', host_name, port, path),
+                      header_list, body)
+
+    # --------------------------------------------------------------------------
+    def order(self, target_order: str = 'sequential', seed: int = 0) -> array:
+        return target_indexes(self.target_count, target_order, seed, self.cum_weights)
+
+    # --------------------------------------------------------------------------
+    def requests(self, target_order: str = 'sequential', seed: int = 0) -> 'CorpusRequests':
+        return CorpusRequests(self, self.order(target_order, seed))
+
+    # --------------------------------------------------------------------------
+    def export(self, target_file: str, target_order: str = 'sequential', seed: int = 0):
+        """
+        Write the corpus back as a vegeta target file for the vegeta binary, with one body file
+        per distinct body next to it
+        """
+        body_dir = target_file + '.bodies'
+        os.makedirs(body_dir, exist_ok=True)
+        with open(target_file, 'w', encoding='latin-1') as f:
+            for index in self.order(target_order, seed):
+                target = self.target(index)
+                f.write('{} {}\n'.format(target.method, target.url))
+                for name, value in target.headers:
+                    f.write('{}: {}\n'.format(name, value))
+                body = self.record.unpack_from(self.data, self.records_offset + index * self.record.size)[2]
+                if body:
+                    body_file = os.path.join(body_dir, '{}.body'.format(body))
+                    if not os.path.exists(body_file):
+                        with open(body_file, 'wb') as body_out:
+                            body_out.write(self.piece_bytes(body))
+                    f.write('@{}\n'.format(os.path.abspath(body_file)))
+                f.write('\n')
+
+
+###############################################################################
+class CorpusRequests:
+    """
+    The requests of a corpus in a given order, as the sequence of (address, request, HEAD flag)
+    that AsyncAttackEngine iterates. Requests are read from the corpus when they are sent.
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, corpus: TargetCorpus, order: array):
+        self.corpus = corpus
+        self.indexes = order
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.indexes)
+
+    # --------------------------------------------------------------------------
+    def __getitem__(self, position: int):
+        return self.corpus.request(self.indexes[position])
+
+    # --------------------------------------------------------------------------
+    def addresses(self) -> List[Tuple[str, int, bool]]:
+        return list(self.corpus.hosts)
+
+
+###############################################################################
+def is_corpus(target_file: str) -> bool:
+    with open(target_file, 'rb') as f:
+        return f.read(len(TargetCorpus.magic)) == TargetCorpus.magic
+
+
+###############################################################################
+def read_json_targets(target_file: str) -> Iterator[Tuple[Target, float]]:
+    """
+    :return: the targets of a file of JSON lines in vegeta's json format, with their weights
+    """
+    with open(target_file, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                headers = [(name, value) for name, values in item.get('header', {}).items() for value in values]
+                body = base64.b64decode(item['body']) if item.get('body') else b''
+                yield Target(item['method'], item['url'], headers, body), float(item.get('weight', 1.0))
+            except (ValueError, KeyError, TypeError) as e:
+                raise Exception(ErrorCode.badParameterType, "{}:{}: {}".format(target_file, line_no, e))
+
+
+###############################################################################
+def compile_targets(target_file: str, corpus_file: str) -> int:
+    """
+    Compile a vegeta target file, or a file of json targets, into a corpus
+    :return: the number of targets
+    """
+    with open(target_file, 'rb') as f:
+        json_lines = f.read(1024).lstrip().startswith(b'{')
+    targets = read_json_targets(target_file) if json_lines else ((target, 1.0) for target in read_targets(target_file))
+
+    pieces = {b'': 0}
+    hosts = {}
+    records = bytearray()
+    weights = array('d')
+    total_weight = 0.0
+    for target, weight in targets:
+        if weight < 0:
+            raise Exception(ErrorCode.valueOutOfRange, "Negative weight of {}".format(target))
+        request = target.request_bytes()
+        line_end = request.index(b'\r\n') + 2
+        header_end = request.index(b'\r\n\r\n') + 4
+        ids = [pieces.setdefault(piece, len(pieces))
+               for piece in (request[:line_end], request[line_end:header_end], request[header_end:])]
+        host = hosts.setdefault(target.address(), len(hosts))
+        records += TargetCorpus.record.pack(*ids, host, 1 if target.method == 'HEAD' else 0)
+        total_weight += weight
+        weights.append(total_weight)
+    if not weights:
+        raise Exception(ErrorCode.emptyParameter, "No targets in {}".format(target_file))
+
+    host_table = json.dumps([list(address) for address in sorted(hosts, key=hosts.get)]).encode('utf-8')
+    piece_table = bytearray()
+    offset = 0
+    for piece in pieces:                                                        # in id order
+        piece_table += TargetCorpus.piece.pack(offset, len(piece))
+        offset += len(piece)
+
+    hosts_offset = TargetCorpus.header.size
+    pieces_offset = hosts_offset + len(host_table)
+    records_offset = pieces_offset + len(piece_table)
+    weights_offset = records_offset + len(records)
+    weights_offset += -weights_offset % 8                                       # doubles are aligned
+    data_offset = weights_offset + 8 * len(weights)
+
+    temp_file = corpus_file + '.tmp'
+    with open(temp_file, 'wb') as f:
+        f.write(TargetCorpus.header.pack(TargetCorpus.magic, len(weights), len(hosts), len(pieces), hosts_offset,
+                                         pieces_offset, records_offset, weights_offset, data_offset))
+        f.write(host_table)
+        f.write(piece_table)
+        f.write(records)
+        f.write(bytes(weights_offset - records_offset - len(records)))
+        f.write(weights.tobytes())
+        for piece in pieces:
+            f.write(piece)
+    os.replace(temp_file, corpus_file)
+    return len(weights)
+
+
+###############################################################################
+def load_requests(target_file: str, target_order: str = 'sequential', seed: int = 0):
+    """
+    :return: the requests of a corpus or of a vegeta target file, for AsyncAttackEngine
+    """
+    if is_corpus(target_file):
+        return TargetCorpus(target_file).requests(target_order, seed)
+    targets = read_targets(target_file)
+    return [targets[index] for index in target_indexes(len(targets), target_order, seed)]
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Compile vegeta targets into a memory-mapped corpus')
+    commands = args.add_subparsers(dest='command')
+    compile_command = commands.add_parser('compile', help='Compile a target file')
+    compile_command.add_argument('target_file', help='vegeta target file, or json lines of vegeta json targets')
+    compile_command.add_argument('corpus_file', help='The compiled corpus')
+    info_command = commands.add_parser('info', help='Describe a compiled corpus')
+    info_command.add_argument('corpus_file')
+    given_args = args.parse_args(argv[1:])
+
+    if given_args.command == 'compile':
+        started = time.time()
+        count = compile_targets(given_args.target_file, given_args.corpus_file)
+        print('Compiled {} targets into {} ({} bytes) in {:.2f} seconds'.format(
+            count, given_args.corpus_file, os.path.getsize(given_args.corpus_file), time.time() - started))
+    elif given_args.command == 'info':
+        corpus = TargetCorpus(given_args.corpus_file)
+        print('Targets : {}'.format(len(corpus)))
+        print('Hosts   : {}'.format(', '.join('{}:{}'.format(host, port) for host, port, _ in corpus.hosts)))
+        print('Pieces  : {} distinct request lines, header blocks and bodies'.format(corpus.piece_count))
+        print('Size    : {} bytes'.format(os.path.getsize(given_args.corpus_file)))
+        corpus.close()
+    else:
+        args.print_help()
+        return ErrorCode.emptyCommandLineParameters
+    return ErrorCode.ok
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,110 @@
+"""
+The statistics and the baseline comparison of the benchmark suite, offline, on samples made up
+for the purpose instead of trials.
+"""
+
+import os
+import json
+import tempfile
+import unittest
+from benchmark_suite import BenchmarkSuite, compare_samples, sample_summary, t_quantile
+from utils import *
+
+
+###############################################################################
+class TestStatistics(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_t_quantile(self):
+        self.assertEqual(t_quantile(1), 12.706)
+        self.assertEqual(t_quantile(11), 2.228)                                 # rounded towards the wider interval
+        self.assertEqual(t_quantile(1000), 1.980)
+
+    # --------------------------------------------------------------------------
+    def test_sample_summary(self):
+        summary = sample_summary([2.0, 4.0, 6.0])
+        self.assertEqual(summary['mean'], 4.0)
+        self.assertEqual(summary['stdev'], 2.0)
+        half = 4.303 * 2.0 / 3 ** 0.5
+        self.assertAlmostEqual(summary['ci'][0], 4.0 - half)
+        self.assertAlmostEqual(summary['ci'][1], 4.0 + half)
+        self.assertEqual(sample_summary([5.0])['ci'], [5.0, 5.0])
+
+    # --------------------------------------------------------------------------
+    def test_compare_samples(self):
+        same = compare_samples([100.0, 101.0, 99.0], [100.0, 101.0, 99.0])
+        self.assertEqual(same['delta%'], 0.0)
+        self.assertLess(same['ci%'][0], 0.0)
+        self.assertGreater(same['ci%'][1], 0.0)
+        lower = compare_samples([90.0, 91.0, 89.0], [100.0, 101.0, 99.0])
+        self.assertAlmostEqual(lower['delta%'], -10.0)
+        self.assertLess(lower['ci%'][1], 0.0)
+
+
+###############################################################################
+class TestCompare(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        suite_file = os.path.join(directory.name, 'suite.json')
+        with open(suite_file, 'w') as f:
+            json.dump({'name': 'offline', 'scenarios': [{'name': 'mixed', 'target_file': 'targets.txt'}]}, f)
+        self.suite = BenchmarkSuite(suite_file)
+        self.baseline = self.report(best_rate=[2000, 2005, 1995], p99_ms=[10.0, 10.5, 9.5])
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def report(**samples) -> dict:
+        return {'scenarios': {'mixed': {'samples': samples, 'summary': {
+            metric: sample_summary(values) for metric, values in samples.items() if values}}}}
+
+    # --------------------------------------------------------------------------
+    def test_no_regression(self):
+        report = self.report(best_rate=[1990, 2010, 2000], p99_ms=[10.2, 9.8, 10.1])
+        self.assertEqual(self.suite.compare(report, self.baseline), [])
+        self.assertFalse(report['scenarios']['mixed']['deltas']['best_rate']['regression'])
+
+    # --------------------------------------------------------------------------
+    def test_lower_rate(self):
+        regressions = self.suite.compare(self.report(best_rate=[1800, 1805, 1795], p99_ms=[10.0, 10.5, 9.5]),
+                                         self.baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('best_rate', regressions[0])
+
+    # --------------------------------------------------------------------------
+    def test_higher_latency(self):
+        regressions = self.suite.compare(self.report(best_rate=[2000, 2005, 1995], p99_ms=[13.0, 13.5, 12.5]),
+                                         self.baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('p99_ms', regressions[0])
+
+    # --------------------------------------------------------------------------
+    def test_no_capacity(self):
+        # no trial found a passing rate: best rates of 0, and no latencies at all
+        regressions = self.suite.compare(self.report(best_rate=[0, 0, 0], p99_ms=[]), self.baseline)
+        self.assertTrue(any('best_rate' in message for message in regressions))
+        self.assertTrue(any('p99_ms has no samples' in message for message in regressions))
+        regressions = self.suite.compare(self.report(best_rate=[], p99_ms=[]), self.baseline)
+        self.assertEqual(len(regressions), 2)
+
+    # --------------------------------------------------------------------------
+    def test_new_scenario(self):
+        report = self.report(best_rate=[100, 100, 100])
+        report['scenarios']['other'] = report['scenarios'].pop('mixed')
+        self.assertEqual(self.suite.compare(report, self.baseline), [])
+
+    # --------------------------------------------------------------------------
+    def test_bad_suite(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            f.write('{"scenarios": [{"name": "a"}]}')
+        self.addCleanup(os.remove, f.name)
+        with self.assertRaises(Exception) as caught:
+            BenchmarkSuite(f.name)
+        self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+The saturation check of the load generator, on made-up reports and on the async engine made to
+fall behind its schedule on purpose.
+"""
+
+import time
+import unittest
+from async_engine import AsyncAttackEngine
+from client_resources import ClientMonitor
+from vegeta_targets import Target
+from utils import *
+
+
+###############################################################################
+class TestSaturation(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def report(**fields) -> dict:
+        report = {'requested_rate': 1000, 'rate': 1000.0, 'lateness_ms': 0.0, 'cpu_cores': 0.5, 'cores': 4,
+                  'fds': 100, 'fd_limit': 1024, 'ports': 100, 'port_range': 28232}
+        report.update(fields)
+        return report
+
+    # --------------------------------------------------------------------------
+    def test_limits(self):
+        monitor = ClientMonitor.__new__(ClientMonitor)
+        self.assertEqual(monitor.saturation(self.report()), [])
+        self.assertTrue(monitor.saturation(self.report(rate=900.0))[0].startswith('rate'))
+        self.assertTrue(monitor.saturation(self.report(lateness_ms=80.0))[0].startswith('late'))
+        self.assertTrue(monitor.saturation(self.report(cpu_cores=3.8))[0].startswith('cpu'))
+        self.assertTrue(monitor.saturation(self.report(fds=1000))[0].startswith('fds'))
+        self.assertTrue(monitor.saturation(self.report(ports=27000))[0].startswith('ports'))
+        self.assertEqual(len(monitor.saturation(self.report(rate=0.0, lateness_ms=500.0))), 2)
+
+
+###############################################################################
+@unittest.skipUnless(ClientMonitor.available(), 'needs /proc')
+class TestFallingBehind(unittest.TestCase):
+    # nothing listens on port 1: every request fails at once, which does not matter here
+    targets = [Target('GET', 'http://127.0.0.1:1/')]
+    rate = 400
+    duration = 2
+
+    # --------------------------------------------------------------------------
+    def attack(self, on_tick) -> dict:
+        monitor = ClientMonitor()
+        monitor.begin()
+        try:
+            stats = AsyncAttackEngine(self.targets).attack(self.rate, self.duration, on_tick=on_tick)
+        finally:
+            monitor.end()
+        return monitor.report(stats.report(), self.rate)
+
+    # --------------------------------------------------------------------------
+    def test_keeps_up(self):
+        report = self.attack(None)
+        self.assertLess(report['lateness_ms'], ClientMonitor.lateness_limit)
+        self.assertFalse([reason for reason in report['saturated'] if reason.split()[0] in ('rate', 'late')])
+
+    # --------------------------------------------------------------------------
+    def test_falls_behind(self):
+        def stall():
+            time.sleep(0.3)                                                     # blocks the event loop
+            return False
+
+        report = self.attack(stall)
+        self.assertGreaterEqual(report['lateness_ms'], ClientMonitor.lateness_limit)
+        reasons = [reason.split()[0] for reason in report['saturated']]
+        self.assertIn('late', reasons)
+        self.assertIn('rate', reasons)                                          # the sends, not the schedule
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
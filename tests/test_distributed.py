@@ -0,0 +1,114 @@
+"""
+The distributed attack without vegeta: the rate split, the transports, and what the coordinator
+does with workers that fail, run by fake transports that ignore the vegeta command.
+"""
+
+import io
+import time
+import tempfile
+import contextlib
+import unittest
+from unittest import mock
+from distributed import DistributedAttack, LocalTransport, SSHTransport, WorkerTransport
+from utils import *
+
+
+###############################################################################
+class ScriptTransport(WorkerTransport):
+    """
+    Runs a shell script of its own instead of the vegeta command
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, script: str):
+        self.script = script
+
+    # --------------------------------------------------------------------------
+    def launch_args(self, command):
+        return ['sh', '-c', self.script]
+
+
+###############################################################################
+class TestDistributed(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_split_rate(self):
+        self.assertEqual(DistributedAttack.split_rate(10, 3), [4, 3, 3])
+        self.assertEqual(DistributedAttack.split_rate(2, 4), [1, 1, 0, 0])
+        for rate in (1, 99, 1000, 1001):
+            for workers in (1, 3, 7):
+                rates = DistributedAttack.split_rate(rate, workers)
+                self.assertEqual(sum(rates), rate)
+                self.assertLessEqual(max(rates) - min(rates), 1)
+
+    # --------------------------------------------------------------------------
+    def test_local_workers(self):
+        workers = DistributedAttack.local_workers(5)
+        self.assertEqual(len(workers), 5)
+        self.assertEqual([worker.core for worker in workers], [i % (os.cpu_count() or 1) for i in range(5)])
+
+    # --------------------------------------------------------------------------
+    def test_transports(self):
+        with self.assertRaises(TypeError):
+            WorkerTransport()
+        self.assertEqual(LocalTransport().launch_args('true'), ['sh', '-c', 'true'])
+        self.assertEqual(LocalTransport().prepare('targets.txt'), 'targets.txt')
+        args = SSHTransport('user@host').launch_args("read go; exec vegeta attack -targets='a b'")
+        self.assertEqual(args[:4], ['ssh', '-T', '-o', 'BatchMode=yes'])
+        self.assertEqual(args[4], 'user@host')
+        self.assertEqual(args[5], 'sh -c \'read go; exec vegeta attack -targets=\'"\'"\'a b\'"\'"\'\'')
+        with self.assertRaises(Exception) as caught:
+            DistributedAttack([], 'targets.txt')
+        self.assertEqual(caught.exception.args[0], ErrorCode.emptyParameter)
+
+    # --------------------------------------------------------------------------
+    def test_ssh_prepare(self):
+        # a fake scp on the ${PATH} that writes down its arguments, one per line
+        with tempfile.TemporaryDirectory(prefix='bin dir ') as directory:
+            arguments_file = os.path.join(directory, 'arguments')
+            with open(os.path.join(directory, 'scp'), 'w') as f:
+                f.write('#!/bin/sh\nprintf "%s\\n" "$@" > "{}"\n'.format(arguments_file))
+            os.chmod(os.path.join(directory, 'scp'), 0o755)
+            target_file = os.path.join(directory, 'my targets.txt')
+            with mock.patch.dict(os.environ, {'PATH': directory + os.pathsep + os.environ['PATH']}):
+                remote_file = SSHTransport('user@host', '/tmp').prepare(target_file)
+            with open(arguments_file) as f:
+                arguments = f.read().splitlines()
+        self.assertEqual(remote_file, '/tmp/my_targets.txt')
+        self.assertEqual(arguments, ['-q', '-o', 'BatchMode=yes', target_file, 'user@host:/tmp/my_targets.txt'])
+
+    # --------------------------------------------------------------------------
+    def attack(self, scripts: List[str]) -> Tuple[Any, float]:
+        """
+        :return: what the attack returned, and how long it took
+        """
+        attack = DistributedAttack([ScriptTransport(script) for script in scripts], 'targets.txt')
+        start = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = attack.attack(len(scripts), 1)
+        return result, time.monotonic() - start
+
+    # --------------------------------------------------------------------------
+    def test_worker_gone_before_the_start(self):
+        drain = DistributedAttack.drain
+
+        def slow_drain(stream):
+            time.sleep(0.5)                                                     # the first worker exits meanwhile
+            return drain(stream)
+
+        with mock.patch.object(DistributedAttack, 'drain', staticmethod(slow_drain)):
+            result, seconds = self.attack(['echo no login >&2; exit 255', 'read go; sleep 30'])
+        self.assertEqual(result, (ErrorCode.executeShellCommand, None))
+        self.assertLess(seconds, 10)                                            # the waiting worker was stopped
+
+    # --------------------------------------------------------------------------
+    def test_chatty_worker(self):
+        # more on stderr than a pipe buffers; reading it only after the exit would hang
+        result, seconds = self.attack(['read go; head -c 1000000 /dev/zero >&2; exit 1'] * 2)
+        self.assertEqual(result, (ErrorCode.executeShellCommand, None))
+        self.assertLess(seconds, 10)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+The log-bucketed latency histogram: its buckets, quantiles, merges, differences and encodings,
+against the exact values of the samples recorded into it.
+"""
+
+import random
+import unittest
+from array import array
+from latency_histogram import LatencyHistogram, parse_go_duration
+from utils import *
+
+
+###############################################################################
+def exact_quantile(values: List[int], q: float) -> int:
+    """
+    :param values: sorted
+    :return: the smallest value with at least q of the values at or below it
+    """
+    rank = max(int(q * len(values) + 0.999999999), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+###############################################################################
+class TestLatencyHistogram(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        generator = random.Random(7)
+        # latencies around 2ms with a long tail, in nanoseconds
+        self.values = [int(generator.lognormvariate(14.5, 1.0)) for _ in range(20000)]
+        self.histogram = LatencyHistogram()
+        for value in self.values:
+            self.histogram.record(value)
+
+    # --------------------------------------------------------------------------
+    def test_parse_go_duration(self):
+        self.assertEqual(parse_go_duration('0'), 0)
+        self.assertEqual(parse_go_duration('1.5ms'), 1500000)
+        self.assertEqual(parse_go_duration('2m0.5s'), 120500000000)
+        self.assertEqual(parse_go_duration('250µs'), 250000)
+        with self.assertRaises(Exception) as caught:
+            parse_go_duration('soon')
+        self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType)
+
+    # --------------------------------------------------------------------------
+    def test_index_value_round_trip(self):
+        histogram = LatencyHistogram()
+        for value in list(range(300)) + [1000, 4095, 4096, 123456, 10 ** 9, 37 * 10 ** 9, histogram.max_value]:
+            index = histogram.index_of(value)
+            self.assertEqual(histogram.index_of(histogram.value_at_index(index)), index)
+            self.assertLessEqual(abs(histogram.value_at_index(index) - value), value / 200 + 0.5)
+        self.assertLess(histogram.index_of(histogram.max_value), len(histogram.counts))
+
+    # --------------------------------------------------------------------------
+    def test_quantile_error_bound(self):
+        values = sorted(self.values)
+        qs = [0.0, 0.5, 0.9, 0.95, 0.99, 0.999, 0.9999, 1.0]
+        for q, value in zip(qs, self.histogram.quantiles(qs)):
+            exact = exact_quantile(values, q) if 0 < q < 1 else (values[0] if q == 0 else values[-1])
+            self.assertLessEqual(abs(value - exact), exact * 0.01, 'quantile {}'.format(q))
+            self.assertEqual(value, self.histogram.quantile(q))
+        self.assertEqual(self.histogram.total_count, len(values))
+        self.assertEqual(self.histogram.mean(), int(sum(values) / len(values)))
+        self.assertEqual((self.histogram.min_value, self.histogram.max_recorded), (values[0], values[-1]))
+
+    # --------------------------------------------------------------------------
+    def test_empty_and_reset(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.quantile(0.99), 0)
+        self.assertEqual(histogram.quantiles([0.5, 0.99]), [0, 0])
+        self.assertEqual(histogram.mean(), 0)
+        self.histogram.reset()
+        self.assertEqual(self.histogram.total_count, 0)
+        self.assertFalse(any(self.histogram.counts))
+
+    # --------------------------------------------------------------------------
+    def test_merge(self):
+        half = len(self.values) // 2
+        first, second = LatencyHistogram(), LatencyHistogram()
+        for value in self.values[:half]:
+            first.record(value)
+        for value in self.values[half:]:
+            second.record(value)
+        merged = LatencyHistogram.merged([first, LatencyHistogram(), second])
+        self.assertEqual(merged.counts, self.histogram.counts)
+        self.assertEqual((merged.total_count, merged.total_value, merged.min_value, merged.max_recorded),
+                         (self.histogram.total_count, self.histogram.total_value, self.histogram.min_value,
+                          self.histogram.max_recorded))
+        other = LatencyHistogram()
+        other.record(1)
+        other.counts = other.counts[:-1]
+        with self.assertRaises(Exception):
+            merged.merge(other)
+
+    # --------------------------------------------------------------------------
+    def test_difference(self):
+        earlier = array('Q', self.histogram.counts)
+        later = [50 * 10 ** 6, 60 * 10 ** 6, 70 * 10 ** 6]
+        for value in later:
+            self.histogram.record(value)
+        window = LatencyHistogram.difference(array('Q', self.histogram.counts), earlier)
+        self.assertEqual(window.total_count, 3)
+        self.assertLessEqual(abs(window.min_value - later[0]), later[0] * 0.01)
+        self.assertLessEqual(abs(window.max_recorded - later[-1]), later[-1] * 0.01)
+        self.assertLessEqual(abs(window.quantile(0.5) - later[1]), later[1] * 0.01)
+        self.assertEqual(LatencyHistogram.difference(earlier, earlier).total_count, 0)
+
+    # --------------------------------------------------------------------------
+    def test_encode_decode(self):
+        decoded = LatencyHistogram.decode(self.histogram.encode())
+        self.assertEqual(decoded.counts, self.histogram.counts)
+        self.assertEqual((decoded.total_count, decoded.total_value, decoded.min_value, decoded.max_recorded),
+                         (self.histogram.total_count, self.histogram.total_value, self.histogram.min_value,
+                          self.histogram.max_recorded))
+        self.assertEqual(LatencyHistogram.from_text(self.histogram.to_text()).counts, self.histogram.counts)
+        self.assertLess(len(self.histogram.encode()), 4096)
+        with self.assertRaises(Exception) as caught:
+            LatencyHistogram.decode(b'XXXX' + self.histogram.encode()[4:])
+        self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType)
+
+    # --------------------------------------------------------------------------
+    def test_vegeta_hist(self):
+        bounds = [parse_go_duration(bound) for bound in LatencyHistogram.vegeta_hist_bounds]
+        self.assertEqual(bounds, sorted(set(bounds)))
+        self.assertGreaterEqual(bounds[-1], 60 * 10 ** 9)
+        self.assertTrue(all(abs(high / low - 1.05) < 1e-4 for low, high in zip(bounds[1:], bounds[2:])))
+        self.assertTrue(LatencyHistogram.vegeta_hist_type().startswith("'hist[0,50000ns,52500ns,"))
+
+        lines = ['Bucket           #     %       Histogram',
+                 '[0s,     50us]   0     0.00%',
+                 '[1ms,    1.05ms] 90    90.00%  ####',
+                 '[10ms,   20ms]   9     9.00%   #',
+                 '[1s,     +Inf]   1     1.00%']
+        histogram = LatencyHistogram.from_vegeta_hist(lines)
+        self.assertEqual(histogram.total_count, 100)
+        self.assertLessEqual(abs(histogram.quantile(0.5) - 1025000), 1025000 * 0.01)
+        self.assertLessEqual(abs(histogram.quantile(0.95) - 15000000), 15000000 * 0.01)
+        self.assertLessEqual(abs(histogram.quantile(0.999) - 10 ** 9), 10 ** 9 * 0.01)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Live metrics: the Prometheus text page of a step, as a scraper and the dashboard read it.
+"""
+
+import unittest
+from live_metrics import LiveMetrics, parse_metrics
+from vegeta_stream import StreamStats
+from utils import *
+
+
+###############################################################################
+class TestLiveMetrics(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        self.live = LiveMetrics(0)
+        self.addCleanup(self.live.server.server_close)
+
+    # --------------------------------------------------------------------------
+    def test_types(self):
+        text = self.live.render()
+        self.assertIn('# TYPE loadtest_rolling_latency_seconds summary', text)
+        self.assertIn('# TYPE loadtest_steps_completed_total counter', text)
+        self.assertNotIn('\nloadtest_best_rate ', text)                         # no value, no sample
+        for line in text.splitlines():
+            if line.startswith('# TYPE'):
+                name, kind = line.split()[2:]
+                self.assertEqual(name.endswith('_total'), kind == 'counter', name)
+
+    # --------------------------------------------------------------------------
+    def test_step(self):
+        stats = StreamStats()
+        self.live.begin_step(1, 100, 10)
+        self.live.watch(lambda: stats)
+        self.live.publish()
+        for index in range(200):
+            stats.record(200 if index % 4 else 503, 2000000 if index % 100 else 50000000)
+        self.live.publish()
+        values = parse_metrics(self.live.text.decode('utf-8'))
+        self.assertEqual(values['loadtest_step_requests'], 200)
+        self.assertEqual(values['loadtest_rolling_success_ratio'], 0.75)
+        self.assertAlmostEqual(values['loadtest_rolling_latency_seconds{quantile="0.5"}'], 0.002, delta=0.00002)
+        self.assertAlmostEqual(values['loadtest_rolling_latency_seconds{quantile="0.99"}'], 0.002, delta=0.00002)
+
+        self.live.end_step({'requests': stats.requests, 'success': stats.success_ratio()}, 100)
+        values = parse_metrics(self.live.text.decode('utf-8'))
+        self.assertEqual(values['loadtest_steps_completed_total'], 1)
+        self.assertEqual(values['loadtest_attacking'], 0)
+        self.assertEqual(values['loadtest_best_rate'], 100)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+Rate shapes: parsing, the rate over time, the requests and their due times, and the analysis of
+a made-up time series.
+"""
+
+import os
+import tempfile
+import unittest
+from array import array
+from rate_shape import RateShape, ShapedStats, Segment, access_log_rates, analyse_shape, log_timestamp
+from utils import *
+
+
+###############################################################################
+class TestParse(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_segments(self):
+        shape = RateShape.parse('ramp(100,2000,60) hold(2000,30) spikes(500,3000,20,2,120) sine(1000,500,60,300)')
+        self.assertEqual([segment.__class__.__name__ for segment in shape.segments], ['Ramp', 'Hold', 'Spikes', 'Sine'])
+        self.assertEqual(shape.duration, 510)
+        self.assertEqual(shape.starts, [0, 60, 90, 210])
+        self.assertEqual(shape.peak_rate(), 3000)
+
+    # --------------------------------------------------------------------------
+    def test_durations_with_units(self):
+        shape = RateShape.parse('sine(50,20,4s,8s) spikes(10,100,1m,5s,2m) hold(5,1h)')
+        sine, spikes, hold = shape.segments
+        self.assertEqual((sine.period, sine.seconds), (4, 8))
+        self.assertEqual((spikes.every, spikes.width, spikes.seconds), (60, 5, 120))
+        self.assertEqual(hold.seconds, 3600)
+
+    # --------------------------------------------------------------------------
+    def test_errors(self):
+        for text in ('wave(1,2)', 'hold(1)', 'hold(1,2,3)', 'hold(-1,10)', 'hold(1,10) junk',
+                     'spikes(1,2,10,10,60)', 'sine(1,2,0,10)', 'hold(1,0)', '', 'hold(1,soon)'):
+            with self.assertRaises(Exception, msg=text) as caught:
+                RateShape.parse(text)
+            self.assertIn(caught.exception.args[0], (ErrorCode.badParameterType, ErrorCode.valueOutOfRange,
+                                                     ErrorCode.emptyParameter), text)
+        with self.assertRaises(TypeError):
+            Segment(1)
+
+    # --------------------------------------------------------------------------
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_file = os.path.join(directory, 'access.log')
+            with open(log_file, 'w') as f:
+                for second, count in enumerate([2, 4, 0, 6]):
+                    for _ in range(count):
+                        f.write('127.0.0.1 - - [10/Oct/2026:13:55:{:02d} +0000] "GET / HTTP/1.1" 200 2\n'.format(
+                            30 + second))
+                f.write('a line without a time\n')
+            self.assertEqual(access_log_rates(log_file), [2, 4, 0, 6])
+            self.assertEqual(access_log_rates(log_file, 2), [3, 3])
+            shape = RateShape.parse('replay({},1s,2,10)'.format(log_file))
+        self.assertEqual(shape.duration, 2)
+        self.assertEqual([shape.rate(t) for t in (0.1, 0.6, 1.1, 1.6)], [20, 40, 0, 60])
+
+    # --------------------------------------------------------------------------
+    def test_log_timestamp(self):
+        self.assertEqual(log_timestamp('[10/Oct/2026:13:55:36 +0000] GET'), 1791640536)
+        self.assertEqual(log_timestamp('1791640536.5 GET /'), 1791640536.5)
+        self.assertEqual(log_timestamp('1791640536500 GET /'), 1791640536.5)
+        self.assertEqual(log_timestamp('2026-10-10T13:55:36.25Z GET /'), 1791640536.25)
+        self.assertIsNone(log_timestamp('GET /'))
+
+
+###############################################################################
+class TestSchedule(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_rate(self):
+        shape = RateShape.parse('ramp(100,200,10) hold(50,5) spikes(10,100,4,1,8)')
+        self.assertEqual(shape.rate(0), 100)
+        self.assertEqual(shape.rate(5), 150)
+        self.assertEqual(shape.rate(12), 50)
+        self.assertEqual(shape.rate(15.5), 10)
+        self.assertEqual(shape.rate(18.5), 100)
+        self.assertEqual(shape.rate(-1), 0)
+        self.assertEqual(shape.rate(23), 0)
+
+    # --------------------------------------------------------------------------
+    def test_requests(self):
+        shape = RateShape.parse('ramp(100,200,10) hold(50,5)')
+        self.assertAlmostEqual(shape.requests(), 1750, places=6)
+        self.assertAlmostEqual(shape.requests(10, 12), 100, places=6)
+        self.assertAlmostEqual(shape.mean_rate(0, 10), 150, places=6)
+        self.assertEqual(shape.requests(5, 5), 0)
+        sine = RateShape.parse('sine(100,50,10,20)')
+        self.assertAlmostEqual(sine.requests(), 2000, delta=1)                  # whole periods: the base
+
+    # --------------------------------------------------------------------------
+    def test_offsets(self):
+        shape = RateShape.parse('ramp(100,200,10) hold(0,2) spikes(10,100,4,1,8)')
+        offsets = list(shape.offsets())
+        self.assertAlmostEqual(len(offsets), shape.requests(), delta=len(offsets) * 0.01)
+        self.assertTrue(all(a < b for a, b in zip(offsets, offsets[1:])))
+        self.assertTrue(0 <= offsets[0] and offsets[-1] < shape.duration)
+        self.assertFalse([t for t in offsets if 10 <= t < 12])                  # nothing at rate 0
+        for start, end in ((0, 1), (9, 10), (15, 16), (19, 20)):
+            sent = len([t for t in offsets if start <= t < end])
+            self.assertAlmostEqual(sent, shape.requests(start, end), delta=2)
+
+
+###############################################################################
+class TestAnalysis(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def series(target: List[float], throughput: List[float], p99: List[float], errors: List[float] = None) -> dict:
+        count = len(target)
+        return {'interval': array('d', range(count)), 'target_rate': array('d', target),
+                'throughput': array('d', throughput), 'p99_ms': array('d', p99),
+                'error%': array('d', errors or [0.0] * count)}
+
+    # --------------------------------------------------------------------------
+    def test_spike_and_recovery(self):
+        target = [100] * 6 + [300] * 2 + [100] * 6
+        throughput = [100] * 6 + [200, 250] + [100] * 6
+        p99 = [10] * 6 + [80, 90, 60, 30, 12] + [10] * 3
+        summary = analyse_shape(self.series(target, throughput, p99), 1.0)
+        self.assertEqual(summary['behind'], 2)
+        self.assertEqual(summary['first_behind_s'], 6)
+        self.assertEqual(summary['behind_from_rate'], 300)
+        self.assertEqual(summary['kept_up_to_rate'], 100)
+        spike, = summary['spikes']
+        self.assertEqual((spike['start'], spike['end'], spike['rate_before'], spike['peak_rate']), (6, 8, 100, 300))
+        self.assertEqual(spike['p99_peak_ms'], 90)
+        self.assertEqual(spike['recovery_s'], 2)                                # p99 within 1.5x at 10, 2s after
+        self.assertTrue(summary['recovered'])
+
+    # --------------------------------------------------------------------------
+    def test_not_recovered(self):
+        target = [100] * 6 + [300] + [100] * 4
+        p99 = [10] * 6 + [80] + [50] * 4
+        summary = analyse_shape(self.series(target, target, p99, [0.0] * 6 + [20.0] * 5), 1.0)
+        self.assertIsNone(summary['spikes'][0]['recovery_s'])
+        self.assertEqual(summary['spikes'][0]['error%_peak'], 20.0)
+        self.assertFalse(summary['recovered'])
+
+    # --------------------------------------------------------------------------
+    def test_spike_at_the_end(self):
+        target = [100] * 6 + [300]
+        summary = analyse_shape(self.series(target, target, [10] * 6 + [80]), 2.0)
+        spike, = summary['spikes']
+        self.assertFalse(spike['watched'])
+        self.assertEqual(spike['start'], 12)
+        self.assertTrue(summary['recovered'])
+
+
+###############################################################################
+class TestShapedStats(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_intervals(self):
+        shape = RateShape.parse('hold(10,3)')
+        with tempfile.TemporaryDirectory() as directory:
+            stats = ShapedStats(shape, 1.0, os.path.join(directory, 'series.csv'))
+            stats.begin(1000.0)
+            for i in range(30):
+                due = 1000.0 + i / 10
+                stats.record(200 if i < 20 else 500, 5000000, started=due + 0.5, due=due)
+            stats.finish()
+            with open(stats.series_file) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines[0], ','.join(ShapedStats.columns))
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(list(stats.series['rate']), [10, 10, 10])              # by due time, not by send time
+        self.assertEqual(list(stats.series['error%']), [0, 0, 100])
+        self.assertEqual(stats.requests, 30)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+"""
+The results store: steps and checkpoints in a temporary SQLite file, and a simulated run that
+fails halfway and is resumed from its checkpoint.
+"""
+
+import io
+import signal
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+import loadtest_vegeta
+from results_store import ResultsStore
+from search_strategy import SearchStrategy, search_strategies
+from latency_histogram import LatencyHistogram
+from simulated_service import SimulatedService
+from utils import *
+
+
+###############################################################################
+class TestResultsStore(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ResultsStore(os.path.join(directory.name, 'results.db'))
+        self.addCleanup(self.store.close)
+
+    # --------------------------------------------------------------------------
+    def test_steps(self):
+        run_id = self.store.start_run('targets.txt', 'adaptive', {'failure_threshold': 5.0, 'objectives': ''})
+        service = SimulatedService(1000)
+        entries = [service.attack(rate, 10) for rate in (500, 1000, 1500)]
+        histogram = LatencyHistogram()
+        histogram.record(entries[1]['latencies']['mean'], entries[1]['requests'])
+        entries[1]['histogram'] = histogram.to_text()
+        for step_no, (rate, entry) in enumerate(zip((500, 1000, 1500), entries), 1):
+            self.store.add_step(run_id, step_no, rate, entry, {'next_rate': rate + 500, 'fail_count': step_no})
+
+        self.assertEqual(self.store.run_settings(run_id), {'failure_threshold': '5.0', 'objectives': ''})
+        steps = self.store.run_steps(run_id)
+        self.assertEqual([step[:3] for step in steps], [(1, 500, entries[0]['requests']),
+                                                        (2, 1000, entries[1]['requests']),
+                                                        (3, 1500, entries[2]['requests'])])
+        step_no, saved, state = self.store.checkpoint(run_id)
+        self.assertEqual((step_no, state), (3, {'next_rate': 2000, 'fail_count': 3}))
+        self.assertIsNone(self.store.checkpoint(run_id + 1))
+
+        histograms = list(self.store.step_histograms(run_id, 1000))
+        self.assertEqual(len(histograms), 1)
+        self.assertEqual(histograms[0].total_count, entries[1]['requests'])
+        self.assertEqual(list(self.store.step_histograms(run_id, 500)), [])
+
+        self.store.finish_run(run_id, 'interrupted', 1000)
+        self.assertEqual(self.store.run_info(run_id)[5:], ('interrupted', 3, 1000))
+        resumed = self.store.resume_run(run_id)
+        self.assertEqual([rate for rate, _ in resumed], [500, 1000, 1500])
+        self.assertNotIn('histogram', resumed[1][1])                            # kept as a blob instead
+        self.assertEqual(resumed[2][1]['success'], entries[2]['success'])
+        self.assertEqual(self.store.run_info(run_id)[5], 'running')
+
+    # --------------------------------------------------------------------------
+    def test_strategy_state(self):
+        run_id = self.store.start_run('targets.txt', 'bisection', {})
+        strategy = search_strategies['bisection'](5.0, 50, 50)
+        service = SimulatedService(1000)
+        rate, fail_count = 50, 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for step_no in range(1, 8):
+                entry = service.attack(rate, 10)
+                failure_rate = 100 - entry['success'] * 100
+                strategy.record_step(rate, failure_rate, entry, 10)
+                _, new_rate, fail_count = strategy.adjust(rate, failure_rate, fail_count, entry)
+                self.store.add_step(run_id, step_no, rate, entry,
+                                    {'next_rate': new_rate, 'fail_count': fail_count, 'search': strategy.state()})
+                rate = new_rate
+
+        _, _, state = self.store.checkpoint(run_id)
+        restored = search_strategies['bisection'](5.0, 50, 50)
+        restored.restore(state['search'])
+        self.assertEqual(restored.state(), strategy.state())
+        self.assertEqual(state['next_rate'], rate)
+
+        # both go on to the same next step
+        entry = service.attack(rate, 10)
+        failure_rate = 100 - entry['success'] * 100
+        with contextlib.redirect_stdout(io.StringIO()):
+            for search in (strategy, restored):
+                search.record_step(rate, failure_rate, entry, 10)
+            self.assertEqual(restored.adjust(rate, failure_rate, fail_count, entry),
+                             strategy.adjust(rate, failure_rate, fail_count, entry))
+
+
+###############################################################################
+class TestResume(unittest.TestCase):
+    capacity = 300
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.target_file = os.path.join(self.directory, 'targets.txt')
+        with open(self.target_file, 'w') as f:
+            f.write('GET http://localhost:5555/test/version\n')
+        self.store_file = os.path.join(self.directory, 'results.db')
+        self.addCleanup(signal.signal, signal.SIGINT, signal.getsignal(signal.SIGINT))
+        # the summary files go next to the scripts; here to the temporary directory
+        patcher = mock.patch.object(TestUtils, 'get_absolute_path', return_value=self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # --------------------------------------------------------------------------
+    def run_main(self, *args) -> loadtest_vegeta.VegetaLoadTest:
+        with contextlib.redirect_stdout(io.StringIO()):
+            loadtest_vegeta.main(['loadtest_vegeta.py'] + list(args))
+        return loadtest_vegeta.test_run
+
+    # --------------------------------------------------------------------------
+    def interrupted_run(self, steps: int, *args) -> int:
+        """
+        Start a simulated run whose step after the given number of steps fails
+        :return: the run id
+        """
+        run_load_step = loadtest_vegeta.SimulatedLoadTest.run_load_step
+        calls = []
+
+        def failing_step(test, attack_rate, attack_time):
+            calls.append(attack_rate)
+            if len(calls) > steps:
+                return ErrorCode.processAbnormalExit, None
+            return run_load_step(test, attack_rate, attack_time)
+
+        with mock.patch.object(loadtest_vegeta.SimulatedLoadTest, 'run_load_step', failing_step):
+            test_run = self.run_main('-f', self.target_file, '--simulate', str(self.capacity), '--search', 'bisection',
+                                     '--store', self.store_file, *args)
+        self.assertEqual(len(test_run.result_set), steps)
+        return test_run.run_id
+
+    # --------------------------------------------------------------------------
+    def test_resume(self):
+        whole = self.run_main('-f', self.target_file, '--simulate', str(self.capacity), '--search', 'bisection',
+                              '--store', self.store_file)
+        run_id = self.interrupted_run(4)
+        store = ResultsStore(self.store_file)
+        try:
+            self.assertEqual(store.run_info(run_id)[5:7], ('failed', 4))
+            _, _, state = store.checkpoint(run_id)
+        finally:
+            store.close()
+        self.assertFalse(state['done'])
+
+        restore = SearchStrategy.restore
+        restored = []
+
+        def restore_spy(strategy, search_state):
+            restore(strategy, search_state)
+            restored.append(strategy.state())
+
+        with mock.patch.object(SearchStrategy, 'restore', restore_spy):
+            resumed = self.run_main('--resume', str(run_id), '--store', self.store_file)
+        self.assertEqual(restored, [state['search']])
+        self.assertEqual(resumed.run_id, run_id)
+        self.assertEqual(resumed.attack_rates, whole.attack_rates)             # the same search, picked up
+        self.assertEqual(resumed.search_strategy.best_rate, whole.search_strategy.best_rate)
+        store = ResultsStore(self.store_file)
+        try:
+            self.assertEqual(store.run_info(run_id)[5:], ('finished', len(whole.attack_rates),
+                                                          whole.search_strategy.best_rate))
+            self.assertEqual([step[1] for step in store.run_steps(run_id)], whole.attack_rates)
+        finally:
+            store.close()
+
+    # --------------------------------------------------------------------------
+    def test_slo_replaces_objectives(self):
+        run_id = self.interrupted_run(2, '--slo', 'p99<10s', '--slo', 'p99.9<20s')
+        kept = self.run_main('--resume', str(run_id), '--store', self.store_file)
+        self.assertEqual([objective.text for objective in kept.objectives], ['p99<10s', 'p99.9<20s'])
+
+        run_id = self.interrupted_run(2, '--slo', 'p99<10s', '--slo', 'p99.9<20s')
+        replaced = self.run_main('--resume', str(run_id), '--store', self.store_file, '--slo', 'p99<30s')
+        self.assertEqual([objective.text for objective in replaced.objectives], ['p99<30s'])
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+The search strategies against SimulatedService, offline: each finds the knee of a service of
+known capacity, in a bounded number of steps.
+"""
+
+import io
+import unittest
+import contextlib
+from search_strategy import SearchStrategy, search_strategies
+from simulated_service import SimulatedService
+from utils import *
+
+
+###############################################################################
+def run_search(name: str, capacity: int, start_rate: int = 50, step_rate: int = 50,
+               failure_threshold: float = 5.0, max_steps: int = 500) -> Tuple[SearchStrategy, int]:
+    """
+    Drive a strategy the way the load test does, with the simulated service's reports
+    :return: the strategy, and the return code it stopped with
+    """
+    strategy = search_strategies[name](failure_threshold, start_rate, step_rate)
+    service = SimulatedService(capacity)
+    rate, fail_count, ret = start_rate, 0, ErrorCode.ok
+    with contextlib.redirect_stdout(io.StringIO()):
+        while strategy.steps < max_steps:
+            entry = service.attack(rate, 10)
+            failure_rate = 100 - entry['success'] * 100
+            strategy.record_step(rate, failure_rate, entry, 10)
+            ret, new_rate, fail_count = strategy.adjust(rate, failure_rate, fail_count, entry)
+            if ret != ErrorCode.ok:
+                break
+            rate = new_rate
+    return strategy, ret
+
+
+###############################################################################
+class TestConvergence(unittest.TestCase):
+    capacities = [300, 1000, 2345, 4000]
+
+    # --------------------------------------------------------------------------
+    def assert_knee(self, strategy: SearchStrategy, capacity: int):
+        # above the capacity the excess fails; the 5% threshold with its 20% tolerance passes up to ~6.4% more
+        self.assertIsNotNone(strategy.best_rate)
+        self.assertGreaterEqual(strategy.best_rate, capacity * 1.04)
+        self.assertLessEqual(strategy.best_rate, capacity * 1.07)
+
+    # --------------------------------------------------------------------------
+    def test_adaptive(self):
+        for capacity in self.capacities:
+            strategy, ret = run_search('adaptive', capacity)
+            self.assertEqual(ret, ErrorCode.requestRateTooHigh)
+            self.assert_knee(strategy, capacity)
+            self.assertLessEqual(strategy.steps, capacity // 50 + 15)                # the ramp, then smaller moves
+
+    # --------------------------------------------------------------------------
+    def test_bisection(self):
+        for capacity in self.capacities:
+            strategy, ret = run_search('bisection', capacity)
+            self.assertEqual(ret, ErrorCode.searchConverged)
+            self.assert_knee(strategy, capacity)
+            self.assertLessEqual(strategy.steps, 12)                            # log2(5000 / 5) and a bit
+
+    # --------------------------------------------------------------------------
+    def test_exponential(self):
+        for capacity in self.capacities:
+            strategy, ret = run_search('exponential', capacity)
+            self.assertEqual(ret, ErrorCode.searchConverged)
+            self.assert_knee(strategy, capacity)
+            self.assertLessEqual(strategy.steps, 18)
+
+    # --------------------------------------------------------------------------
+    def test_model(self):
+        for capacity in self.capacities:
+            strategy, ret = run_search('model', capacity)
+            self.assertEqual(ret, ErrorCode.searchConverged)
+            self.assert_knee(strategy, capacity)
+            self.assertLessEqual(strategy.steps, run_search('bisection', capacity)[0].steps + 3)
+
+    # --------------------------------------------------------------------------
+    def test_deterministic(self):
+        for name in search_strategies:
+            first, second = run_search(name, 1234)[0], run_search(name, 1234)[0]
+            self.assertEqual((first.best_rate, first.steps), (second.best_rate, second.steps))
+
+
+###############################################################################
+class TestStrategy(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            SearchStrategy(5.0, 50, 50)
+
+    # --------------------------------------------------------------------------
+    def test_is_pass(self):
+        strategy = search_strategies['bisection'](5.0, 50, 50)
+        self.assertTrue(strategy.is_pass(5.9))
+        self.assertFalse(strategy.is_pass(6.1))
+        strict = search_strategies['bisection'](0.0, 50, 50)
+        self.assertTrue(strict.is_pass(0.0))
+        self.assertFalse(strict.is_pass(0.01))
+
+    # --------------------------------------------------------------------------
+    def test_resume(self):
+        # a search restored from the state of its fifth step ends where the uninterrupted one does
+        for name in search_strategies:
+            complete = run_search(name, 1500)[0]
+            strategy = search_strategies[name](5.0, 50, 50)
+            service = SimulatedService(1500)
+            rate, fail_count = 50, 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(5):
+                    entry = service.attack(rate, 10)
+                    failure_rate = 100 - entry['success'] * 100
+                    strategy.record_step(rate, failure_rate, entry, 10)
+                    _, rate, fail_count = strategy.adjust(rate, failure_rate, fail_count, entry)
+                resumed = search_strategies[name](5.0, 50, 50)
+                resumed.restore(strategy.state())
+                ret = ErrorCode.ok
+                while ret == ErrorCode.ok:
+                    entry = service.attack(rate, 10)
+                    failure_rate = 100 - entry['success'] * 100
+                    resumed.record_step(rate, failure_rate, entry, 10)
+                    ret, rate, fail_count = resumed.adjust(rate, failure_rate, fail_count, entry)
+            self.assertEqual((resumed.best_rate, resumed.steps), (complete.best_rate, complete.steps), name)
+
+    # --------------------------------------------------------------------------
+    def test_generator_saturated(self):
+        strategy = search_strategies['bisection'](5.0, 50, 50)
+        strategy.record_step(1000, 0.0, {}, 10)
+        strategy.adjust(1000, 0.0, 0, {})
+        with contextlib.redirect_stdout(io.StringIO()):
+            ret, new_rate = strategy.generator_saturated(3000, 10)
+        self.assertEqual(ret, ErrorCode.ok)
+        self.assertEqual(strategy.max_rate, 2999)
+        self.assertEqual(strategy.generator_limit, 3000)
+        self.assertTrue(1000 < new_rate < 3000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ret, new_rate = strategy.generator_saturated(1003, 10)
+        self.assertEqual(ret, ErrorCode.searchConverged)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
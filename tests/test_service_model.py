@@ -0,0 +1,87 @@
+"""
+The simulated service of testserver.py, offline: its ServiceModel is driven with arrival times
+directly, and checked against queueing theory.
+"""
+
+import random
+import statistics
+import unittest
+from testserver import ServiceModel
+from utils import *
+
+
+###############################################################################
+def drive(model: ServiceModel, rate: float, seconds: float, seed: int = 1) -> List[Tuple[float, int, float]]:
+    """
+    Poisson arrivals at rate for seconds
+    :return: arrival time, status code and latency of every request
+    """
+    arrivals = random.Random(seed)
+    results = []
+    now = arrivals.expovariate(rate)
+    while now < seconds:
+        code, ready = model.schedule(now)
+        results.append((now, code, ready - now))
+        now += arrivals.expovariate(rate)
+    return results
+
+
+###############################################################################
+class TestServiceModel(unittest.TestCase):
+    capacity = 1000
+
+    # --------------------------------------------------------------------------
+    def test_queueing(self):
+        # M/M/1: the mean time in the system is 1 / (capacity - rate)
+        for utilisation in [0.5, 0.8]:
+            results = drive(ServiceModel(self.capacity, max_queue=10), self.capacity * utilisation, 20)
+            self.assertTrue(all(code == 200 for _, code, _ in results))
+            expected = 1.0 / (self.capacity * (1 - utilisation))
+            self.assertAlmostEqual(statistics.mean(latency for _, _, latency in results), expected,
+                                   delta=expected * 0.1)
+
+    # --------------------------------------------------------------------------
+    def test_shedding(self):
+        model = ServiceModel(self.capacity, max_queue=0.1)
+        results = drive(model, 2 * self.capacity, 10)
+        shed = sum(code == 503 for _, code, _ in results) / len(results)
+        self.assertAlmostEqual(shed, 0.5, delta=0.03)                           # the excess over the capacity
+        self.assertEqual(model.shed, sum(code == 503 for _, code, _ in results))
+        self.assertLess(max(latency for _, _, latency in results), 0.1 + 0.05)  # nothing waits beyond max_queue
+
+    # --------------------------------------------------------------------------
+    def test_knee(self):
+        results = drive(ServiceModel(self.capacity, max_queue=10, knee=0.8), 900, 10)[2000:]
+        failed = sum(code == 500 for _, code, _ in results) / len(results)
+        self.assertAlmostEqual(failed, (900 - 800) / 900, delta=0.02)           # the arrivals above the knee
+        below = drive(ServiceModel(self.capacity, max_queue=10, knee=0.8), 600, 10)[2000:]
+        self.assertFalse(any(code == 500 for _, code, _ in below))
+
+    # --------------------------------------------------------------------------
+    def test_gc_pauses(self):
+        model = ServiceModel(self.capacity, max_queue=10, gc_interval=1.0, gc_pause=0.2)
+        results = drive(model, 300, 10)
+        self.assertIn(model.pauses, range(9, 12))                               # every 1s +-10%
+        self.assertGreaterEqual(max(latency for _, _, latency in results), 0.2)
+        quiet = drive(ServiceModel(self.capacity, max_queue=10), 300, 10)
+        self.assertLess(max(latency for _, _, latency in quiet), 0.1)
+
+    # --------------------------------------------------------------------------
+    def test_cold_start(self):
+        results = drive(ServiceModel(self.capacity, max_queue=10, cold_factor=5, warm_up_requests=1000), 100, 100)
+        cold = statistics.mean(latency for _, _, latency in results[:200])
+        warm = statistics.mean(latency for _, _, latency in results[-2000:])
+        self.assertGreater(cold, 4 * warm)
+        self.assertAlmostEqual(warm, 1.0 / (self.capacity - 100), delta=0.0003)
+
+    # --------------------------------------------------------------------------
+    def test_deterministic(self):
+        def run(seed):
+            return drive(ServiceModel(self.capacity, knee=0.8, gc_interval=1.0, gc_pause=0.1, seed=seed), 1200, 5)
+        self.assertEqual(run(7), run(7))
+        self.assertNotEqual(run(7), run(8))
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
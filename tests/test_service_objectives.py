@@ -0,0 +1,108 @@
+"""
+Service level objectives: parsing, measuring a step against them, and the failure rate a step
+that missed one counts with in the search.
+"""
+
+import math
+import unittest
+from service_objectives import Objective, missed_objectives, parse_objective
+from search_strategy import search_strategies
+from utils import *
+
+
+###############################################################################
+def entry(success: float = 1.0, **latencies) -> dict:
+    """
+    :param latencies: in milliseconds, by the keys of the vegeta report, e.g. p99=120 for 99th
+    """
+    keys = {'p50': '50th', 'p99': '99th', 'p999': '99.9th', 'mean': 'mean', 'max': 'max'}
+    return {'success': success, 'latencies': {keys[name]: value * 1000000 for name, value in latencies.items()}}
+
+
+###############################################################################
+class TestParseObjective(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_objectives(self):
+        for text, metric, limit in (('p99<250ms', '99th', 250000000),
+                                    (' P99.9 < 1s ', '99.9th', 1000000000),
+                                    ('p99.99<1.5s', '99.99th', 1500000000),
+                                    ('mean<800us', 'mean', 800000),
+                                    ('max<2m', 'max', 120000000000),
+                                    ('failure<1%', 'failure', 1.0),
+                                    ('failure<0.5 %', 'failure', 0.5)):
+            objective = parse_objective(text)
+            self.assertEqual((objective.metric, objective.limit, objective.text), (metric, limit, text.strip()))
+
+    # --------------------------------------------------------------------------
+    def test_errors(self):
+        for text in ('p99>250ms', 'p42<1s', 'failure<1', 'p99<', 'p99<fast', 'latency', ''):
+            with self.assertRaises(Exception, msg=text) as caught:
+                parse_objective(text)
+            self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType, text)
+
+
+###############################################################################
+class TestObjective(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_measure(self):
+        p99 = parse_objective('p99<250ms')
+        self.assertTrue(p99.is_met(entry(p99=249)))
+        self.assertFalse(p99.is_met(entry(p99=250)))
+        self.assertAlmostEqual(p99.severity(entry(p99=500)), 2.0)
+        self.assertEqual(p99.describe(entry(p99=312)), 'p99 = 312.000ms (p99<250ms)')
+
+        failure = parse_objective('failure<2%')
+        self.assertAlmostEqual(failure.measure(entry(0.97)), 3.0)
+        self.assertAlmostEqual(failure.severity(entry(0.97)), 1.5)
+        self.assertEqual(failure.describe(entry(0.97)), 'failure = 3.000% (failure<2%)')
+
+        with self.assertRaises(Exception) as caught:
+            parse_objective('p99.9<1s').measure(entry(p99=100))                 # cannot pass unchecked
+        self.assertEqual(caught.exception.args[0], ErrorCode.badVegetaReport)
+
+    # --------------------------------------------------------------------------
+    def test_zero_limit(self):
+        none_fail = Objective('failure', 0.0, 'failure<0%')
+        self.assertTrue(none_fail.is_met(entry(1.0)))
+        self.assertEqual(none_fail.severity(entry(1.0)), 1.0)
+        self.assertFalse(none_fail.is_met(entry(0.999)))
+        self.assertEqual(none_fail.severity(entry(0.999)), math.inf)
+
+    # --------------------------------------------------------------------------
+    def test_missed_objectives(self):
+        objectives = [parse_objective(text) for text in ('failure<1%', 'p50<10ms', 'p99<100ms', 'p99.9<1s')]
+        missed = missed_objectives(objectives, entry(0.995, p50=30, p99=400, p999=900))
+        self.assertEqual([(objective.text, severity) for objective, severity in missed],
+                         [('p99<100ms', 4.0), ('p50<10ms', 3.0)])              # the worst first
+        self.assertEqual(missed_objectives(objectives, entry(1.0, p50=1, p99=2, p999=3)), [])
+
+
+###############################################################################
+class TestMissedFailureRate(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_mapping(self):
+        strategy = search_strategies['adaptive'](5.0, 50, 50)
+        self.assertEqual(strategy.pass_limit(), 6.0)
+        self.assertAlmostEqual(strategy.missed_failure_rate(0.0, 1.5), 9.0)    # severity times the pass limit
+        self.assertAlmostEqual(strategy.missed_failure_rate(0.0, 3.0), 18.0)
+        self.assertAlmostEqual(strategy.missed_failure_rate(0.0, 1000), 60.0)  # at most 10 times
+        self.assertAlmostEqual(strategy.missed_failure_rate(0.0, math.inf), 60.0)
+        self.assertAlmostEqual(strategy.missed_failure_rate(75.0, 1.5), 75.0)  # never below the real one
+
+    # --------------------------------------------------------------------------
+    def test_always_fails(self):
+        for name, strategy_class in search_strategies.items():
+            for threshold in (0.0, 0.5, 5.0, 50.0):
+                strategy = strategy_class(threshold, 50, 50)
+                for severity in (1.0001, 1.2, 2.0, 10.0, math.inf):
+                    failure_rate = strategy.missed_failure_rate(0.0, severity)
+                    self.assertFalse(strategy.is_pass(failure_rate), (name, threshold, severity))
+                self.assertLess(strategy.missed_failure_rate(0.0, 1.2), strategy.missed_failure_rate(0.0, 2.0))
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Soak tests: the duration parser, the drift detection over made-up windows, and the time series
+of the recorder.
+"""
+
+import os
+import csv
+import time
+import tempfile
+import unittest
+from soak_test import DriftDetector, OnlineTrend, SoakRecorder, parse_soak_time
+from vegeta_stream import StreamStats
+from utils import *
+
+
+###############################################################################
+def window(time: float, p99_ms: float = 10.0, error: float = 0.0, throughput: float = 100.0,
+           max_ms: float = None, requests: int = 1000) -> dict:
+    return {'time': time, 'requests': requests, 'p99_ms': p99_ms, 'error%': error, 'throughput': throughput,
+            'max_ms': p99_ms * 2 if max_ms is None else max_ms}
+
+
+###############################################################################
+class TestParseSoakTime(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_durations(self):
+        self.assertEqual(parse_soak_time('3600'), 3600)
+        self.assertEqual(parse_soak_time('90m'), 5400)
+        self.assertEqual(parse_soak_time(' 12H '), 43200)
+        self.assertEqual(parse_soak_time('2d12h'), 216000)
+        self.assertEqual(parse_soak_time('1.5h'), 5400)
+        self.assertEqual(parse_soak_time('1h30m15s'), 5415)
+
+    # --------------------------------------------------------------------------
+    def test_errors(self):
+        for text in ('12x', '12h5', 'h', 'soon', '-5m'):
+            with self.assertRaises(Exception, msg=text) as caught:
+                parse_soak_time(text)
+            self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType, text)
+
+
+###############################################################################
+class TestDriftDetector(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_baseline(self):
+        detector = DriftDetector(baseline_windows=5)
+        self.assertEqual(detector.add(window(0, requests=0)), [])              # no requests, no window
+        for index, p99 in enumerate([9, 12, 10, 11, 30]):
+            messages = detector.add(window(index * 10, p99, throughput=100 + index))
+            self.assertEqual(len(messages), 1 if index == 4 else 0)
+        self.assertIn('baseline of the first 5 windows', messages[0])
+        self.assertEqual(detector.baseline, {'p99_ms': 11, 'error%': 0.0, 'throughput': 102})
+        self.assertEqual(detector.summary()['regressions'], [])
+
+    # --------------------------------------------------------------------------
+    def test_regression_and_recovery(self):
+        detector = DriftDetector(baseline_windows=5)
+        clock = iter(range(0, 10000, 10))
+        for _ in range(5):
+            detector.add(window(next(clock)))
+        messages = [detector.add(window(next(clock))) for _ in range(5)]
+        self.assertEqual(messages, [[]] * 5)                                    # steady
+        messages = [detector.add(window(next(clock), p99_ms=20, error=3.0)) for _ in range(3)]
+        self.assertEqual(messages[:2], [[], []])                                # not yet the median
+        self.assertEqual([message.split(':')[0] for message in messages[2]], ['regression', 'regression'])
+        self.assertEqual(detector.summary()['regressions'], ['error%', 'p99_ms'])
+        messages = [detector.add(window(next(clock), throughput=80)) for _ in range(3)]
+        self.assertEqual(messages[:2], [[], []])
+        self.assertEqual([message.split(':')[0] for message in messages[2]], ['recovered', 'recovered', 'regression'])
+        self.assertIn('throughput 80.0/s against 100.0/s', messages[2][2])
+        summary = detector.summary()
+        self.assertEqual(summary['regressions'], ['throughput'])
+        self.assertEqual([event['kind'] for event in summary['events']],
+                         ['regression', 'regression', 'recovered', 'recovered', 'regression'])
+        self.assertEqual(summary['event_count'], 5)
+
+    # --------------------------------------------------------------------------
+    def test_pause(self):
+        detector = DriftDetector(baseline_windows=3)
+        for index in range(3):
+            detector.add(window(index * 10))
+        self.assertEqual(detector.add(window(30, max_ms=99)), [])               # below 10x the p99
+        messages = detector.add(window(40, max_ms=500))
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].startswith('pause: max latency 500.000ms, 50x the baseline p99'))
+        self.assertEqual(detector.summary()['pauses'], 1)
+        self.assertEqual(detector.summary()['regressions'], [])                 # one window moves no median
+
+    # --------------------------------------------------------------------------
+    def test_trend(self):
+        creeping, flat = DriftDetector(baseline_windows=5), DriftDetector(baseline_windows=5)
+        for index in range(101):                                                # 10 hours, every 6 minutes
+            creeping.add(window(index * 360, p99_ms=10 + index * 0.1, error=index * 0.02))
+            flat.add(window(index * 360, p99_ms=10 + (index % 2) * 0.1))
+        summary = creeping.summary()
+        self.assertAlmostEqual(summary['hours'], 10.0)
+        self.assertAlmostEqual(summary['drift']['p99_ms']['per_hour'], 1.0)
+        self.assertAlmostEqual(summary['drift']['p99_ms']['relative'], 10 / 10.2)
+        self.assertAlmostEqual(summary['drift']['throughput']['per_hour'], 0.0)
+        self.assertEqual(summary['drifting'], ['p99_ms', 'error%'])             # error% from a baseline of 0.04%
+        self.assertEqual(flat.summary()['drifting'], [])
+
+    # --------------------------------------------------------------------------
+    def test_online_trend(self):
+        trend = OnlineTrend()
+        self.assertEqual(trend.slope(), 0.0)
+        trend.add(1.0, 5.0)
+        trend.add(1.0, 7.0)
+        self.assertEqual(trend.slope(), 0.0)                                    # no two distinct x
+        trend.add(3.0, 2.0)
+        self.assertAlmostEqual(trend.slope(), -2.0)
+
+
+###############################################################################
+class TestSoakRecorder(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_series(self):
+        with tempfile.TemporaryDirectory() as directory:
+            series_file = os.path.join(directory, 'soak.csv')
+            stats = None
+            recorder = SoakRecorder(series_file, interval=60, detector=DriftDetector(baseline_windows=2))
+            recorder.watch(lambda: stats)
+            recorder.record()                                                   # no step yet
+            self.assertEqual(recorder.windows, 0)
+
+            stats = StreamStats()
+            for index in range(100):
+                stats.record(500 if index % 10 == 0 else 200, 1000000)
+            time.sleep(0.01)
+            recorder.record()
+            for _ in range(50):
+                stats.record(200, 5000000)
+            time.sleep(0.01)
+            recorder.record()
+            recorder.stop()
+            recorder.stop()                                                     # only once
+
+            with open(series_file) as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(recorder.windows, 3)
+        self.assertEqual(list(rows[0]), SoakRecorder.columns)
+        self.assertEqual([int(row['requests']) for row in rows], [100, 50, 0])  # the last, partial window
+        self.assertEqual(float(rows[0]['error%']), 10.0)
+        self.assertEqual(float(rows[1]['error%']), 0.0)
+        self.assertAlmostEqual(float(rows[0]['p50_ms']), 1.0, delta=0.01)
+        self.assertAlmostEqual(float(rows[1]['p99_ms']), 5.0, delta=0.05)
+        self.assertGreaterEqual(float(rows[1]['seconds']), 0.01)
+        self.assertAlmostEqual(float(rows[1]['rate']) * float(rows[1]['seconds']), 50, delta=3)
+        self.assertEqual(recorder.detector.baseline['error%'], 5.0)             # median of the two windows
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
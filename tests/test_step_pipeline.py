@@ -0,0 +1,107 @@
+"""
+The pieces that overlap two steps: the ordered background writes of ResultWriter, and the
+attack command that GatedCommand spawns ahead of time and holds until it is released.
+"""
+
+import time
+import tempfile
+import threading
+import unittest
+from step_pipeline import GatedCommand, ResultWriter
+from utils import *
+
+
+###############################################################################
+class TestResultWriter(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        self.writer = ResultWriter()
+        self.addCleanup(self.writer.executor.shutdown)
+        self.written = []
+
+    # --------------------------------------------------------------------------
+    def write(self, step: int, seconds: float = 0.0):
+        time.sleep(seconds)
+        self.written.append((step, threading.current_thread().name))
+
+    # --------------------------------------------------------------------------
+    def test_order(self):
+        for step in range(1, 6):
+            self.writer.submit(self.write, step, 0.05 if step == 1 else 0.0)   # a slow first write holds the rest
+        self.assertEqual(self.written, [])                                      # the caller does not wait
+        self.assertEqual(self.writer.call(lambda: [step for step, _ in self.written]), [1, 2, 3, 4, 5])
+        threads = {thread for _, thread in self.written}
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads.pop(), threading.current_thread().name)
+
+    # --------------------------------------------------------------------------
+    def test_failure(self):
+        def fail():
+            raise Exception(ErrorCode.executeShellCommand, 'the store is gone')
+
+        self.writer.submit(self.write, 1)
+        self.writer.submit(fail)
+        self.writer.submit(self.write, 2)
+        with self.assertRaises(Exception) as caught:
+            self.writer.drain()
+        self.assertEqual(caught.exception.args, (ErrorCode.executeShellCommand, 'the store is gone'))
+        self.writer.drain()                                                     # raised once only
+        self.assertEqual(self.writer.call(lambda: [step for step, _ in self.written]), [1, 2])  # the later ones ran
+
+    # --------------------------------------------------------------------------
+    def test_close(self):
+        writer = ResultWriter()
+        writer.submit(self.write, 1, 0.05)
+        writer.close()
+        self.assertEqual([step for step, _ in self.written], [1])
+        with self.assertRaises(RuntimeError):
+            writer.submit(self.write, 2)
+
+
+###############################################################################
+class TestGatedCommand(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.input_file = os.path.join(self.directory, 'targets.txt')
+        with open(self.input_file, 'w') as f:
+            f.write('GET http://localhost:5555/test/version\n' * 1000)
+
+    # --------------------------------------------------------------------------
+    def test_release(self):
+        output_file = os.path.join(self.directory, 'output.txt')
+        command = GatedCommand('cat > {} && echo done >> {}'.format(output_file, output_file))
+        self.addCleanup(command.cleanup)
+        time.sleep(0.2)
+        self.assertIsNone(command.proc.poll())                                  # spawned, and held on its stdin
+        self.assertEqual(os.path.getsize(output_file), 0)
+        self.assertEqual(command.release(self.input_file).wait(), ErrorCode.ok)
+        with open(output_file) as f, open(self.input_file) as g:
+            self.assertEqual(f.read(), g.read() + 'done\n')
+
+    # --------------------------------------------------------------------------
+    def test_failed_command(self):
+        command = GatedCommand('exit 3', stdout=subprocess.DEVNULL)
+        self.addCleanup(command.cleanup)
+        command.proc.wait()
+        self.assertEqual(command.release(self.input_file).wait(), ErrorCode.executeShellCommand)
+
+    # --------------------------------------------------------------------------
+    def test_cleanup(self):
+        temp_dir = tempfile.mkdtemp(dir=self.directory)
+        command = GatedCommand('cat | sleep 30', temp_dir)                      # a pipeline, never released
+        started = time.monotonic()
+        command.cleanup()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIsNotNone(command.proc.poll())
+        self.assertFalse(os.path.exists(temp_dir))
+        command.cleanup()                                                       # again, nothing left to do
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Typed step results: the checks on vegeta's json report, the views of a step, and the columnar
+export of many steps and its round trip.
+"""
+
+import json
+import tempfile
+import unittest
+from array import array
+from step_result import StepColumns, StepResult, parse_report, read_npy, validate_report, write_npy
+from utils import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+###############################################################################
+def report(rate: float = 100.0, success: float = 0.99, status_codes: dict = None, **fields) -> dict:
+    entry = {'latencies': {'total': 5000000000, 'mean': 5000000, '50th': 4000000, '90th': 8000000,
+                           '95th': 9000000, '99th': 12000000, '99.9th': 20000000, 'max': 30000000,
+                           'min': 1000000},
+             'bytes_in': {'total': 10000, 'mean': 10.0}, 'bytes_out': {'total': 0, 'mean': 0.0},
+             'duration': 10000000000, 'wait': 5000000, 'requests': 1000, 'rate': rate,
+             'throughput': rate * success, 'success': success,
+             'status_codes': status_codes if status_codes is not None else {'200': 990, '503': 10},
+             'errors': ['503 Service Unavailable']}
+    entry.update(fields)
+    return entry
+
+
+###############################################################################
+class TestReport(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_validate(self):
+        entry = report()
+        self.assertIs(validate_report(entry), entry)
+        self.assertEqual(parse_report(json.dumps(entry).encode()), entry)
+        self.assertEqual(validate_report(report(errors=None))['requests'], 1000)
+
+        broken = [[], report(requests='1000'), report(rate=True), report(status_codes=[]), report(errors='x'),
+                  dict(report(), latencies={'mean': 1}), {key: value for key, value in report().items()
+                                                          if key != 'status_codes'}]
+        for entry in broken:
+            with self.assertRaises(Exception, msg=entry) as caught:
+                validate_report(entry)
+            self.assertEqual(caught.exception.args[0], ErrorCode.badVegetaReport)
+        with self.assertRaises(Exception) as caught:
+            parse_report('{"latencies": ')                                      # a truncated report
+        self.assertEqual(caught.exception.args[0], ErrorCode.badVegetaReport)
+
+    # --------------------------------------------------------------------------
+    def test_step_result(self):
+        result = StepResult.from_report(report(error_counts={'503 Service Unavailable': 10},
+                                               bound_by={'objective': 'p99<10ms'}), step=3)
+        self.assertEqual((result.step, result.attack_rate, result.requests), (3, 100, 1000))
+        self.assertEqual((result.latency_50th, result.latency_999th, result.latency_9999th), (4000000, 20000000, 0))
+        self.assertEqual(result.status_codes, {200: 990, 503: 10})
+        self.assertAlmostEqual(result.failure_pct, 1.0)
+        self.assertEqual(result.bound_by, 'p99<10ms')
+        self.assertEqual(result.status_classes(), {'2xx': 990, '5xx': 10})
+        self.assertEqual(result.breakdown(), '200:990 503:10; 503 Service Unavailable x10')
+        self.assertEqual(result.table_times()[:2], [(10.0, 's'), (5.0, 'ms')])
+
+        no_response = StepResult.from_report(report(status_codes={'0': 4, '200': 6}), attack_rate=50)
+        self.assertEqual(no_response.attack_rate, 50)
+        self.assertEqual(no_response.status_classes(), {'none': 4, '2xx': 6})
+        self.assertEqual(no_response.breakdown(), '200:6 0:4; 503 Service Unavailable')
+
+    # --------------------------------------------------------------------------
+    def test_from_hist(self):
+        lines = ['Bucket           #     %       Histogram',
+                 '[0s,     1ms]    0     0.00%',
+                 '[1ms,    3ms]    90    90.00%  ###################################################',
+                 '[3ms,    +Inf]   10    10.00%  #####']
+        result = StepResult.from_hist(lines, 2, 100)
+        self.assertEqual((result.step, result.requests), (2, 100))
+        self.assertAlmostEqual(result.latency_50th, 2000000, delta=20000)
+        self.assertAlmostEqual(result.latency_99th, 3000000, delta=30000)
+
+
+###############################################################################
+class TestStepColumns(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.steps = [(1, StepResult.from_report(report(100.0), 1)),
+                      (1, StepResult.from_report(report(200.5, 1.0, {'200': 1000}, errors=[]), 2)),
+                      (7, StepResult.from_report(report(300.0, 0.5, {'0': 500, '200': 500},
+                                                        bound_by={'objective': 'p99<1s'}), 1))]
+        self.columns = StepColumns(self.steps)
+
+    # --------------------------------------------------------------------------
+    def test_columns(self):
+        columns = self.columns.columns
+        self.assertEqual(self.columns.rows, 3)
+        self.assertEqual(list(columns['run_id']), [1, 1, 7])
+        self.assertEqual(list(columns['rate']), [100.0, 200.5, 300.0])
+        self.assertEqual(columns['rate'].typecode, 'd')
+        self.assertEqual(columns['latency_99th'].typecode, 'q')
+        self.assertEqual([name for name in columns if name.startswith('code_')], ['code_0', 'code_200', 'code_503'])
+        self.assertEqual(list(columns['code_0']), [0, 0, 500])                  # 0 where a step had none
+        self.assertEqual(list(columns['code_503']), [10, 0, 0])
+        self.assertEqual(self.columns.text['bound_by'], ['', '', 'p99<1s'])
+        self.assertEqual(self.columns.text['errors'], ['{"503 Service Unavailable": 0}', '',
+                                                       '{"503 Service Unavailable": 0}'])
+
+    # --------------------------------------------------------------------------
+    def test_npy_round_trip(self):
+        output = os.path.join(self.directory, 'export')
+        files = self.columns.write(output)
+        self.assertEqual(len(files), len(self.columns.columns) + 1)
+        columns, text = StepColumns.read_npy(output)
+        self.assertEqual(list(columns), list(self.columns.columns))
+        for name, values in self.columns.columns.items():
+            self.assertEqual(columns[name], values, name)
+        self.assertEqual(text, self.columns.text)
+        with open(files[0], 'rb') as f:
+            self.assertEqual((10 + int.from_bytes(f.read(10)[8:], 'little')) % 64, 0)   # header aligned
+
+    # --------------------------------------------------------------------------
+    def test_npy_files(self):
+        path = os.path.join(self.directory, 'values.npy')
+        for values in (array('q', [0, -1, 2 ** 62]), array('d', [0.5, -1e300]), array('q')):
+            write_npy(path, values)
+            self.assertEqual(read_npy(path), values)
+        with open(path, 'wb') as f:
+            f.write(b'not numpy')
+        with self.assertRaises(Exception) as caught:
+            read_npy(path)
+        self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType)
+
+    # --------------------------------------------------------------------------
+    @unittest.skipUnless(numpy, 'needs numpy')
+    def test_numpy_load(self):
+        output = os.path.join(self.directory, 'export')
+        self.columns.write(output)
+        self.assertEqual(numpy.load(os.path.join(output, 'rate.npy')).tolist(), [100.0, 200.5, 300.0])
+        self.assertEqual(numpy.load(os.path.join(output, 'code_0.npy')).dtype, numpy.int64)
+
+    # --------------------------------------------------------------------------
+    def test_parquet(self):
+        output = os.path.join(self.directory, 'steps.parquet')
+        if pyarrow is None:
+            with self.assertRaises(Exception) as caught:
+                self.columns.write(output, 'parquet')
+            self.assertEqual(caught.exception.args[0], ErrorCode.toolNotInstalled)
+            return
+        from pyarrow import parquet
+        self.assertEqual(self.columns.write(output, 'parquet'), [output])
+        table = parquet.read_table(output).to_pydict()
+        for name, values in self.columns.columns.items():
+            self.assertEqual(table[name], list(values), name)
+        self.assertEqual(table['bound_by'], self.columns.text['bound_by'])
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
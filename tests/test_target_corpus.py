@@ -0,0 +1,84 @@
+"""
+Compiled target corpora: the requests they hold, their orders, and their export back to a vegeta
+target file.
+"""
+
+import os
+import tempfile
+import unittest
+from target_corpus import TargetCorpus, compile_targets, is_corpus, target_indexes
+from vegeta_targets import read_targets
+from utils import *
+
+
+###############################################################################
+class TestTargetCorpus(unittest.TestCase):
+    targets = """GET http://localhost:5555/test/version
+
+GET http://10.0.0.5:8080/status
+Host: api.internal
+X-Account-ID: 8675309
+
+POST https://example.com/update
+Content-Type: application/json
+@body.json
+
+GET http://example.com/agent
+Host: example.com
+User-Agent: probe/1.0
+"""
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.target_file = os.path.join(self.directory, 'targets.txt')
+        with open(self.target_file, 'w') as f:
+            f.write(self.targets)
+        with open(os.path.join(self.directory, 'body.json'), 'w') as f:
+            f.write('{"a": 1}')
+        self.corpus_file = os.path.join(self.directory, 'targets.vtc')
+        self.assertEqual(compile_targets(self.target_file, self.corpus_file), 4)
+        self.corpus = TargetCorpus(self.corpus_file)
+        self.addCleanup(self.corpus.close)
+
+    # --------------------------------------------------------------------------
+    def test_requests(self):
+        self.assertTrue(is_corpus(self.corpus_file))
+        self.assertFalse(is_corpus(self.target_file))
+        for index, target in enumerate(read_targets(self.target_file)):
+            address, request, head_request = self.corpus.request(index)
+            self.assertEqual(address, target.address())
+            self.assertEqual(request, target.request_bytes())
+            self.assertFalse(head_request)
+        self.assertEqual(len(self.corpus.hosts), 4)                       # example.com on http and https
+
+    # --------------------------------------------------------------------------
+    def test_export(self):
+        exported = os.path.join(self.directory, 'exported.txt')
+        self.corpus.export(exported)
+        original, targets = read_targets(self.target_file), read_targets(exported)
+        self.assertEqual([target.method for target in targets], [target.method for target in original])
+        self.assertEqual([target.address() for target in targets], [target.address() for target in original])
+        self.assertEqual([target.body for target in targets], [target.body for target in original])
+        self.assertEqual(targets[0].headers, [])                                # nothing the corpus added
+        self.assertEqual(targets[1].headers, [('Host', 'api.internal'), ('X-Account-ID', '8675309')])
+        self.assertEqual(targets[2].headers, [('Content-Type', 'application/json')])
+        self.assertEqual(targets[3].headers, [('User-Agent', 'probe/1.0')])     # the Host of the url is implied
+
+    # --------------------------------------------------------------------------
+    def test_orders(self):
+        self.assertEqual(list(target_indexes(5)), [0, 1, 2, 3, 4])
+        shuffled = target_indexes(5, 'shuffle', seed=3)
+        self.assertEqual(sorted(shuffled), [0, 1, 2, 3, 4])
+        self.assertEqual(shuffled, target_indexes(5, 'shuffle', seed=3))
+        self.assertEqual(len(self.corpus.order('weighted')), 10000)
+        with self.assertRaises(Exception) as caught:
+            target_indexes(5, 'random')
+        self.assertEqual(caught.exception.args[0], ErrorCode.valueOutOfRange)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
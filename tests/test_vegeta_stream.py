@@ -0,0 +1,170 @@
+"""
+Streaming statistics of vegeta results, and the early abort of a step that clearly fails.
+"""
+
+import math
+import random
+import unittest
+from datetime import datetime, timezone
+from vegeta_stream import EarlyAbortRule, StreamStats, parse_timestamp
+from utils import *
+
+start = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+
+
+###############################################################################
+def results(count: int = 11, failures=(3, 7)) -> List[dict]:
+    """
+    :return: decoded vegeta results 0.1 seconds apart, taking 10ms each, failing at the failures indexes
+    """
+    return [{'timestamp': '2024-05-01T12:00:{:02d}.{}00000000Z'.format(index // 10, index % 10),
+             'code': 500 if index in failures else 200,
+             'latency': 10000000,
+             'bytes_in': 100,
+             'bytes_out': 20,
+             'error': '500 Internal Server Error' if index in failures else ''} for index in range(count)]
+
+
+###############################################################################
+class TestStreamStats(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_parse_timestamp(self):
+        self.assertAlmostEqual(parse_timestamp('2024-05-01T12:00:00.123456789Z'), start + 0.123456, places=6)
+        self.assertAlmostEqual(parse_timestamp('2024-05-01T05:00:01.5-07:00'), start + 1.5, places=6)
+        self.assertEqual(parse_timestamp('2024-05-01T12:00:02+00:00'), start + 2)
+
+    # --------------------------------------------------------------------------
+    def test_report(self):
+        stats = StreamStats()
+        for result in results():
+            stats.add(result)
+        report = stats.report()
+        self.assertEqual(report['requests'], 11)
+        self.assertAlmostEqual(report['duration'], 1000000000, delta=1000)   # float seconds, to the microsecond
+        self.assertAlmostEqual(report['wait'], 10000000, delta=1000)
+        self.assertAlmostEqual(report['rate'], 11.0, places=4)                          # requests / duration, as vegeta
+        self.assertAlmostEqual(report['throughput'], 9 / 1.01, places=4)
+        self.assertAlmostEqual(report['success'], 9 / 11)
+        self.assertEqual(report['status_codes'], {'200': 9, '500': 2})
+        self.assertEqual(report['errors'], ['500 Internal Server Error'])
+        self.assertEqual(report['error_counts'], {'500 Internal Server Error': 2})
+        self.assertEqual(report['bytes_in'], {'total': 1100, 'mean': 100.0})
+        self.assertEqual(report['bytes_out'], {'total': 220, 'mean': 20.0})
+        self.assertEqual(report['latencies']['total'], 11 * 10000000)
+        for key in ('mean', '50th', '99th', 'max', 'min'):
+            self.assertAlmostEqual(report['latencies'][key], 10000000, delta=100000, msg=key)
+        self.assertNotIn('lateness', report)
+        self.assertEqual(parse_timestamp(report['earliest']), start)
+        self.assertAlmostEqual(parse_timestamp(report['end']), start + 1.01, places=6)
+
+    # --------------------------------------------------------------------------
+    def test_empty(self):
+        report = StreamStats().report()
+        self.assertEqual((report['requests'], report['rate'], report['throughput'], report['success']),
+                         (0, 0.0, 0.0, 0.0))
+        self.assertEqual(report['earliest'], '')
+
+    # --------------------------------------------------------------------------
+    def test_merge(self):
+        whole, first, second = StreamStats(), StreamStats(), StreamStats()
+        for index, result in enumerate(results(20, failures=(2, 5, 17))):
+            whole.add(result)
+            (first if index % 3 else second).add(result)
+        merged = StreamStats().merge(first).merge(second)
+        self.assertEqual(merged.report(), whole.report())
+        self.assertEqual(first.merge(StreamStats()).report(), first.report())
+
+    # --------------------------------------------------------------------------
+    def test_lateness(self):
+        stats = StreamStats()
+        stats.record(200, 5000000, started=start + 0.002, due=start)            # 2ms late
+        stats.record(200, 5000000, started=start + 0.009, due=start + 0.001)    # 8ms late
+        stats.record(200, 5000000, started=start + 0.019, due=start + 0.02)     # early counts as on time
+        stats.record(200, 5000000, started=start + 0.5)                         # no schedule
+        report = stats.report()
+        self.assertAlmostEqual(report['lateness']['max'], 8000000, delta=1000)
+        self.assertAlmostEqual(report['lateness']['mean'], 10000000 / 3, delta=1000)
+        self.assertAlmostEqual(stats.end, start + 0.505)                        # latency counts from the due time
+
+        other = StreamStats()
+        other.record(200, 5000000, started=start + 0.05, due=start + 0.02)      # 30ms late
+        stats.merge(other)
+        self.assertEqual(stats.scheduled, 4)
+        self.assertAlmostEqual(stats.report()['lateness']['max'], 30000000, delta=1000)
+
+
+###############################################################################
+def run_rule(rule: EarlyAbortRule, failure_rate, planned: int, generator: random.Random) -> int:
+    """
+    Feed the rule a stream of results, checked every check_interval results as in a step
+    :param failure_rate: the failure probability, or a function of the result index to it
+    :return: the results seen when the rule tripped, 0 if it did not
+    """
+    rate_at = failure_rate if callable(failure_rate) else lambda index: failure_rate
+    success = 0
+    for index in range(planned):
+        if generator.random() >= rate_at(index):
+            success += 1
+        if (index + 1) % rule.check_interval == 0 and rule.check(index + 1, success):
+            return index + 1
+    return 0
+
+
+###############################################################################
+class TestEarlyAbortRule(unittest.TestCase):
+
+    # --------------------------------------------------------------------------
+    def test_layout(self):
+        rule = EarlyAbortRule(5, 10000)
+        self.assertAlmostEqual(rule.p0, 0.06)                                   # the threshold with 20% tolerance
+        self.assertAlmostEqual(rule.p1, 0.12)
+        self.assertAlmostEqual(rule.limit, math.log(10000 / rule.alpha))
+        self.assertEqual(EarlyAbortRule(0, 100).p0, EarlyAbortRule.min_failure_rate)
+        self.assertLess(EarlyAbortRule(90, 100).p1, 1.0)
+
+    # --------------------------------------------------------------------------
+    def test_trips_on_failing_stream(self):
+        rule = EarlyAbortRule(5, 10000)
+        tripped_at = run_rule(rule, 0.3, 10000, random.Random(1))
+        self.assertGreater(tripped_at, 0)
+        self.assertLess(tripped_at, 500)
+        self.assertTrue(rule.tripped)
+        self.assertGreater(rule.failure_rate, 0.2)
+        self.assertGreaterEqual(rule.log_likelihood_ratio, rule.limit)
+        self.assertTrue(rule.check(tripped_at, 0))                              # no new results: still tripped
+
+    # --------------------------------------------------------------------------
+    def test_trips_when_failures_begin_late(self):
+        rule = EarlyAbortRule(5, 20000)
+        tripped_at = run_rule(rule, lambda index: 0.0 if index < 15000 else 0.5, 20000, random.Random(2))
+        self.assertGreater(tripped_at, 15000)
+        self.assertLess(tripped_at, 15500)                                      # the successes are not held against it
+        self.assertGreater(rule.failure_rate, 0.3)
+
+    # --------------------------------------------------------------------------
+    def test_passing_stream(self):
+        for failure_rate in (0.0, 0.01, 0.05):
+            rule = EarlyAbortRule(5, 20000)
+            self.assertEqual(run_rule(rule, failure_rate, 20000, random.Random(3)), 0, failure_rate)
+            self.assertFalse(rule.tripped)
+            self.assertLess(rule.log_likelihood_ratio, rule.limit)
+
+    # --------------------------------------------------------------------------
+    def test_false_abort_rate_at_threshold(self):
+        """
+        A step failing at exactly the tolerated rate p0 is stopped in at most alpha of the runs
+        """
+        generator = random.Random(4)
+        runs, planned = 500, 2000
+        aborts = 0
+        for _ in range(runs):
+            rule = EarlyAbortRule(5, planned)
+            if run_rule(rule, rule.p0, planned, generator):
+                aborts += 1
+        self.assertLessEqual(aborts / runs, EarlyAbortRule.alpha * 2)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
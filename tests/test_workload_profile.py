@@ -0,0 +1,135 @@
+"""
+Workload profiles: loading, the weighted interleaving of the endpoints, the templates of the
+generated requests, and the results and objectives per endpoint.
+"""
+
+import os
+import json
+import tempfile
+import unittest
+from workload_profile import Endpoint, WorkloadProfile
+from service_objectives import parse_objective
+from utils import *
+
+
+###############################################################################
+class TestWorkloadProfile(unittest.TestCase):
+    profile = {
+        'requests': 8,
+        'seed': 7,
+        'endpoints': [
+            {'name': 'version', 'url': 'http://localhost:5555/test/version?n=${seq}', 'weight': 3,
+             'slo': ['failure<1%', 'p99<50ms']},
+            {'name': 'update', 'method': 'post', 'url': 'http://localhost:5555/test/update',
+             'headers': {'Content-Type': 'application/json', 'X-Request': '${uuid}'},
+             'body_file': 'update.json', 'slo': ['p99<200ms']}]}
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        with open(os.path.join(self.directory, 'update.json'), 'w') as f:
+            f.write('{"account": ${random:1:1000}, "kind": "${choice:a|b}"}')
+
+    # --------------------------------------------------------------------------
+    def load(self, profile: dict) -> WorkloadProfile:
+        profile_file = os.path.join(self.directory, 'profile.json')
+        with open(profile_file, 'w') as f:
+            json.dump(profile, f)
+        return WorkloadProfile.load(profile_file)
+
+    # --------------------------------------------------------------------------
+    def test_load(self):
+        profile = self.load(self.profile)
+        version, update = profile.endpoints
+        self.assertEqual((profile.requests, profile.seed), (8, 7))
+        self.assertEqual((version.method, version.weight, version.headers, version.body), ('GET', 3.0, [], ''))
+        self.assertEqual([objective.text for objective in version.objectives], ['failure<1%', 'p99<50ms'])
+        self.assertEqual(update.method, 'POST')
+        self.assertEqual(update.weight, 1.0)
+        self.assertEqual(update.headers, [('Content-Type', 'application/json'), ('X-Request', '${uuid}')])
+        self.assertIn('${random:1:1000}', update.body)
+
+    # --------------------------------------------------------------------------
+    def test_bad_profiles(self):
+        def endpoint(**fields):
+            return dict({'name': 'a', 'url': 'http://localhost/a'}, **fields)
+
+        for profile in ({'endpoints': []},
+                        {},
+                        {'endpoints': [{'name': 'a'}]},
+                        {'endpoints': [endpoint(weight=0)]},
+                        {'endpoints': [endpoint(), endpoint()]},
+                        {'endpoints': [endpoint(slo=['p99>1s'])]},
+                        {'endpoints': [endpoint(body_file='missing.json')]}):
+            with self.assertRaises(Exception, msg=profile) as caught:
+                self.load(profile)
+            self.assertIn(caught.exception.args[0], (ErrorCode.badParameterType, ErrorCode.emptyParameter), profile)
+
+    # --------------------------------------------------------------------------
+    def test_schedule(self):
+        profile = self.load(self.profile)
+        self.assertEqual(profile.schedule(), [0, 0, 1, 0, 0, 0, 1, 0])         # 3:1, evenly spread
+        profile = WorkloadProfile([Endpoint(str(i), 'GET', 'http://localhost/', [], '', weight, [])
+                                   for i, weight in enumerate((5, 3, 2))], requests=1000)
+        order = profile.schedule()
+        self.assertEqual([order.count(i) for i in range(3)], [500, 300, 200])
+        self.assertEqual([order[:10].count(i) for i in range(3)], [5, 3, 2])    # in every stretch of the run
+
+        few = WorkloadProfile([Endpoint(str(i), 'GET', 'http://localhost/', [], '', 1, []) for i in range(3)],
+                              requests=1)
+        self.assertEqual(sorted(few.schedule()), [0, 1, 2])                     # every endpoint at least once
+
+    # --------------------------------------------------------------------------
+    def test_materialize(self):
+        targets = self.load(self.profile).materialize()
+        self.assertEqual([target.url for target in targets[:2]], ['http://localhost:5555/test/version?n=0',
+                                                                  'http://localhost:5555/test/version?n=1'])
+        update = targets[2]
+        self.assertEqual(update.method, 'POST')
+        body = json.loads(update.body)
+        self.assertTrue(1 <= body['account'] <= 1000)
+        self.assertIn(body['kind'], ('a', 'b'))
+        self.assertEqual(len(dict(update.headers)['X-Request']), 36)
+        self.assertNotEqual(dict(update.headers)['X-Request'], dict(targets[6].headers)['X-Request'])
+        again = self.load(self.profile).materialize()                           # the same seed, the same requests
+        self.assertEqual([(target.url, target.headers, target.body) for target in again],
+                         [(target.url, target.headers, target.body) for target in targets])
+
+        profile = WorkloadProfile([Endpoint('a', 'GET', 'http://localhost/${nothing}', [], '', 1, [])])
+        with self.assertRaises(Exception) as caught:
+            profile.materialize()
+        self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType)
+
+    # --------------------------------------------------------------------------
+    def test_endpoint_results(self):
+        profile = self.load(self.profile)
+        targets = profile.materialize()
+        stats = profile.endpoint_stats()
+        results = [{'method': target.method, 'url': target.url, 'code': 200 if i % 4 else 500,
+                    'latency': 100000000 if target.method == 'POST' else 1000000,
+                    'timestamp': '2024-05-01T12:00:00.{}00000000Z'.format(i)} for i, target in enumerate(targets)]
+        results.append({'method': 'GET', 'url': 'http://elsewhere/', 'code': 200, 'latency': 1})
+        self.assertEqual(list(stats.split(results)), results)                   # passed on as they come
+        reports = stats.reports()
+        self.assertEqual((reports['version']['requests'], reports['update']['requests']), (6, 2))
+        self.assertNotIn('histogram', reports['version'])
+
+        missed = profile.missed_objectives(reports)
+        self.assertEqual([(name, objective.text) for name, objective, _ in missed], [('version', 'failure<1%')])
+        self.assertAlmostEqual(missed[0][2], 100 / 3)                           # 2 of 6 failed against 1%
+        self.assertEqual(profile.missed_objectives({}), [])
+
+    # --------------------------------------------------------------------------
+    def test_ambiguous_endpoints(self):
+        profile = WorkloadProfile([Endpoint(name, 'GET', 'http://localhost/same', [], '', 1,
+                                            [parse_objective('p99<1s')]) for name in ('a', 'b')])
+        with self.assertRaises(Exception) as caught:
+            list(profile.endpoint_stats().split([]))
+        self.assertEqual(caught.exception.args[0], ErrorCode.badParameterType)
+
+
+###############################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,342 @@
+"""
+Sample web server to try the load tests locally, serving the requests of test_local_requests.txt:
+
+    GET  /test/version - the server version
+    POST /test/update  - counts one update
+    GET  /test/count   - the number of updates so far
+
+It is a plain asyncio HTTP/1.1 server with keep-alive connections and no dependencies, fast
+enough to stand in for a real service when the load test tools themselves are benchmarked.
+With --processes it runs in several processes on one port (SO_REUSEPORT), so that it is not
+the bottleneck of a benchmark; each process counts its own updates.
+
+With a capacity, it behaves like a service of that capacity instead of answering at once,
+see ServiceModel: requests queue up and latency grows with the load, requests are shed with
+503 once the queue is too long, and optionally errors rise beyond a knee, the process stops
+for GC pauses, and a cold process is slower until it has warmed up. The capacity is shared by
+the processes. Every random draw comes from the seed, so that the same load gives the same
+behaviour, and the warm-up, the search strategies and the harness itself can be benchmarked
+reproducibly on one machine.
+
+    python3 testserver.py [--port 5555] [--processes 4] [--capacity 2000] [--knee 0.9]
+                          [--gc_interval 10 --gc_pause 200] [--cold_factor 5 --warm_up_requests 5000]
+"""
+
+import math
+import heapq
+import random
+import signal
+import asyncio
+import argparse
+import multiprocessing
+from utils import *
+
+
+###############################################################################
+class ServiceModel:
+    """
+    The timing of one server process: a single FIFO queue served at capacity requests/second,
+    with exponentially distributed service times (M/M/1), so the latency grows with the load as
+    1 / (1 - utilisation). On top of that:
+
+    - a request that would wait longer than max_queue seconds is shed at once with a 503
+    - beyond the knee, a fraction of the capacity, the arrivals above it fail with a 500
+    - every gc_interval seconds (+-10%) the process stops for gc_pause seconds
+    - a cold process serves cold_factor times slower, and warms up exponentially over
+      warm_up_requests requests, like a JIT compiler would
+    """
+    rate_window = 1.0                                                           # seconds of the arrival rate
+
+    # --------------------------------------------------------------------------
+    def __init__(self, capacity: float, max_queue: float = 0.1, knee: float = None, gc_interval: float = None,
+                 gc_pause: float = 0.0, cold_factor: float = 1.0, warm_up_requests: int = 1000, seed: int = 0,
+                 now: float = 0.0):
+        """
+        :param capacity: requests/second
+        :param now: the time the process starts, on the clock that is passed to schedule()
+        """
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.knee = knee
+        self.gc_interval = gc_interval
+        self.gc_pause = gc_pause
+        self.cold_factor = cold_factor
+        self.warm_up_requests = warm_up_requests
+        self.random = random.Random(seed)
+        self.busy_until = now                                                   # the queue is empty then
+        self.paused_until = now
+        self.next_gc = now + self.gc_delay() if gc_interval else math.inf
+        self.arrival_rate = 0.0                                                 # decaying average
+        self.last_arrival = now
+        self.served = self.shed = self.failed = self.pauses = 0
+
+    # --------------------------------------------------------------------------
+    def gc_delay(self) -> float:
+        return self.gc_interval * self.random.uniform(0.9, 1.1)
+
+    # --------------------------------------------------------------------------
+    def collect_garbage(self, now: float):
+        """
+        Start the GC pauses that are due by now
+        """
+        while self.next_gc <= now:
+            if self.busy_until > self.next_gc:
+                self.busy_until += self.gc_pause                                # the queue stops too
+            self.paused_until = max(self.paused_until, self.next_gc) + self.gc_pause
+            self.pauses += 1
+            self.next_gc += self.gc_delay()
+
+    # --------------------------------------------------------------------------
+    def service_time(self) -> float:
+        slowdown = 1.0 + (self.cold_factor - 1.0) * math.exp(-self.served / self.warm_up_requests)
+        return self.random.expovariate(self.capacity) * slowdown
+
+    # --------------------------------------------------------------------------
+    def schedule(self, now: float) -> Tuple[int, float]:
+        """
+        Queue one request that arrives now
+        :return: its status code, and the time its response is ready
+        """
+        self.collect_garbage(now)
+        self.arrival_rate = self.arrival_rate * math.exp((self.last_arrival - now) / self.rate_window) + \
+            1.0 / self.rate_window
+        self.last_arrival = now
+        start = max(now, self.busy_until, self.paused_until)
+        if start - now > self.max_queue:
+            self.shed += 1
+            return 503, max(now, self.paused_until)
+        if self.knee is not None:
+            limit = self.knee * self.capacity
+            if self.arrival_rate > limit and self.random.random() < (self.arrival_rate - limit) / self.arrival_rate:
+                self.failed += 1
+                return 500, max(now, self.paused_until)
+        self.busy_until = start + self.service_time()
+        self.served += 1
+        return 200, self.busy_until
+
+
+###############################################################################
+class TestServer:
+    version = b'1.0'
+
+    # --------------------------------------------------------------------------
+    def __init__(self, model: ServiceModel = None):
+        """
+        :param model: the timing of the responses, None to answer at once
+        """
+        self.update_count = 0
+        self.request_count = 0
+        self.model = model
+        self.pending = []                                                       # heap of delayed responses
+        self.sequence = 0
+        self.timer = None
+        self.timer_at = None
+
+    # --------------------------------------------------------------------------
+    def handle(self, method: bytes, path: bytes, body: bytes) -> Tuple[int, bytes]:
+        """
+        :return: status code and response body of one request
+        """
+        self.request_count += 1
+        if path == b'/test/version' and method == b'GET':
+            return 200, self.version
+        if path == b'/test/update' and method == b'POST':
+            self.update_count += 1
+            return 200, b'OK'
+        if path == b'/test/count' and method == b'GET':
+            return 200, str(self.update_count).encode('ascii')
+        return 404, b'Not Found'
+
+    # --------------------------------------------------------------------------
+    def delay(self, protocol: 'HttpServerProtocol', ready: float, code: int, content: bytes):
+        """
+        Send a response once it is ready
+        """
+        self.sequence += 1
+        heapq.heappush(self.pending, (ready, self.sequence, protocol, code, content))
+        protocol.queued += 1
+        if self.timer_at is None or ready < self.timer_at:
+            self.wake_up_at(ready)
+
+    # --------------------------------------------------------------------------
+    def wake_up_at(self, when: float):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_at(when, self.send_ready)
+        self.timer_at = when
+
+    # --------------------------------------------------------------------------
+    def send_ready(self):
+        self.timer = self.timer_at = None
+        now = asyncio.get_running_loop().time()
+        self.model.collect_garbage(now)
+        if now < self.model.paused_until:
+            self.wake_up_at(self.model.paused_until)                            # nothing is sent in a pause
+            return
+        while self.pending and self.pending[0][0] <= now:
+            _, _, protocol, code, content = heapq.heappop(self.pending)
+            protocol.queued -= 1
+            protocol.send(code, content)
+        if self.pending:
+            self.wake_up_at(self.pending[0][0])
+
+
+###############################################################################
+class HttpServerProtocol(asyncio.Protocol):
+    reasons = {200: b'OK', 404: b'Not Found', 500: b'Internal Server Error', 503: b'Service Unavailable'}
+
+    # --------------------------------------------------------------------------
+    def __init__(self, server: TestServer):
+        self.server = server
+        self.transport = None
+        self.buffer = bytearray()
+        self.queued = 0                                                         # responses not sent yet
+        self.last_ready = 0.0                                                   # responses go out in order
+
+    # --------------------------------------------------------------------------
+    def connection_made(self, transport):
+        self.transport = transport
+
+    # --------------------------------------------------------------------------
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            header_end = self.buffer.find(b'\r\n\r\n')
+            if header_end < 0:
+                return
+            head = bytes(self.buffer[:header_end])
+            body_length = 0
+            position = head.lower().find(b'\r\ncontent-length:')
+            if position >= 0:
+                value_end = head.find(b'\r\n', position + 2)
+                body_length = int(head[position + 17:value_end if value_end > 0 else None])
+            request_end = header_end + 4 + body_length
+            if len(self.buffer) < request_end:
+                return
+
+            body = bytes(self.buffer[header_end + 4:request_end])
+            del self.buffer[:request_end]
+            method, path, _ = head.split(b' ', 2)
+            self.respond(method, path.split(b'?', 1)[0], body)
+
+    # --------------------------------------------------------------------------
+    def respond(self, method: bytes, path: bytes, body: bytes):
+        model = self.server.model
+        if model is None:
+            code, content = self.server.handle(method, path, body)
+            self.send(code, content)
+            return
+
+        now = asyncio.get_running_loop().time()
+        code, ready = model.schedule(now)
+        if code == 200:
+            code, content = self.server.handle(method, path, body)
+        else:
+            content = self.reasons[code]
+        self.last_ready = ready = max(ready, self.last_ready)
+        if ready <= now and self.queued == 0:
+            self.send(code, content)
+        else:
+            self.server.delay(self, ready, code, content)
+
+    # --------------------------------------------------------------------------
+    def send(self, code: int, content: bytes):
+        if self.transport.is_closing():
+            return
+        self.transport.write(b'HTTP/1.1 %d %s\r\nContent-Type: text/plain\r\nContent-Length: %d\r\n\r\n%s'
+                             % (code, self.reasons.get(code, b'Unknown'), len(content), content))
+
+
+###############################################################################
+def serve(given_args, index: int):
+    """
+    Run one server process until it is interrupted
+    """
+    async def run():
+        loop = asyncio.get_running_loop()
+        model = None
+        if given_args.capacity is not None:
+            model = ServiceModel(given_args.capacity / given_args.processes, given_args.max_queue / 1000,
+                                 given_args.knee, given_args.gc_interval, given_args.gc_pause / 1000,
+                                 given_args.cold_factor, given_args.warm_up_requests,
+                                 given_args.seed * 1000003 + index, loop.time())
+        server = TestServer(model)
+        listener = await loop.create_server(lambda: HttpServerProtocol(server), '127.0.0.1',
+                                            given_args.port, reuse_address=True,
+                                            reuse_port=given_args.processes > 1, backlog=4096)
+        async with listener:
+            await listener.serve_forever()
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+###############################################################################
+def main(argv):
+    args = argparse.ArgumentParser(description='Sample web server for local load tests')
+    args.add_argument('--port', "-p", type=int, action="store", dest="port", default=5555,
+                      help="Port to listen on. Default is 5555.")
+    args.add_argument('--processes', type=int, action="store", dest="processes", default=1,
+                      help="Server processes on the port. Default is 1.")
+    args.add_argument('--capacity', "-c", type=int, action="store", dest="capacity", default=None,
+                      help="Requests/second the server can serve, shared by the processes. "
+                           "Default is to answer every request at once.")
+    args.add_argument('--max_queue', type=float, action="store", dest="max_queue", default=100,
+                      help="Milliseconds a request may wait in the queue before it is shed with 503. "
+                           "Default is 100.")
+    args.add_argument('--knee', type=float, action="store", dest="knee", default=None,
+                      help="Fraction of the capacity beyond which the arrivals above it fail with 500, "
+                           "e.g. 0.9. Default is no errors.")
+    args.add_argument('--gc_interval', type=float, action="store", dest="gc_interval", default=None,
+                      help="Seconds between two GC pauses of a process. Default is no pauses.")
+    args.add_argument('--gc_pause', type=float, action="store", dest="gc_pause", default=200,
+                      help="Milliseconds of a GC pause. Default is 200.")
+    args.add_argument('--cold_factor', type=float, action="store", dest="cold_factor", default=1.0,
+                      help="How many times slower a cold process serves. Default is 1, no warm-up.")
+    args.add_argument('--warm_up_requests', type=int, action="store", dest="warm_up_requests", default=1000,
+                      help="Requests over which a cold process warms up. Default is 1000.")
+    args.add_argument('--seed', type=int, action="store", dest="seed", default=0,
+                      help="Seed of the random service times, errors and pauses. Default is 0.")
+    given_args = args.parse_args(argv[1:])
+    if given_args.processes <= 0:
+        raise Exception(ErrorCode.valueOutOfRange, "At least one process")
+    if given_args.capacity is not None and given_args.capacity <= 0:
+        raise Exception(ErrorCode.valueOutOfRange, "Capacity must be positive")
+    if given_args.capacity is None and (given_args.knee is not None or given_args.gc_interval is not None or
+                                        given_args.cold_factor != 1.0):
+        raise Exception(ErrorCode.badParameterType, "The knee, GC pauses and warm-up need a --capacity")
+    if given_args.knee is not None and not 0 < given_args.knee <= 1:
+        raise Exception(ErrorCode.valueOutOfRange, "The knee is a fraction of the capacity, e.g. 0.9")
+    if given_args.cold_factor < 1.0 or given_args.warm_up_requests <= 0 or given_args.max_queue < 0 or \
+            given_args.gc_pause < 0 or (given_args.gc_interval is not None and given_args.gc_interval <= 0):
+        raise Exception(ErrorCode.valueOutOfRange, "Bad service model settings")
+
+    print('Serving on http://localhost:{} with {} process(es){}'.format(
+        given_args.port, given_args.processes,
+        ', capacity {}/second'.format(given_args.capacity) if given_args.capacity is not None else ''))
+    if given_args.processes == 1:
+        serve(given_args, 0)
+        return ErrorCode.ok
+
+    processes = [multiprocessing.Process(target=serve, args=(given_args, index), daemon=True)
+                 for index in range(given_args.processes)]
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    return ErrorCode.ok
+
+
+###############################################################################
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,428 @@
+"""
+Streaming consumption of vegeta attack results.
+
+Instead of waiting for `vegeta attack | vegeta report` to finish, the attack output is
+piped through `vegeta encode -to json` and read line by line. Each result goes through a
+small generator pipeline and is folded into StreamStats, which keeps a fixed amount of
+state (counters and log-bucketed histograms) no matter how long the attack runs.
+
+At the end of the attack StreamStats.report() returns a dict with the same shape as
+`vegeta report -type json`, so the rest of the script can treat both modes alike.
+"""
+
+import json
+import math
+import time
+import signal
+from collections import deque
+from datetime import datetime
+from step_pipeline import GatedCommand
+from latency_histogram import LatencyHistogram
+from utils import *
+
+
+###############################################################################
+def parse_timestamp(value: str) -> float:
+    """
+    Vegeta writes RFC3339 timestamps with nanoseconds, e.g. 2018-10-10T17:41:03.123456789-07:00.
+    datetime only takes microseconds, so the fraction is cut to 6 digits.
+    :return: POSIX timestamp in seconds
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    dot = value.find('.')
+    if dot > 0:
+        end = dot + 1
+        while end < len(value) and value[end].isdigit():
+            end += 1
+        value = value[:dot + 1] + value[dot + 1:end][:6].ljust(6, '0') + value[end:]
+    return datetime.fromisoformat(value).timestamp()
+
+
+###############################################################################
+def result_lines(stream) -> Iterator[bytes]:
+    """
+    :param stream: binary file object, typically the stdout of the vegeta pipeline
+    :return: non-empty lines as they arrive
+    """
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield line
+
+
+###############################################################################
+def decode_results(lines: Iterable[bytes]) -> Iterator[dict]:
+    """
+    :param lines: JSON-encoded vegeta results, one per line
+    :return: the decoded results. Broken lines (e.g. a truncated last line after a kill) are skipped
+    """
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+###############################################################################
+class RollingWindow:
+    """
+    Success counts and latencies over the last `window_seconds` seconds, kept in one slot per
+    second. Slots are recycled, so the memory use is fixed.
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, window_seconds: int = 10):
+        self.window_seconds = window_seconds
+        self.slots = deque(maxlen=window_seconds)
+        self.current_second = None
+
+    # --------------------------------------------------------------------------
+    def slot_for(self, now: float) -> list:
+        second = int(now)
+        if second != self.current_second:
+            if len(self.slots) == self.slots.maxlen:
+                slot = self.slots.popleft()                                      # recycle the oldest slot
+                slot[0], slot[1] = 0, 0
+                slot[2].reset()
+            else:
+                slot = [0, 0, LatencyHistogram()]
+            self.slots.append(slot)
+            self.current_second = second
+        return self.slots[-1]
+
+    # --------------------------------------------------------------------------
+    def record(self, now: float, success: bool, latency: int):
+        slot = self.slot_for(now)
+        slot[0] += 1
+        if success:
+            slot[1] += 1
+        slot[2].record(latency)
+
+    # --------------------------------------------------------------------------
+    def record_counts(self, now: float, total: int, success: int):
+        """
+        Add a batch of results whose latencies are accounted for elsewhere
+        """
+        slot = self.slot_for(now)
+        slot[0] += total
+        slot[1] += success
+
+    # --------------------------------------------------------------------------
+    def counts(self) -> Tuple[int, int]:
+        """
+        :return: total and successful requests within the window
+        """
+        total = success = 0
+        for slot in self.slots:
+            total += slot[0]
+            success += slot[1]
+        return total, success
+
+    # --------------------------------------------------------------------------
+    def success_ratio(self) -> float:
+        total, success = self.counts()
+        return success / total if total else 1.0
+
+    # --------------------------------------------------------------------------
+    def quantile(self, q: float) -> int:
+        return LatencyHistogram.merged(slot[2] for slot in self.slots).quantile(q)
+
+
+###############################################################################
+class StreamStats:
+    """
+    Incremental statistics over a stream of vegeta results, with bounded memory.
+    """
+    max_error_messages = 100
+
+    # --------------------------------------------------------------------------
+    def __init__(self, window_seconds: int = 10):
+        self.latencies = LatencyHistogram()
+        self.window = RollingWindow(window_seconds)
+        self.requests = 0
+        self.success = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.status_codes = {}
+        self.errors = {}                                                        # message: count
+        self.earliest = None
+        self.latest = None
+        self.end = None
+        self.scheduled = 0                                                      # results with a due time
+        self.lateness_total = 0.0                                               # seconds sent after their due time
+        self.lateness_max = 0.0
+
+    # --------------------------------------------------------------------------
+    def add(self, result: dict, now: float = None):
+        """
+        Fold one decoded vegeta result into the statistics
+        """
+        timestamp = result.get('timestamp')
+        self.record(result.get('code', 0), result.get('latency', 0), result.get('bytes_in', 0),
+                    result.get('bytes_out', 0), result.get('error'),
+                    parse_timestamp(timestamp) if timestamp else None, now)
+
+    # --------------------------------------------------------------------------
+    def record(self, code: int, latency: int, bytes_in: int = 0, bytes_out: int = 0, error: str = None,
+               started: float = None, now: float = None, due: float = None):
+        """
+        Fold one result into the statistics
+        :param code: HTTP status code, 0 if there was no response
+        :param latency: in nanoseconds, from due if it is given, else from started
+        :param started: POSIX timestamp the request was sent at, in seconds
+        :param now: monotonic time for the rolling window. Default is time.monotonic()
+        :param due: POSIX timestamp the schedule of an open-model attack had the request due at
+        """
+        success = 200 <= code < 400
+
+        self.requests += 1
+        if success:
+            self.success += 1
+        self.latencies.record(latency)
+        self.window.record(time.monotonic() if now is None else now, success, latency)
+
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        code_key = str(code)
+        self.status_codes[code_key] = self.status_codes.get(code_key, 0) + 1
+
+        if error and (error in self.errors or len(self.errors) < self.max_error_messages):
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+        if started is not None:
+            if self.earliest is None or started < self.earliest:
+                self.earliest = started
+            if self.latest is None or started > self.latest:
+                self.latest = started
+            finished = (started if due is None else due) + latency / 1e9
+            if self.end is None or finished > self.end:
+                self.end = finished
+            if due is not None:
+                lateness = max(0.0, started - due)
+                self.scheduled += 1
+                self.lateness_total += lateness
+                self.lateness_max = max(self.lateness_max, lateness)
+
+    # --------------------------------------------------------------------------
+    def merge(self, other: 'StreamStats') -> 'StreamStats':
+        """
+        Add the totals of other, e.g. of another worker, to these statistics. The rolling
+        window is left alone, it only makes sense for the stream it was recorded from.
+        :return: self
+        """
+        self.latencies.merge(other.latencies)
+        self.requests += other.requests
+        self.success += other.success
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        for code, count in other.status_codes.items():
+            self.status_codes[code] = self.status_codes.get(code, 0) + count
+        for error, count in other.errors.items():
+            if error in self.errors or len(self.errors) < self.max_error_messages:
+                self.errors[error] = self.errors.get(error, 0) + count
+        if other.earliest is not None and (self.earliest is None or other.earliest < self.earliest):
+            self.earliest = other.earliest
+        if other.latest is not None and (self.latest is None or other.latest > self.latest):
+            self.latest = other.latest
+        if other.end is not None and (self.end is None or other.end > self.end):
+            self.end = other.end
+        self.scheduled += other.scheduled
+        self.lateness_total += other.lateness_total
+        self.lateness_max = max(self.lateness_max, other.lateness_max)
+        return self
+
+    # --------------------------------------------------------------------------
+    def consume(self, results: Iterable[dict]) -> Iterator[dict]:
+        """
+        Pass-through stage of the generator pipeline: every result is added, then handed on,
+        so that later stages (e.g. the early-abort check) see the updated statistics.
+        """
+        for result in results:
+            self.add(result)
+            yield result
+
+    # --------------------------------------------------------------------------
+    def success_ratio(self) -> float:
+        return self.success / self.requests if self.requests else 0.0
+
+    # --------------------------------------------------------------------------
+    def report(self) -> dict:
+        """
+        :return: the statistics in the layout of `vegeta report -type json`. Results with a due
+                 time add how late they were sent, in nanoseconds, as lateness
+        """
+        duration = int((self.latest - self.earliest) * 1e9) if self.requests > 1 else 0
+        wait = int((self.end - self.latest) * 1e9) if self.requests > 0 else 0
+        rate = self.requests / (duration / 1e9) if duration > 0 else 0.0           # as vegeta defines it
+        throughput = self.success / ((duration + wait) / 1e9) if duration + wait > 0 else 0.0
+
+        def as_rfc3339(value):
+            return datetime.fromtimestamp(value).astimezone().isoformat() if value else ''
+
+        p50, p90, p95, p99, p999, p9999 = self.latencies.quantiles([0.50, 0.90, 0.95, 0.99, 0.999, 0.9999])
+        report = {
+            'latencies': {
+                'total': self.latencies.total_value,
+                'mean': self.latencies.mean(),
+                '50th': p50,
+                '90th': p90,
+                '95th': p95,
+                '99th': p99,
+                '99.9th': p999,
+                '99.99th': p9999,
+                'max': self.latencies.max_recorded,
+                'min': self.latencies.min_value},
+            'histogram': self.latencies.to_text(),
+            'bytes_in': {'total': self.bytes_in,
+                         'mean': self.bytes_in / self.requests if self.requests else 0.0},
+            'bytes_out': {'total': self.bytes_out,
+                          'mean': self.bytes_out / self.requests if self.requests else 0.0},
+            'earliest': as_rfc3339(self.earliest),
+            'latest': as_rfc3339(self.latest),
+            'end': as_rfc3339(self.end),
+            'duration': duration,
+            'wait': wait,
+            'requests': self.requests,
+            'rate': rate,
+            'throughput': throughput,
+            'success': self.success_ratio(),
+            'status_codes': dict(self.status_codes),
+            'errors': list(self.errors),
+            'error_counts': dict(self.errors)}
+        if self.scheduled:
+            report['lateness'] = {'mean': int(self.lateness_total / self.scheduled * 1e9),
+                                  'max': int(self.lateness_max * 1e9)}
+        return report
+
+
+###############################################################################
+class EarlyAbortRule:
+    """
+    Sequential stop rule for one step: Wald's sequential probability ratio test of the failure
+    rate, between the acceptable rate p0 (the threshold with the same 20% tolerance that
+    result_analysis_adaptive_adjustments applies) and a clearly failing rate p1, here twice that.
+    Each result adds log(p1 / p0) to the log likelihood ratio if it failed, log((1 - p1) / (1 - p0))
+    if it succeeded.
+
+    A service often fails only once it has been loaded for a while, so the test is restarted
+    from 0 whenever the ratio falls below it (Page's CUSUM) rather than accepting p0 for good.
+    Under p0 each run of the test crosses log(1 / e) with a probability of e at most, however
+    often it is looked at (Ville's inequality); with one run per result, at most n runs over the
+    n planned results of the step. The step is stopped once the ratio reaches log(n / alpha), so
+    that the chance of stopping a step that meets the threshold stays below alpha in all.
+    """
+    alpha = 0.01                                                                # false abort probability
+    min_failure_rate = 0.001                                                    # p0 for a threshold of 0
+    check_interval = 50                                                         # results between checks
+
+    # --------------------------------------------------------------------------
+    def __init__(self, failure_threshold: float, planned_requests: int):
+        """
+        :param failure_threshold: the expected failure threshold in percent
+        :param planned_requests: the results the step is to have, rate times duration
+        """
+        self.p0 = min(max(failure_threshold * 1.2 / 100.0, self.min_failure_rate), 0.99)
+        self.p1 = min(2 * self.p0, (1 + self.p0) / 2)
+        self.failure_step = math.log(self.p1 / self.p0)
+        self.success_step = math.log((1 - self.p1) / (1 - self.p0))
+        self.limit = math.log(max(planned_requests, 1) / self.alpha)
+        self.seen_requests = self.seen_success = 0
+        self.run_requests = self.run_failures = 0                               # since the last restart
+        self.log_likelihood_ratio = 0.0
+        self.failure_rate = 0.0
+        self.tripped = False
+
+    # --------------------------------------------------------------------------
+    def check(self, requests: int, success: int) -> bool:
+        """
+        :param requests: results of the step so far
+        :param success: successful results of the step so far
+        :return: True if the step should be stopped
+        """
+        new_requests, new_success = requests - self.seen_requests, success - self.seen_success
+        if new_requests <= 0:
+            return self.tripped
+        self.seen_requests, self.seen_success = requests, success
+        new_failures = new_requests - new_success
+        ratio = self.log_likelihood_ratio + new_failures * self.failure_step + new_success * self.success_step
+        if ratio <= 0:
+            self.log_likelihood_ratio = 0.0
+            self.run_requests = self.run_failures = 0
+            return False
+        self.log_likelihood_ratio = ratio
+        self.run_requests += new_requests
+        self.run_failures += new_failures
+        self.failure_rate = self.run_failures / self.run_requests
+        self.tripped = ratio >= self.limit
+        return self.tripped
+
+    # --------------------------------------------------------------------------
+    def watch(self, results: Iterable[dict], stats: StreamStats) -> Iterator[dict]:
+        """
+        Pipeline stage placed after StreamStats.consume(); the stream ends as soon as the rule trips
+        """
+        count = 0
+        for result in results:
+            yield result
+            count += 1
+            if count % self.check_interval == 0 and self.check(stats.requests, stats.success):
+                return
+
+
+###############################################################################
+class VegetaStream:
+    """
+    One running `vegeta attack | vegeta encode -to json` pipeline
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, rate: int, duration: int, target_file: str):
+        self.cmd = "vegeta attack -rate={} -duration={}s -targets={} -max-body=0 | vegeta encode -to json"\
+            .format(rate, duration, target_file)
+        self.target_file = target_file
+        self.proc = None
+        self.gate = None
+
+    # --------------------------------------------------------------------------
+    def start(self):
+        # own process group, so that stop() reaches both ends of the pipeline
+        self.proc = subprocess.Popen(self.cmd, shell=True, stdout=subprocess.PIPE,
+                                     start_new_session=True)
+        return self
+
+    # --------------------------------------------------------------------------
+    def prepare(self):
+        """
+        Spawn the pipeline ahead of its step, reading the targets from stdin instead of the
+        target file, so that it does not send anything before results() releases it
+        """
+        self.cmd = self.cmd.replace(' -targets={}'.format(self.target_file), '')
+        self.gate = GatedCommand(self.cmd, stdout=subprocess.PIPE)
+        self.proc = self.gate.proc
+        return self
+
+    # --------------------------------------------------------------------------
+    def results(self) -> Iterator[dict]:
+        if self.proc is None:
+            self.start()
+        elif self.gate is not None:
+            self.gate.release(self.target_file)
+        return decode_results(result_lines(self.proc.stdout))
+
+    # --------------------------------------------------------------------------
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    # --------------------------------------------------------------------------
+    def wait(self) -> int:
+        """
+        :return: ErrorCode.ok, or ErrorCode.executeShellCommand if the pipeline failed
+        """
+        self.proc.stdout.close()
+        ret = self.proc.wait()
+        return ErrorCode.ok if ret == 0 else ErrorCode.executeShellCommand
@@ -0,0 +1,103 @@
+"""
+Reader of vegeta target files, in vegeta's http format:
+
+    GET http://localhost:5555/test/version
+    X-Account-ID: 8675309
+
+    POST http://localhost:5555/test/update
+    Content-Type: application/json
+    @/path/to/body.json
+
+A target starts with a `METHOD URL` line, followed by optional header lines and an optional
+`@file` line for the body. Blank lines and `#` comments between targets are ignored.
+"""
+
+from urllib.parse import urlsplit
+from utils import *
+
+
+http_methods = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'}
+
+
+###############################################################################
+class Target:
+    __slots__ = ('method', 'url', 'headers', 'body')
+    user_agent = 'loadtest_vegeta'                                              # unless the target has its own
+
+    # --------------------------------------------------------------------------
+    def __init__(self, method: str, url: str, headers: List[Tuple[str, str]] = None, body: bytes = b''):
+        self.method = method
+        self.url = url
+        self.headers = headers or []
+        self.body = body
+
+    # --------------------------------------------------------------------------
+    def address(self) -> Tuple[str, int, bool]:
+        """
+        :return: host, port and whether it is HTTPS
+        """
+        parts = urlsplit(self.url)
+        secure = parts.scheme == 'https'
+        return parts.hostname, parts.port or (443 if secure else 80), secure
+
+    # --------------------------------------------------------------------------
+    def request_bytes(self) -> bytes:
+        """
+        :return: the complete HTTP/1.1 keep-alive request, ready to be written to a connection
+        """
+        parts = urlsplit(self.url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        lines = ['{} {} HTTP/1.1'.format(self.method, path)]
+        names = {name.lower() for name, _ in self.headers}
+        if 'host' not in names:
+            lines.append('Host: {}'.format(parts.netloc))
+        for name, value in self.headers:
+            lines.append('{}: {}'.format(name, value))
+        if 'content-length' not in names and (self.body or self.method in ('POST', 'PUT', 'PATCH')):
+            lines.append('Content-Length: {}'.format(len(self.body)))
+        if 'user-agent' not in names:
+            lines.append('User-Agent: {}'.format(self.user_agent))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + self.body
+
+    # --------------------------------------------------------------------------
+    def __repr__(self):
+        return '{} {}'.format(self.method, self.url)
+
+
+###############################################################################
+def read_targets(target_file: str) -> List[Target]:
+    """
+    :param target_file: a vegeta target file in http format
+    :return: the targets in the order of the file
+    """
+    targets = []
+    base_dir = os.path.dirname(os.path.abspath(target_file))
+    with open(target_file, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            method, _, rest = line.partition(' ')
+            if method in http_methods and rest:
+                targets.append(Target(method, rest.strip()))
+            elif not targets:
+                raise Exception(ErrorCode.badParameterType,
+                                "{}:{}: expected METHOD URL, got {}".format(target_file, line_no, line))
+            elif line.startswith('@'):
+                body_file = os.path.join(base_dir, line[1:].strip())
+                with open(body_file, 'rb') as body:
+                    targets[-1].body = body.read()
+            else:
+                name, colon, value = line.partition(':')
+                if not colon:
+                    raise Exception(ErrorCode.badParameterType,
+                                    "{}:{}: expected a header, got {}".format(target_file, line_no, line))
+                targets[-1].headers.append((name.strip(), value.strip()))
+
+    if not targets:
+        raise Exception(ErrorCode.emptyParameter, "No targets in {}".format(target_file))
+    return targets
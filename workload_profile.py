@@ -0,0 +1,242 @@
+"""
+Workload profiles: a weighted mix of endpoints, each with its own service level objectives.
+
+A profile is a JSON file:
+
+    {
+        "requests": 1000,
+        "seed": 0,
+        "endpoints": [
+            {"name": "version", "method": "GET", "url": "http://localhost:5555/test/version",
+             "weight": 8, "slo": ["failure<1%", "p99<50ms"]},
+            {"name": "update", "method": "POST", "url": "http://localhost:5555/test/update",
+             "headers": {"Content-Type": "application/json"},
+             "body": "{\\"account\\": ${random:1:1000}, \\"request\\": \\"${uuid}\\"}",
+             "weight": 1, "slo": ["failure<0.5%", "p99<200ms"]}
+        ]
+    }
+
+`requests` concrete requests (default 1000) are generated from the profile, every endpoint
+in proportion to its weight and evenly interleaved with the others. The url, the header
+values and the body (or the file of `body_file`) are templates:
+
+    ${seq}                  the number of the request, 0, 1, 2 ...
+    ${random:1:1000}        a random integer between 1 and 1000
+    ${uuid}                 a random UUID
+    ${choice:a|b|c}         one of a, b or c
+
+Random values are drawn from `seed`, so that the same profile always gives the same requests.
+While a step runs, its results are also broken down per endpoint, and each endpoint is held
+to its own objectives (see service_objectives.py).
+"""
+
+import re
+import json
+import uuid
+import random
+from service_objectives import Objective, parse_objective, missed_objectives
+from vegeta_stream import StreamStats
+from vegeta_targets import Target
+from utils import *
+
+
+template_field = re.compile(r'\$\{([a-z]+)(?::([^}]*))?\}')
+
+
+###############################################################################
+class Endpoint:
+    __slots__ = ('name', 'method', 'url', 'headers', 'body', 'weight', 'objectives')
+
+    # --------------------------------------------------------------------------
+    def __init__(self, name: str, method: str, url: str, headers: List[Tuple[str, str]], body: str,
+                 weight: float, objectives: List[Objective]):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.weight = weight
+        self.objectives = objectives
+
+
+###############################################################################
+class WorkloadProfile:
+    default_requests = 1000
+
+    # --------------------------------------------------------------------------
+    def __init__(self, endpoints: List[Endpoint], requests: int = None, seed: int = 0):
+        if not endpoints:
+            raise Exception(ErrorCode.emptyParameter, "The profile has no endpoints")
+        names = [endpoint.name for endpoint in endpoints]
+        if len(set(names)) != len(names):
+            raise Exception(ErrorCode.badParameterType, "Endpoint names must be unique: {}".format(names))
+        self.endpoints = endpoints
+        self.requests = max(requests or self.default_requests, len(endpoints))
+        self.seed = seed
+        self.targets = None
+        self.target_endpoints = None
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def load(cls, profile_file: str) -> 'WorkloadProfile':
+        base_dir = os.path.dirname(os.path.abspath(profile_file))
+        try:
+            with open(profile_file, 'r') as f:
+                profile = json.load(f)
+            endpoints = []
+            for i, item in enumerate(profile['endpoints']):
+                body = item.get('body', '')
+                if 'body_file' in item:
+                    with open(os.path.join(base_dir, item['body_file']), 'r') as body_file:
+                        body = body_file.read()
+                weight = float(item.get('weight', 1.0))
+                if weight <= 0:
+                    raise ValueError('the weight of endpoint {} must be positive'.format(i))
+                endpoints.append(Endpoint(item.get('name', str(i)), item.get('method', 'GET').upper(), item['url'],
+                                          list(item.get('headers', {}).items()), body, weight,
+                                          [parse_objective(text) for text in item.get('slo', [])]))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise Exception(ErrorCode.badParameterType, "Bad profile {}: {}".format(profile_file, e))
+        return cls(endpoints, profile.get('requests'), profile.get('seed', 0))
+
+    # --------------------------------------------------------------------------
+    def schedule(self) -> List[int]:
+        """
+        :return: the endpoint of each request, in proportion to the weights and evenly spread
+                 (smooth weighted round-robin)
+        """
+        total = sum(endpoint.weight for endpoint in self.endpoints)
+        current = [0.0] * len(self.endpoints)
+        order = []
+        for _ in range(self.requests):
+            for i, endpoint in enumerate(self.endpoints):
+                current[i] += endpoint.weight
+            chosen = max(range(len(current)), key=current.__getitem__)
+            current[chosen] -= total
+            order.append(chosen)
+        return order
+
+    # --------------------------------------------------------------------------
+    def materialize(self) -> List[Target]:
+        """
+        Generate the concrete requests of the profile. target_endpoints gives the endpoint of each
+        """
+        if self.targets is None:
+            generator = random.Random(self.seed)
+
+            def expand(template: str, seq: int) -> str:
+                def field(match):
+                    name, argument = match.group(1), match.group(2)
+                    if name == 'seq':
+                        return str(seq)
+                    if name == 'random':
+                        low, _, high = (argument or '0:1000000').partition(':')
+                        return str(generator.randint(int(low), int(high)))
+                    if name == 'uuid':
+                        return str(uuid.UUID(int=generator.getrandbits(128), version=4))
+                    if name == 'choice':
+                        return generator.choice(argument.split('|'))
+                    raise Exception(ErrorCode.badParameterType, "Unknown template field {}".format(match.group(0)))
+                return template_field.sub(field, template)
+
+            self.target_endpoints = self.schedule()
+            self.targets = []
+            for seq, index in enumerate(self.target_endpoints):
+                endpoint = self.endpoints[index]
+                self.targets.append(Target(endpoint.method, expand(endpoint.url, seq),
+                                           [(name, expand(str(value), seq)) for name, value in endpoint.headers],
+                                           expand(endpoint.body, seq).encode('utf-8')))
+        return self.targets
+
+    # --------------------------------------------------------------------------
+    def write_target_file(self, target_dir: str) -> str:
+        """
+        Write the generated requests as a vegeta target file, with one file per distinct body
+        :return: the target file
+        """
+        target_file = os.path.join(target_dir, 'profile_targets.txt')
+        bodies = {}
+        with open(target_file, 'w', encoding='utf-8') as f:
+            for target in self.materialize():
+                f.write('{} {}\n'.format(target.method, target.url))
+                for name, value in target.headers:
+                    f.write('{}: {}\n'.format(name, value))
+                if target.body:
+                    if target.body not in bodies:
+                        bodies[target.body] = os.path.join(target_dir, 'body_{}'.format(len(bodies)))
+                        with open(bodies[target.body], 'wb') as body_file:
+                            body_file.write(target.body)
+                    f.write('@{}\n'.format(bodies[target.body]))
+                f.write('\n')
+        return target_file
+
+    # --------------------------------------------------------------------------
+    def endpoint_stats(self) -> 'EndpointStats':
+        return EndpointStats(self)
+
+    # --------------------------------------------------------------------------
+    def missed_objectives(self, endpoint_reports: dict) -> List[Tuple[str, Objective, float]]:
+        """
+        :param endpoint_reports: the reports of a step per endpoint name
+        :return: (endpoint, objective, severity) of every objective missed, the worst first
+        """
+        missed = []
+        for endpoint in self.endpoints:
+            report = endpoint_reports.get(endpoint.name)
+            if report is not None and report['requests'] > 0:
+                missed += [(endpoint.name, objective, severity)
+                           for objective, severity in missed_objectives(endpoint.objectives, report)]
+        return sorted(missed, key=lambda item: -item[2])
+
+
+###############################################################################
+class EndpointStats:
+    """
+    The results of one step broken down per endpoint of a profile
+    """
+
+    # --------------------------------------------------------------------------
+    def __init__(self, profile: WorkloadProfile):
+        self.profile = profile
+        self.stats = [StreamStats() for _ in profile.endpoints]
+        self.keys = None
+
+    # --------------------------------------------------------------------------
+    def target_stats(self) -> List[StreamStats]:
+        """
+        :return: the statistics of the endpoint of each generated request, for AsyncAttackEngine
+        """
+        return [self.stats[index] for index in self.profile.target_endpoints]
+
+    # --------------------------------------------------------------------------
+    def split(self, results: Iterable[dict]) -> Iterator[dict]:
+        """
+        Pass-through stage of the vegeta result pipeline: every result is also added to the
+        statistics of its endpoint, which is known by its method and url
+        """
+        if self.keys is None:
+            self.keys = {}
+            for target, index in zip(self.profile.materialize(), self.profile.target_endpoints):
+                other = self.keys.setdefault((target.method, target.url), index)
+                if other != index:
+                    raise Exception(ErrorCode.badParameterType,
+                                    "Endpoints {} and {} both send {} {}; vegeta's results cannot tell them apart"
+                                    .format(self.profile.endpoints[other].name, self.profile.endpoints[index].name,
+                                            target.method, target.url))
+        for result in results:
+            index = self.keys.get((result.get('method'), result.get('url')))
+            if index is not None:
+                self.stats[index].add(result)
+            yield result
+
+    # --------------------------------------------------------------------------
+    def reports(self) -> dict:
+        """
+        :return: the report of each endpoint by name, without the histograms
+        """
+        reports = {}
+        for endpoint, stats in zip(self.profile.endpoints, self.stats):
+            report = stats.report()
+            del report['histogram']
+            reports[endpoint.name] = report
+        return reports